@@ -1,10 +1,122 @@
+import os
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
 from database import db
+from export import export_table, EXPORT_FORMATS
+from backup import backup_service
+from retention import retention_service, RETENTION_MESSAGES_DAYS, RETENTION_SESSIONS_DAYS
+from telemetry import telemetry
 import plotly.express as px
 import plotly.graph_objects as go
 
+# Seconds the dashboard may keep cached data. Loaders are also keyed on
+# db.data_version(), so new messages, sessions and logins show up on the next rerun
+ADMIN_CACHE_TTL = 60
+# Results kept per loader (older data versions age out first)
+ADMIN_CACHE_MAX_ENTRIES = 50
+
+# Messages shown per page in the "User Messages" browser
+MESSAGES_PAGE_SIZE = 20
+
+# Gemini prices in USD per million tokens, for cost estimates
+PRICE_INPUT_PER_MTOK = float(os.getenv("GEMINI_PRICE_INPUT_PER_MTOK", "0.075"))
+PRICE_OUTPUT_PER_MTOK = float(os.getenv("GEMINI_PRICE_OUTPUT_PER_MTOK", "0.30"))
+
+# Time range selector: label -> (days, bucket)
+TIME_RANGES = {
+    "Last 24 hours": (1, 'hour'),
+    "Last 7 days": (7, 'day'),
+    "Last 30 days": (30, 'day'),
+    "Last 90 days": (90, 'week'),
+    "Last 12 months": (365, 'month'),
+}
+
+@st.cache_data(ttl=ADMIN_CACHE_TTL, max_entries=ADMIN_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_user_stats(version):
+    return db.get_user_stats()
+
+@st.cache_data(ttl=ADMIN_CACHE_TTL, max_entries=ADMIN_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_activity(version, days, bucket):
+    return pd.DataFrame(db.get_activity_buckets(days=days, bucket=bucket))
+
+@st.cache_data(ttl=ADMIN_CACHE_TTL, max_entries=ADMIN_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_recent_users(version, limit=20):
+    return db.get_all_users(limit=limit)
+
+@st.cache_data(ttl=ADMIN_CACHE_TTL, max_entries=ADMIN_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_notice_usage(version, days=None):
+    return pd.DataFrame(db.get_notice_usage(days=days))
+
+@st.cache_data(ttl=ADMIN_CACHE_TTL, max_entries=ADMIN_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_user_messages_page(version, user_id, cursor=None, page_size=MESSAGES_PAGE_SIZE):
+    return db.get_messages_page(cursor=cursor, page_size=page_size, user_id=user_id)
+
+@st.cache_data(ttl=ADMIN_CACHE_TTL, max_entries=ADMIN_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_search_results(version, query, notice=None, since=None):
+    return db.search_messages(query, notice=notice, since=since, limit=50)
+
+@st.cache_data(ttl=ADMIN_CACHE_TTL, max_entries=ADMIN_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_token_usage(version, days, group_by):
+    usage_df = pd.DataFrame(db.get_token_usage(days=days, group_by=group_by))
+    if not usage_df.empty:
+        usage_df['tokens'] = usage_df['prompt_tokens'] + usage_df['response_tokens']
+        usage_df['cost_usd'] = (usage_df['prompt_tokens'] * PRICE_INPUT_PER_MTOK
+                                + usage_df['response_tokens'] * PRICE_OUTPUT_PER_MTOK) / 1_000_000
+    return usage_df
+
+def invalidate_admin_cache():
+    """Drop cached dashboard data; call after writes that change it"""
+    for loader in (load_user_stats, load_activity, load_recent_users,
+                   load_notice_usage, load_user_messages_page, load_search_results,
+                   load_token_usage):
+        loader.clear()
+
+@st.fragment(run_every=2)
+def show_backup_status():
+    """Progress of the background backup, refreshed without rerunning the page"""
+    job = backup_service.status()
+    if not job:
+        return
+    if job['state'] == 'running':
+        st.progress(job['progress'], text=f"Backing up... {job['progress']:.0%}")
+    elif job['state'] == 'done':
+        st.success(f"✅ Backup created: {job['path']}")
+    else:
+        st.error(f"❌ Error creating backup: {job['error']}")
+
+@st.fragment(run_every=2)
+def show_archive_status():
+    """Progress of the background archival, refreshed without rerunning the page"""
+    job = retention_service.status()
+    if not job:
+        return
+    if job['state'] == 'running':
+        st.progress(job['progress'], text=f"Archiving... {job['rows_done']} rows")
+    elif job['state'] == 'done':
+        # Archived rows leave the dashboard queries: drop their cached results once
+        if st.session_state.get('archive_invalidated') != job['started_at']:
+            invalidate_admin_cache()
+            st.session_state.archive_invalidated = job['started_at']
+        result = job['result']
+        st.success(f"✅ Archived {sum(result['messages'].values())} messages and "
+                   f"{sum(result['user_sessions'].values())} sessions; "
+                   f"{result['vacuum']['released']} pages released")
+    else:
+        st.error(f"❌ Error archiving: {job['error']}")
+
+def latency_frame(stats):
+    """Per-stage latency summary in milliseconds, slowest p95 first"""
+    rows = [
+        {'stage': name, 'count': summary['count'],
+         'p50': summary['p50'] * 1000, 'p95': summary['p95'] * 1000,
+         'p99': summary['p99'] * 1000, 'max': summary['max'] * 1000}
+        for name, summary in stats.items()
+    ]
+    if not rows:
+        return pd.DataFrame(columns=['stage', 'count', 'p50', 'p95', 'p99', 'max'])
+    return pd.DataFrame(rows).sort_values('p95', ascending=False)
+
 def show_admin_page():
     """Admin dashboard to view user and usage statistics"""
     
@@ -16,8 +128,19 @@ def show_admin_page():
         st.error("❌ Você precisa estar logado para acessar esta página.")
         return
     
+    col_range, col_refresh = st.columns([3, 1])
+    with col_range:
+        range_label = st.selectbox("Time range:", list(TIME_RANGES), index=1)
+    with col_refresh:
+        st.write("")
+        if st.button("🔄 Refresh data", help="Re-query everything (new activity already refreshes the data)"):
+            invalidate_admin_cache()
+    range_days, range_bucket = TIME_RANGES[range_label]
+    # Part of every loader's cache key: activity since the last rerun re-queries
+    data_version = db.data_version()
+    
     # Get statistics
-    stats = db.get_user_stats()
+    stats = load_user_stats(data_version)
     
     # Overview metrics
     col1, col2, col3, col4 = st.columns(4)
@@ -37,6 +160,19 @@ def show_admin_page():
     
     st.markdown("---")
     
+    # Activity over the selected range (bucketed in SQL)
+    st.subheader(f"📈 Activity ({range_label})")
+    activity_df = load_activity(data_version, range_days, range_bucket)
+    
+    if not activity_df.empty:
+        fig = px.line(activity_df, x='bucket', y=['messages', 'active_users'],
+                      title=f"Messages and Active Users per {range_bucket.capitalize()}", markers=True)
+        fig.update_xaxes(title=range_bucket.capitalize())
+        fig.update_yaxes(title="Count")
+        st.plotly_chart(fig, use_container_width=True)
+    else:
+        st.info("No activity in the selected range.")
+    
     # Domain distribution
     st.subheader("👥 Users by Domain")
     if stats['domain_stats']:
@@ -51,7 +187,7 @@ def show_admin_page():
     
     # Recent users table
     st.subheader("👤 Recent Users")
-    users = db.get_all_users(limit=20)
+    users = load_recent_users(data_version, limit=20)
     
     if users:
         users_df = pd.DataFrame(users)
@@ -69,12 +205,10 @@ def show_admin_page():
         st.info("No users found.")
     
     # Notice usage
-    st.subheader("📋 Notice Usage Statistics")
-    notice_usage = db.get_notice_usage()
+    st.subheader(f"📋 Notice Usage Statistics ({range_label})")
+    notice_df = load_notice_usage(data_version, days=range_days)
     
-    if notice_usage:
-        notice_df = pd.DataFrame(notice_usage)
-        
+    if not notice_df.empty:
         fig = px.bar(notice_df, x='notice_context', y='usage_count',
                     title="Most Consulted Notices")
         fig.update_xaxes(title="Notice")
@@ -86,6 +220,44 @@ def show_admin_page():
     else:
         st.info("No notice usage data available yet.")
     
+    # Token usage and estimated cost (from the daily rollups)
+    st.subheader(f"💰 Token Usage & Cost ({range_label})")
+    daily_usage_df = load_token_usage(data_version, max(range_days, 1), 'day')
+    
+    if not daily_usage_df.empty:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Tokens", f"{int(daily_usage_df['tokens'].sum()):,}")
+        with col2:
+            st.metric("Estimated Cost", f"US$ {daily_usage_df['cost_usd'].sum():.2f}")
+        with col3:
+            avg_latency = daily_usage_df['avg_model_latency_ms'].dropna().mean()
+            st.metric("Avg Model Latency", f"{avg_latency:.0f} ms" if pd.notna(avg_latency) else "-")
+        
+        fig = px.bar(daily_usage_df, x='day', y=['prompt_tokens', 'response_tokens'],
+                     title="Tokens per Day")
+        fig.update_yaxes(title="Tokens")
+        st.plotly_chart(fig, use_container_width=True)
+        
+        fig = px.line(daily_usage_df, x='day', y='cost_usd', markers=True,
+                      title="Estimated Cost per Day (US$)")
+        st.plotly_chart(fig, use_container_width=True)
+        
+        fig = px.line(daily_usage_df, x='day', y='avg_model_latency_ms', markers=True,
+                      title="Average Model Latency per Day (ms)")
+        st.plotly_chart(fig, use_container_width=True)
+        
+        notice_cost_df = load_token_usage(data_version, max(range_days, 1), 'notice')
+        fig = px.bar(notice_cost_df.sort_values('cost_usd', ascending=False),
+                     x='notice', y='cost_usd', title="Estimated Cost per Notice (US$)")
+        st.plotly_chart(fig, use_container_width=True)
+        
+        st.markdown("**Top users by tokens**")
+        user_cost_df = load_token_usage(data_version, max(range_days, 1), 'user')
+        st.dataframe(user_cost_df.head(20), use_container_width=True, hide_index=True)
+    else:
+        st.info("No token usage recorded in the selected range.")
+    
     # User messages (for selected user)
     st.subheader("💬 User Messages")
     
@@ -99,7 +271,13 @@ def show_admin_page():
             selected_email = selected_user_display.split('(')[1].split(')')[0]
             selected_user = next(user for user in users if user['email'] == selected_email)
             
-            messages = db.get_user_messages(selected_user['id'])
+            # Keyset pagination: stack of the cursors of the pages visited so far
+            if st.session_state.get('messages_page_user') != selected_user['id']:
+                st.session_state.messages_page_user = selected_user['id']
+                st.session_state.messages_page_cursors = [None]
+            cursors = st.session_state.messages_page_cursors
+            
+            messages, next_cursor = load_user_messages_page(data_version, selected_user['id'], cursors[-1])
             
             if messages:
                 st.write(f"**Messages for {selected_user['name']}:**")
@@ -108,30 +286,142 @@ def show_admin_page():
                     with st.expander(f"📅 {msg['timestamp']} - Notice: {msg['notice_context'] or 'N/A'}"):
                         st.write("**User:**", msg['user_message'])
                         st.write("**Bot:**", msg['bot_response'])
+                
+                col_newer, col_page, col_older = st.columns([1, 2, 1])
+                with col_newer:
+                    if st.button("⬅️ Newer", disabled=len(cursors) == 1):
+                        cursors.pop()
+                        st.rerun()
+                with col_page:
+                    st.caption(f"Page {len(cursors)} · {MESSAGES_PAGE_SIZE} messages per page")
+                with col_older:
+                    if st.button("Older ➡️", disabled=next_cursor is None):
+                        cursors.append(next_cursor)
+                        st.rerun()
             else:
                 st.info("No messages found for this user.")
     
+    # Full-text search over all conversations
+    st.subheader("🔎 Search Conversations")
+    
+    col_query, col_notice, col_since = st.columns([3, 2, 2])
+    with col_query:
+        search_query = st.text_input("Search questions and answers:", placeholder="e.g. prazo de inscrição")
+    with col_notice:
+        notice_options = ["All notices"] + (notice_df['notice_context'].tolist() if not notice_df.empty else [])
+        search_notice = st.selectbox("Notice:", notice_options)
+    with col_since:
+        search_since = st.date_input("Since:", value=None)
+    
+    if search_query:
+        results = load_search_results(
+            data_version,
+            search_query,
+            notice=None if search_notice == "All notices" else search_notice,
+            since=search_since.isoformat() if search_since else None,
+        )
+        
+        if results:
+            st.write(f"**{len(results)} matching messages** (best matches first):")
+            for result in results:
+                with st.expander(f"📅 {result['timestamp']} - {result['name']} - Notice: {result['notice_context'] or 'N/A'}"):
+                    st.markdown(f"**User:** {result['question_snippet']}")
+                    st.markdown(f"**Bot:** {result['response_snippet']}")
+        else:
+            st.info("No messages match this search.")
+    
+    # Data export (streamed to a file in chunks)
+    st.markdown("---")
+    st.subheader("📤 Export Data")
+    
+    col_table, col_format, col_from, col_to = st.columns(4)
+    with col_table:
+        export_table_name = st.selectbox("Table:", sorted(db.EXPORT_TABLES))
+    with col_format:
+        export_format = st.selectbox("Format:", EXPORT_FORMATS, index=EXPORT_FORMATS.index('parquet'))
+    with col_from:
+        export_since = st.date_input("From:", value=None, key="export_since")
+    with col_to:
+        export_until = st.date_input("Until (exclusive):", value=None, key="export_until")
+    
+    export_notice = None
+    if export_table_name == 'messages':
+        export_notice_choice = st.selectbox("Notice:", notice_options, key="export_notice")
+        export_notice = None if export_notice_choice == "All notices" else export_notice_choice
+    
+    if st.button("📤 Export"):
+        try:
+            with st.spinner("Exporting..."):
+                result = export_table(
+                    export_table_name,
+                    fmt=export_format,
+                    since=export_since.isoformat() if export_since else None,
+                    until=export_until.isoformat() if export_until else None,
+                    notice=export_notice,
+                )
+            st.success(f"✅ {result['rows']} rows exported to {result['path']} ({result['bytes'] / 1024:.1f} KB)")
+            st.session_state.last_export = result
+        except Exception as e:
+            st.error(f"❌ Error exporting data: {str(e)}")
+    
+    # The file is only read when asked for, not on every rerun of the page
+    last_export = st.session_state.get('last_export')
+    if last_export and last_export['bytes'] <= 50 * 1024 * 1024:
+        if st.button("📦 Prepare download of last export"):
+            with open(last_export['path'], 'rb') as f:
+                st.download_button("⬇️ Download last export", f,
+                                   file_name=os.path.basename(last_export['path']))
+    
+    # Latency per stage (this process, in-memory)
+    st.markdown("---")
+    st.subheader("⏱️ Performance")
+    stage_df = latency_frame(telemetry.stage_stats())
+    request_df = latency_frame(telemetry.request_stats())
+    
+    if not stage_df.empty:
+        fig = px.bar(stage_df, x='stage', y=['p50', 'p95', 'p99'], barmode='group',
+                     title="Latency per Stage (ms)")
+        fig.update_yaxes(title="Milliseconds")
+        st.plotly_chart(fig, use_container_width=True)
+        st.dataframe(stage_df.round(1), use_container_width=True, hide_index=True)
+    else:
+        st.info("No timings recorded yet in this process.")
+    
+    if not request_df.empty:
+        st.dataframe(request_df.rename(columns={'stage': 'request'}).round(1),
+                     use_container_width=True, hide_index=True)
+    
+    with st.expander("Component metrics"):
+        st.json(telemetry.gauges())
+    
     # Database management
     st.markdown("---")
     st.subheader("🔧 Database Management")
     
-    col1, col2 = st.columns(2)
+    col1, col2, col3 = st.columns(3)
+    # Backups and archives copy the SQLite file; PostgreSQL has its own tooling (pg_dump)
+    file_tools = db.backend == 'sqlite'
     
     with col1:
-        if st.button("📦 Create Backup"):
-            try:
-                backup_path = db.backup_database()
-                st.success(f"✅ Backup created: {backup_path}")
-            except Exception as e:
-                st.error(f"❌ Error creating backup: {str(e)}")
+        if st.button("📦 Create Backup", disabled=backup_service.is_running() or not file_tools):
+            backup_service.start_backup()
+        show_backup_status()
     
     with col2:
         if st.button("🧹 Cleanup Old Sessions"):
             try:
                 db.cleanup_old_sessions(days=30)
+                invalidate_admin_cache()
                 st.success("✅ Old sessions cleaned up (30+ days)")
             except Exception as e:
                 st.error(f"❌ Error cleaning up: {str(e)}")
+    
+    with col3:
+        if st.button("🗄️ Archive Old Data", disabled=retention_service.is_running() or not file_tools,
+                     help=f"Move messages older than {RETENTION_MESSAGES_DAYS} days and sessions older "
+                          f"than {RETENTION_SESSIONS_DAYS} days to monthly archives"):
+            retention_service.start_run()
+        show_archive_status()
 
 
 def main():
@@ -3,7 +3,12 @@ from dotenv import load_dotenv
 import streamlit as st
 import streamlit.components.v1 as components
 import google.generativeai as gpt
-from functions import map_role, fetch_gemini_response, get_available_editais, register_user_login, end_user_session, save_user_message
+from history import ConversationHistory, model_summarizer
+from gemini_scheduler import GeminiOverloadedError
+from telemetry import telemetry
+from oauth_state import oauth_state_store
+from oauth_client import oauth_client
+from functions import map_role, fetch_gemini_response, summary_generator, stream_gemini_response, get_available_editais, register_user_login, end_user_session, save_user_message, touch_user_session, TokenQuotaExceededError
 import re
 import json
 import base64
@@ -11,7 +16,6 @@ import hashlib
 import secrets
 from urllib.parse import urlencode
 import requests
-import tempfile
 import time
 
 st.set_page_config(
@@ -33,6 +37,9 @@ GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID") or st.secrets.get("GOOGLE_CLIEN
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET") or st.secrets.get("GOOGLE_CLIENT_SECRET")
 REDIRECT_URI = os.getenv("REDIRECT_URI", "http://localhost:8502")
 
+# Exibir a resposta do Gemini à medida que é gerada (desative com STREAM_RESPONSES=false)
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() != "false"
+
 if not GOOGLE_CLIENT_ID or not GOOGLE_CLIENT_SECRET:
     st.error("❌ Credenciais do Google OAuth não encontradas.")
     st.info("Configure as variáveis de ambiente:")
@@ -65,68 +72,25 @@ def is_admin_user(email):
     """Verifica se o usuário é um administrador autorizado"""
     return email.lower() in [admin.lower() for admin in ADMIN_EMAILS]
 
-def save_oauth_state(state):
-    """Salva o estado OAuth em um arquivo temporário"""
-    temp_dir = tempfile.gettempdir()
-    state_file = os.path.join(temp_dir, f"streamlit_oauth_state_{state}.txt")
-    try:
-        with open(state_file, 'w') as f:
-            f.write(f"{time.time()},{state}")
-        return state_file
-    except Exception as e:
-        st.error(f"❌ Erro ao salvar estado OAuth: {str(e)}")
-        return None
-
 def validate_oauth_state(state):
-    """Valida o estado OAuth verificando se existe e não expirou"""
+    """Valida (e consome) o estado OAuth: precisa existir e não ter expirado"""
     if not state:
         return False
-        
-    temp_dir = tempfile.gettempdir()
-    state_file = os.path.join(temp_dir, f"streamlit_oauth_state_{state}.txt")
-    
-    if not os.path.exists(state_file):
-        return False
-    
-    try:
-        with open(state_file, 'r') as f:
-            content = f.read().strip()
-            if ',' not in content:
-                # Formato antigo, remover arquivo
-                os.remove(state_file)
-                return False
-            
-            timestamp_str, saved_state = content.split(',', 1)
-            timestamp = float(timestamp_str)
-        
-        # Verificar se o state bate
-        if saved_state != state:
-            os.remove(state_file)
-            return False
-        
-        # Verificar se não expirou (15 minutos)
-        if time.time() - timestamp > 900:
-            os.remove(state_file)
-            return False
-        
-        # Remover arquivo após validação bem-sucedida
-        os.remove(state_file)
-        return True
-    except Exception as e:
-        # Em caso de erro, remover arquivo e retornar False
-        try:
-            if os.path.exists(state_file):
-                os.remove(state_file)
-        except:
-            pass
-        return False
+    return oauth_state_store.consume(state)
+
+def get_oauth_state():
+    """Estado OAuth desta sessão do navegador, gerado uma única vez (renovado se expirar)"""
+    issued = st.session_state.get('oauth_state')
+    # Renova com folga para não enviar um estado prestes a expirar
+    if not issued or issued[1] - time.time() < 60:
+        state = secrets.token_urlsafe(32)
+        issued = (state, oauth_state_store.put(state))
+        st.session_state.oauth_state = issued
+    return issued[0]
 
 def generate_auth_url():
     """Gera a URL de autenticação do Google OAuth"""
-    state = secrets.token_urlsafe(32)
-    
-    # Salvar estado em arquivo temporário
-    save_oauth_state(state)
+    state = get_oauth_state()
     
     params = {
         'client_id': GOOGLE_CLIENT_ID,
@@ -139,40 +103,27 @@ def generate_auth_url():
         'hd': 'unirio.br,edu.unirio.br,uniriotec.br'  # Restringe aos domínios da UNIRIO
     }
     
-    auth_url = f"https://accounts.google.com/o/oauth2/auth?{urlencode(params)}"
+    auth_url = f"{oauth_client.auth_url}?{urlencode(params)}"
     return auth_url
 
+@telemetry.timed('oauth_token')
 def exchange_code_for_token(code, state):
     """Troca o código de autorização por um token de acesso"""
     if not validate_oauth_state(state):
         st.error("❌ Estado OAuth inválido ou expirado. Tente novamente.")
         return None
     
-    token_url = "https://oauth2.googleapis.com/token"
-    data = {
-        'client_id': GOOGLE_CLIENT_ID,
-        'client_secret': GOOGLE_CLIENT_SECRET,
-        'code': code,
-        'grant_type': 'authorization_code',
-        'redirect_uri': REDIRECT_URI
-    }
-    
     try:
-        response = requests.post(token_url, data=data)
-        response.raise_for_status()
-        return response.json()
+        return oauth_client.exchange_code(code, GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, REDIRECT_URI)
     except requests.RequestException as e:
         st.error(f"❌ Erro ao trocar código por token: {str(e)}")
         return None
 
+@telemetry.timed('oauth_userinfo')
 def get_user_info(access_token):
     """Obtém informações do usuário usando o token de acesso"""
-    user_info_url = f"https://www.googleapis.com/oauth2/v2/userinfo?access_token={access_token}"
-    
     try:
-        response = requests.get(user_info_url)
-        response.raise_for_status()
-        return response.json()
+        return oauth_client.get_user_info(access_token)
     except requests.RequestException as e:
         st.error(f"❌ Erro ao obter informações do usuário: {str(e)}")
         return None
@@ -192,39 +143,40 @@ def authenticate_with_google():
         state = query_params['state']
         
         # Trocar código por token
-        token_data = exchange_code_for_token(code, state)
+        with telemetry.trace('login'):
+            token_data = exchange_code_for_token(code, state)
+            user_info = None
+            if token_data and 'access_token' in token_data:
+                # Obter informações do usuário
+                user_info = get_user_info(token_data['access_token'])
         
-        if token_data and 'access_token' in token_data:
-            # Obter informações do usuário
-            user_info = get_user_info(token_data['access_token'])
+        if user_info:
+            email = user_info.get('email', '')
+            name = user_info.get('name', '')
             
-            if user_info:
-                email = user_info.get('email', '')
-                name = user_info.get('name', '')
+            # Verificar se o email é de um domínio permitido
+            if is_allowed_domain(email):
+                st.session_state.authenticated = True
+                st.session_state.user_email = email
+                st.session_state.user_name = name
+                st.session_state.user_picture = user_info.get('picture', '')
+                
+                # Registrar usuário no banco de dados
+                register_user_login(email, name, user_info.get('picture', ''))
                 
-                # Verificar se o email é de um domínio permitido
-                if is_allowed_domain(email):
-                    st.session_state.authenticated = True
-                    st.session_state.user_email = email
-                    st.session_state.user_name = name
-                    st.session_state.user_picture = user_info.get('picture', '')
-                    
-                    # Registrar usuário no banco de dados
-                    register_user_login(email, name, user_info.get('picture', ''))
-                    
-                    # Limpar parâmetros da URL
+                # Limpar parâmetros da URL
+                st.query_params.clear()
+                st.success(f"✅ Bem-vindo(a), {name}!")
+                st.rerun()
+            else:
+                st.error("❌ **Acesso Negado**")
+                st.warning(f"O email `{email}` não pertence aos domínios autorizados da UNIRIO.")
+                st.info("Apenas emails dos domínios @edu.unirio.br, @uniriotec.br e @unirio.br são permitidos.")
+                
+                if st.button("🔄 Tentar Novamente"):
                     st.query_params.clear()
-                    st.success(f"✅ Bem-vindo(a), {name}!")
                     st.rerun()
-                else:
-                    st.error("❌ **Acesso Negado**")
-                    st.warning(f"O email `{email}` não pertence aos domínios autorizados da UNIRIO.")
-                    st.info("Apenas emails dos domínios @edu.unirio.br, @uniriotec.br e @unirio.br são permitidos.")
-                    
-                    if st.button("🔄 Tentar Novamente"):
-                        st.query_params.clear()
-                        st.rerun()
-                    return False
+                return False
     
     # Mostrar tela de login
     st.markdown("""
@@ -289,6 +241,9 @@ if not authenticate_with_google():
 
 # Usuário autenticado e autorizado - continuar com a aplicação
 
+# Registrar atividade da sessão (em memória; gravada em lote)
+touch_user_session()
+
 # Configurar a API do Gemini
 gpt.configure(api_key=API_KEY)
 model = gpt.GenerativeModel('gemini-1.5-flash')
@@ -305,6 +260,15 @@ st.markdown("""
 if "chat_session" not in st.session_state:
     st.session_state.chat_session = model.start_chat(history=[])
 
+# Histórico limitado: últimas mensagens literais + resumo das anteriores
+if "history" not in st.session_state:
+    summarizer = model_summarizer(summary_generator(model)) if os.getenv("HISTORY_SUMMARIZER") == "model" else None
+    st.session_state.history = ConversationHistory(
+        max_turns=int(os.getenv("HISTORY_MAX_TURNS", "8")),
+        summary_tokens=int(os.getenv("HISTORY_SUMMARY_TOKENS", "300")),
+        summarizer=summarizer,
+    )
+
 # Sidebar
 st.sidebar.image("logo.png", width=200, use_container_width="True")
 
@@ -419,25 +383,46 @@ if st.session_state.get('admin_mode', False):
 col1, col2 = st.columns([1, 3], gap="large")
 
 # Exibir mensagem de boas-vindas se não houver histórico
-if len(st.session_state.chat_session.history) == 0:
+history = st.session_state.history
+
+if len(history) == 0:
     with st.chat_message("assistant"):
         st.markdown("👋 Olá! Eu sou o **EditalBot da UNIRIO**! Como posso te ajudar hoje? Você pode me fazer perguntas sobre editais, concursos, processos seletivos e muito mais!")
 
-for msg in st.session_state.chat_session.history:
-    with st.chat_message(map_role(msg["role"])):
-        st.markdown(msg["content"])
+if history.summarized_count:
+    st.caption(f"🗂️ {history.summarized_count} mensagens anteriores foram resumidas para manter a conversa leve.")
+
+for turn in history:
+    with st.chat_message(map_role(turn.role)):
+        st.markdown(turn.content)
 
 
 user_input = st.chat_input("")
 if user_input:
-    st.chat_message("user").markdown(user_input)
-    gemini_response = fetch_gemini_response(user_input)
-
-    with st.chat_message("assistant"):
-        st.markdown(gemini_response)
-
-    # Salvar mensagem no banco de dados
-    save_user_message(user_input, gemini_response, selected_edital)
-
-    st.session_state.chat_session.history.append({"role": "user", "content": user_input})
-    st.session_state.chat_session.history.append({"role": "model", "content": gemini_response})
+    with telemetry.trace('chat_turn', user=current_user_email, notice=selected_edital):
+        st.chat_message("user").markdown(user_input)
+
+        gemini_response = None
+        usage = None
+        with st.chat_message("assistant"):
+            try:
+                if STREAM_RESPONSES:
+                    response_stream = stream_gemini_response(user_input, notice=selected_edital, history=history)
+                    st.write_stream(response_stream)
+                    gemini_response = response_stream.text
+                    usage = response_stream.usage
+                else:
+                    gemini_response, usage = fetch_gemini_response(user_input, notice=selected_edital,
+                                                                   history=history)
+                    with telemetry.stage('render'):
+                        st.markdown(gemini_response)
+            except GeminiOverloadedError:
+                st.warning("⏳ O EditalBot está recebendo muitas perguntas agora. Aguarde alguns segundos e tente novamente.")
+            except TokenQuotaExceededError:
+                st.warning("🚦 Você atingiu o limite diário de uso do EditalBot. Tente novamente amanhã.")
+
+        if gemini_response:
+            # Salvar mensagem no banco de dados (com o consumo de tokens)
+            save_user_message(user_input, gemini_response, selected_edital, usage=usage)
+
+            history.add_exchange(user_input, gemini_response)
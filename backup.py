@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Online backups of editalbot.db
+
+Backups run on a background thread and copy the database in page-limited
+steps, sleeping between steps, so the app keeps reading and writing while a
+backup is in progress. The copy holds one read snapshot from start to end
+(see Database.backup_database), so concurrent writes never restart it and
+the backup reflects the database as of the moment it started. After each backup, older files are gzip-compressed
+and pruned with a snapshot (grandfather-father-son) retention policy: the
+newest backup of each of the last N days, weeks and months is kept.
+
+Usage:
+    python backup.py            # run a backup in the foreground and rotate
+    python backup.py --rotate   # only compress/prune existing backups
+"""
+
+import argparse
+import gzip
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_NAME_RE = re.compile(r"^editalbot_backup_(\d{8}_\d{6})\.db(\.gz)?$")
+
+
+class BackupService:
+    """Runs non-blocking, throttled backups and rotates old backup files"""
+
+    def __init__(self, database, backup_dir: str = BACKUP_DIR, pages_per_step: int = 256,
+                 step_delay: float = 0.02, keep_uncompressed: int = 2,
+                 keep_daily: int = 7, keep_weekly: int = 4, keep_monthly: int = 6):
+        self.database = database
+        self.backup_dir = backup_dir
+        self.pages_per_step = pages_per_step
+        self.step_delay = step_delay
+        self.keep_uncompressed = keep_uncompressed
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self.keep_monthly = keep_monthly
+        self._lock = threading.Lock()
+        self._thread = None
+        self._job: Dict = {}
+
+    def status(self) -> Dict:
+        """Return the state of the current or last backup job"""
+        with self._lock:
+            return dict(self._job)
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start_backup(self) -> Dict:
+        """Start a backup on a background thread (no-op if one is running)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return dict(self._job)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            self._job = {
+                'state': 'running',
+                'path': os.path.join(self.backup_dir, f"editalbot_backup_{timestamp}.db"),
+                'progress': 0.0,
+                'pages_total': None,
+                'pages_remaining': None,
+                'started_at': time.time(),
+                'finished_at': None,
+                'error': None,
+            }
+            self._thread = threading.Thread(target=self._run, name="db-backup", daemon=True)
+            self._thread.start()
+            return dict(self._job)
+
+    def run_backup(self, path: str = None) -> str:
+        """Run a throttled backup in the calling thread and return its path"""
+        if path is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            path = os.path.join(self.backup_dir, f"editalbot_backup_{timestamp}.db")
+        self._copy(path)
+        return path
+
+    def _progress(self, status, remaining, total):
+        with self._lock:
+            self._job['pages_total'] = total
+            self._job['pages_remaining'] = remaining
+            self._job['progress'] = (total - remaining) / total if total else 1.0
+        # Give writers room between steps
+        if remaining and self.step_delay:
+            time.sleep(self.step_delay)
+
+    def _copy(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        partial = path + ".partial"
+        # Dedicated connections under one read snapshot: the copy never ties up
+        # a pooled app connection and isn't restarted by concurrent writes
+        self.database.backup_database(partial, pages=self.pages_per_step, progress=self._progress)
+        os.replace(partial, path)
+
+    def _run(self):
+        path = self._job['path']
+        try:
+            self._copy(path)
+            self.rotate()
+        except Exception as e:
+            logger.exception("Backup to %s failed", path)
+            with self._lock:
+                self._job.update(state='failed', error=str(e), finished_at=time.time())
+            if os.path.exists(path + ".partial"):
+                os.remove(path + ".partial")
+            return
+
+        with self._lock:
+            self._job.update(state='done', progress=1.0, finished_at=time.time(),
+                             bytes=os.path.getsize(path) if os.path.exists(path) else None)
+        logger.info("Backup written to %s", path)
+
+    def list_backups(self) -> List[Dict]:
+        """Return the backup files, newest first"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        backups = []
+        for filename in os.listdir(self.backup_dir):
+            match = BACKUP_NAME_RE.match(filename)
+            if not match:
+                continue
+            path = os.path.join(self.backup_dir, filename)
+            backups.append({
+                'path': path,
+                'created': datetime.strptime(match.group(1), "%Y%m%d_%H%M%S"),
+                'compressed': bool(match.group(2)),
+                'bytes': os.path.getsize(path),
+            })
+        return sorted(backups, key=lambda backup: backup['created'], reverse=True)
+
+    def _retained(self, backups: List[Dict]) -> set:
+        """Paths kept by the daily/weekly/monthly snapshot policy"""
+        keep = set()
+        for period_key, limit in (
+            (lambda d: d.strftime("%Y-%m-%d"), self.keep_daily),
+            (lambda d: d.strftime("%G-W%V"), self.keep_weekly),
+            (lambda d: d.strftime("%Y-%m"), self.keep_monthly),
+        ):
+            seen = []
+            for backup in backups:  # newest first: first of each period is its newest
+                period = period_key(backup['created'])
+                if period in seen:
+                    continue
+                if len(seen) >= limit:
+                    break
+                seen.append(period)
+                keep.add(backup['path'])
+        return keep
+
+    def rotate(self) -> Dict:
+        """Compress all but the newest backups and delete those outside retention"""
+        backups = self.list_backups()
+        if self.is_running() and self._job.get('path'):
+            # Never touch the file of a backup still being written
+            backups = [b for b in backups if b['path'] != self._job['path']]
+
+        keep = self._retained(backups)
+        deleted, compressed = [], []
+        for index, backup in enumerate(backups):
+            if backup['path'] not in keep:
+                os.remove(backup['path'])
+                deleted.append(backup['path'])
+            elif not backup['compressed'] and index >= self.keep_uncompressed:
+                compressed.append(self._compress(backup['path']))
+        return {'deleted': deleted, 'compressed': compressed}
+
+    @staticmethod
+    def _compress(path: str) -> str:
+        gz_path = path + ".gz"
+        with open(path, 'rb') as src, gzip.open(gz_path + ".partial", 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(gz_path + ".partial", gz_path)
+        os.remove(path)
+        return gz_path
+
+
+# Global backup service
+backup_service = BackupService(db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backup do banco de dados do EditalBot")
+    parser.add_argument('--rotate', action='store_true', help="apenas comprimir/remover backups antigos")
+    args = parser.parse_args()
+    if backup_service.database.backend != 'sqlite':
+        parser.error("backups de arquivo exigem DATABASE_BACKEND=sqlite; para PostgreSQL use pg_dump")
+
+    if not args.rotate:
+        path = backup_service.run_backup()
+        print(f"Backup criado: {path}")
+    result = backup_service.rotate()
+    print(f"Comprimidos: {len(result['compressed'])}, removidos: {len(result['deleted'])}")
+
+
+if __name__ == "__main__":
+    main()
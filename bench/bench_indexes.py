@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the hot admin/app queries before and after migration 2 (indexes)
+
+Builds a synthetic database at schema version 1 (no secondary indexes), times
+the queries, applies the remaining migrations and times them again.
+
+Usage:
+    python bench/bench_indexes.py                      # 1,000,000 messages
+    python bench/bench_indexes.py --messages 200000 --json results.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from migrations import apply_migrations, get_schema_version  # noqa: E402
+
+DOMAINS = ["edu.unirio.br", "uniriotec.br", "unirio.br"]
+NOTICES = [f"Notice {i:03d}/2025" for i in range(1, 31)]
+
+QUERIES = {
+    'get_user_messages': ("""
+        SELECT * FROM messages WHERE user_id = ? ORDER BY timestamp DESC LIMIT 50
+    """, lambda users: (random.randint(1, users),)),
+    'get_notice_usage': ("""
+        SELECT notice_context, COUNT(*) AS usage_count FROM messages
+        WHERE notice_context IS NOT NULL
+        GROUP BY notice_context ORDER BY usage_count DESC
+    """, lambda users: ()),
+    'cleanup_old_sessions_scan': ("""
+        SELECT COUNT(*) FROM user_sessions WHERE session_start < datetime('now', '-30 days')
+    """, lambda users: ()),
+    'get_all_users': ("""
+        SELECT * FROM users WHERE is_active = 1 ORDER BY last_access DESC LIMIT 100
+    """, lambda users: ()),
+}
+
+
+def build_database(path: str, users: int, sessions: int, messages: int):
+    """Create a version-1 database filled with synthetic rows"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    apply_migrations(conn, target=1)
+
+    now = time.time()
+    span = 180 * 86400
+
+    def ts(offset):
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - offset))
+
+    conn.executemany(
+        "INSERT INTO users (email, name, domain, last_access) VALUES (?, ?, ?, ?)",
+        ((f"user{i}@{random.choice(DOMAINS)}", f"User {i}", random.choice(DOMAINS),
+          ts(random.uniform(0, span))) for i in range(users)),
+    )
+    conn.executemany(
+        "INSERT INTO user_sessions (user_id, session_start) VALUES (?, ?)",
+        ((random.randint(1, users), ts(random.uniform(0, span))) for _ in range(sessions)),
+    )
+    batch = 100000
+    for start in range(0, messages, batch):
+        conn.executemany(
+            "INSERT INTO messages (user_id, user_message, bot_response, notice_context, timestamp)"
+            " VALUES (?, ?, ?, ?, ?)",
+            ((random.randint(1, users), "Qual o prazo de inscrição?", "O prazo é ...",
+              random.choice(NOTICES), ts(random.uniform(0, span)))
+             for _ in range(min(batch, messages - start))),
+        )
+        conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    return conn
+
+
+def time_queries(conn, users: int, repeat: int):
+    """Return the median latency (ms) of each query"""
+    results = {}
+    for name, (sql, params) in QUERIES.items():
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(sql, params(users)).fetchall()
+            samples.append((time.perf_counter() - started) * 1000)
+        results[name] = statistics.median(samples)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--sessions', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        print(f"Building synthetic database ({args.messages:,} messages)...")
+        started = time.perf_counter()
+        conn = build_database(path, args.users, args.sessions, args.messages)
+        base_version = get_schema_version(conn)
+        print(f"  built in {time.perf_counter() - started:.1f}s at schema version {base_version}")
+
+        before = time_queries(conn, args.users, args.repeat)
+
+        started = time.perf_counter()
+        version = apply_migrations(conn)
+        migrate_seconds = time.perf_counter() - started
+        print(f"Migrated to version {version} in {migrate_seconds:.1f}s")
+
+        after = time_queries(conn, args.users, args.repeat)
+        conn.close()
+
+    print(f"\n{'query':<28}{'v' + str(base_version) + ' (ms)':>12}{'v' + str(version) + ' (ms)':>12}"
+          f"{'speedup':>10}")
+    for name in QUERIES:
+        speedup = before[name] / after[name] if after[name] else float('inf')
+        print(f"{name:<28}{before[name]:>12.2f}{after[name]:>12.2f}{speedup:>9.1f}x")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'messages': args.messages,
+                'users': args.users,
+                'sessions': args.sessions,
+                'schema_version': version,
+                'migration_seconds': migrate_seconds,
+                'before_ms': before,
+                'after_ms': after,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test: N concurrent students logging in, asking and saving
+
+Every simulated student runs on its own thread, with its own session state
+standing in for a Streamlit browser session, through the app's real code:
+
+1. ``register_user_login`` (user upsert and session row), then a heartbeat;
+2. ``--questions`` times: think, ``fetch_gemini_response`` against
+   ``fake_model.FakeGenerativeModel`` with a sampled latency, then
+   ``save_user_message`` (write-behind queue);
+3. ``end_user_session``.
+
+The run uses a fresh SQLite database in a temporary directory (or the
+PostgreSQL one when DATABASE_BACKEND=postgres). The report holds throughput,
+latency percentiles per operation, the telemetry stage histograms and the
+SQLite write-lock contention, measured by a probe thread that times
+``BEGIN IMMEDIATE`` on its own connection. Results are written as JSON
+tagged with the git commit, so runs can be compared across commits.
+
+Latency distributions (seconds until the first chunk):
+fixed:0.8, uniform:0.3,1.5, normal:0.8,0.2, lognormal:0.8,0.5 (median,
+sigma), exponential:0.8 (mean).
+
+Usage:
+    python bench/load_test.py --students 50 --questions 5 --json results/head.json
+    python bench/load_test.py --latency lognormal:1.2,0.6 --think-time 2 --async
+    python bench/load_test.py --compare results/base.json results/head.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+DOMAINS = ["edu.unirio.br", "uniriotec.br", "unirio.br"]
+NOTICES = [f"Notice {i:03d}/2025" for i in range(1, 6)]
+QUESTIONS = [
+    "Qual o prazo de inscrição",
+    "Quais documentos preciso enviar",
+    "Quantas vagas são oferecidas",
+    "Qual o valor da bolsa",
+    "Quem pode se inscrever",
+    "Como funciona a seleção",
+    "Quando sai o resultado",
+    "Posso recorrer do resultado",
+]
+
+
+def parse_latency(spec: str, rng: random.Random) -> Callable[[], float]:
+    """Sampler (seconds) for a 'kind:param[,param]' latency distribution"""
+    kind, _, params = spec.partition(':')
+    try:
+        values = [float(value) for value in params.split(',')] if params else []
+    except ValueError:
+        raise ValueError(f"Invalid latency distribution: {spec}")
+    samplers = {
+        'fixed': (1, lambda v: lambda: v[0]),
+        'uniform': (2, lambda v: lambda: rng.uniform(v[0], v[1])),
+        'normal': (2, lambda v: lambda: max(0.0, rng.gauss(v[0], v[1]))),
+        'lognormal': (2, lambda v: lambda: rng.lognormvariate(math.log(v[0]), v[1])),
+        'exponential': (1, lambda v: lambda: rng.expovariate(1 / v[0])),
+    }
+    if kind not in samplers or len(values) != samplers[kind][0]:
+        raise ValueError(f"Invalid latency distribution: {spec}")
+    return samplers[kind][1](values)
+
+
+def summarize(samples: List[float]) -> Dict:
+    """Count, mean and p50/p90/p95/p99/max of samples given in seconds, in ms"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered) * 1000,
+        'p50': percentile(0.50),
+        'p90': percentile(0.90),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': ordered[-1] * 1000,
+    }
+
+
+class SessionState(dict):
+    """Attribute-style dict, like st.session_state"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def __delattr__(self, name):
+        del self[name]
+
+
+class StudentRuntime(threading.local):
+    """Per-thread ``session_state``/``context``: one browser session per student thread"""
+
+    def __init__(self):
+        self.session_state = SessionState()
+        self.context = types.SimpleNamespace(ip_address="127.0.0.1",
+                                             headers={'User-Agent': "editalbot-load-test"})
+
+
+class LockProbe:
+    """Samples how long taking the SQLite write lock takes while the load runs"""
+
+    def __init__(self, db_path: str, interval: float = 0.05, busy_timeout: float = 5.0):
+        self.db_path = db_path
+        self.interval = interval
+        self.busy_timeout = busy_timeout
+        self.waits: List[float] = []
+        self.busy = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lock-probe", daemon=True)
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+        try:
+            while not self._stop.wait(self.interval):
+                started = time.perf_counter()
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                except sqlite3.OperationalError:
+                    # Waited the whole busy timeout: an app write would have failed too
+                    self.busy += 1
+                    continue
+                self.waits.append(time.perf_counter() - started)
+                conn.execute("ROLLBACK")
+        finally:
+            conn.close()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Dict:
+        self._stop.set()
+        self._thread.join()
+        contended = sum(1 for wait in self.waits if wait >= 0.001)
+        return {
+            'probes': len(self.waits) + self.busy,
+            'busy_timeouts': self.busy,
+            'contended_ratio': contended / len(self.waits) if self.waits else 0.0,
+            'wait_ms': summarize(self.waits),
+        }
+
+
+def git_revision() -> Dict:
+    """Commit of the tree under test, and whether it has uncommitted changes"""
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True,
+                              timeout=30).stdout.strip()
+    try:
+        return {'commit': git('rev-parse', 'HEAD') or None,
+                'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+    except (OSError, subprocess.SubprocessError):
+        return {'commit': None, 'dirty': None}
+
+
+def configure_environment(args, workdir: str):
+    """Point the app at the scratch directory and apply the run options (before importing it)"""
+    # Never the real editalbot.db
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["NOTICE_INDEX_PATH"] = os.path.join(workdir, "notices.db")
+    # The default 60 RPM budget would make the scheduler the only thing measured
+    os.environ.setdefault("GEMINI_RPM", str(args.gemini_rpm))
+    if args.use_async:
+        os.environ["GEMINI_ASYNC"] = "true"
+    if args.no_coalesce:
+        os.environ["GEMINI_COALESCE"] = "false"
+    if args.no_cache:
+        os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+
+
+def run(args) -> Dict:
+    """Run the load and return the JSON report"""
+    import functions
+    from message_writer import message_writer
+    from session_tracker import session_tracker
+    from telemetry import telemetry
+    from fake_model import FakeGenerativeModel
+
+    runtime = StudentRuntime()
+    functions.st = runtime
+    db = functions.db
+
+    model = FakeGenerativeModel(
+        responder=lambda prompt: "Resposta simulada: " + "o edital prevê isso. " * args.answer_words,
+        chunk_delay=args.chunk_delay,
+        first_chunk_latency=parse_latency(args.latency, random.Random(args.seed)),
+        failure_rate=args.failure_rate,
+    )
+    pool = [(f"{QUESTIONS[i % len(QUESTIONS)]} (item {i // len(QUESTIONS)})?", NOTICES[i % len(NOTICES)])
+            for i in range(args.distinct_questions)]
+
+    latencies = {'login': [], 'ask': [], 'save': [], 'student': []}
+    errors = Counter()
+    lock = threading.Lock()
+
+    def timed(operation, fn, *fn_args, **fn_kwargs):
+        started = time.perf_counter()
+        try:
+            result = fn(*fn_args, **fn_kwargs)
+        except Exception as e:
+            with lock:
+                errors[f"{operation}:{type(e).__name__}"] += 1
+            raise
+        with lock:
+            latencies[operation].append(time.perf_counter() - started)
+        return result
+
+    def student(index: int):
+        rng = random.Random(args.seed * 100003 + index)
+        if args.ramp_up:
+            time.sleep(args.ramp_up * index / args.students)
+        state = runtime.session_state
+        state.clear()  # pool threads are reused by later students
+        started = time.perf_counter()
+        email = f"aluno{index:05d}@{DOMAINS[index % len(DOMAINS)]}"
+        try:
+            timed('login', functions.register_user_login, email, f"Aluno {index}")
+            functions.touch_user_session()
+            for _ in range(args.questions):
+                if args.think_time:
+                    time.sleep(rng.expovariate(1 / args.think_time))
+                question, notice = rng.choice(pool)
+                try:
+                    answer, usage = timed('ask', functions.fetch_gemini_response, question,
+                                          notice=notice, model=model)
+                except Exception:
+                    continue
+                timed('save', functions.save_user_message, question, answer, notice, usage=usage)
+                functions.touch_user_session()
+            functions.end_user_session()
+        except Exception as e:
+            with lock:
+                errors[f"aborted:{type(e).__name__}"] += 1
+            return
+        with lock:
+            latencies['student'].append(time.perf_counter() - started)
+
+    probe = LockProbe(db.db_path, interval=args.probe_interval) if db.backend == 'sqlite' else None
+    if probe:
+        probe.start()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency or args.students,
+                            thread_name_prefix="student") as executor:
+        list(executor.map(student, range(args.students)))
+    wall = time.perf_counter() - started
+
+    # Time until the write-behind queue and the heartbeats are on disk
+    drain_started = time.perf_counter()
+    message_writer.flush(timeout=120)
+    session_tracker.flush()
+    drain = time.perf_counter() - drain_started
+
+    lock_contention = probe.stop() if probe else None
+
+    stages = {}
+    for name, stats in telemetry.stage_stats().items():
+        stages[name] = {key: (value * 1000 if key != 'count' else value) for key, value in stats.items()}
+
+    return {
+        'benchmark': 'load_test',
+        'format': 1,
+        **git_revision(),
+        'started_at': datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'backend': db.backend,
+            'gemini_async': functions.GEMINI_ASYNC,
+            'gemini_coalesce': functions.GEMINI_COALESCE,
+            'response_cache': functions.RESPONSE_CACHE_ENABLED,
+            'gemini_rpm': os.environ.get("GEMINI_RPM"),
+        },
+        'config': {key: value for key, value in vars(args).items() if key not in ('json', 'compare', 'workdir')},
+        'wall_seconds': wall,
+        'drain_seconds': drain,
+        'throughput': {
+            'questions_per_second': len(latencies['ask']) / wall if wall else 0.0,
+            'saves_per_second': len(latencies['save']) / wall if wall else 0.0,
+            'logins_per_second': len(latencies['login']) / wall if wall else 0.0,
+        },
+        'latency_ms': {operation: summarize(samples) for operation, samples in latencies.items()},
+        'errors': dict(errors),
+        'model_calls': model.calls,
+        'persisted_messages': db.get_user_stats()['total_messages'],
+        'lock_contention': lock_contention,
+        'stages_ms': stages,
+        'gauges': telemetry.gauges(),
+    }
+
+
+def print_report(report: Dict):
+    print(f"commit {report['commit'] or '?'}{' (dirty)' if report['dirty'] else ''}, "
+          f"backend {report['environment']['backend']}")
+    print(f"{report['config']['students']} students x {report['config']['questions']} questions "
+          f"in {report['wall_seconds']:.1f}s (+{report['drain_seconds']:.2f}s drain)")
+    throughput = report['throughput']
+    print(f"  {throughput['questions_per_second']:.1f} questions/s, "
+          f"{throughput['logins_per_second']:.1f} logins/s, "
+          f"{report['model_calls']} model calls, {report['persisted_messages']} messages stored")
+    print(f"\n{'operation':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for operation, stats in report['latency_ms'].items():
+        if stats['count']:
+            print(f"{operation:<12}{stats['count']:>8}{stats['p50']:>10.1f}{stats['p95']:>10.1f}"
+                  f"{stats['p99']:>10.1f}{stats['max']:>10.1f}")
+    contention = report['lock_contention']
+    if contention:
+        wait = contention['wait_ms']
+        print(f"\nwrite lock: {contention['contended_ratio']:.1%} of {contention['probes']} probes waited, "
+              f"p95 {wait.get('p95', 0):.1f}ms, max {wait.get('max', 0):.1f}ms, "
+              f"{contention['busy_timeouts']} busy timeouts")
+    if report['errors']:
+        print("\nerrors: " + ", ".join(f"{name}={count}" for name, count in sorted(report['errors'].items())))
+
+
+# (label, path in the report, True when higher is better)
+COMPARED_METRICS = [
+    ("questions/s", ('throughput', 'questions_per_second'), True),
+    ("login p50 ms", ('latency_ms', 'login', 'p50'), False),
+    ("login p95 ms", ('latency_ms', 'login', 'p95'), False),
+    ("ask p50 ms", ('latency_ms', 'ask', 'p50'), False),
+    ("ask p95 ms", ('latency_ms', 'ask', 'p95'), False),
+    ("ask p99 ms", ('latency_ms', 'ask', 'p99'), False),
+    ("save p95 ms", ('latency_ms', 'save', 'p95'), False),
+    ("lock wait p95 ms", ('lock_contention', 'wait_ms', 'p95'), False),
+    ("lock contended", ('lock_contention', 'contended_ratio'), False),
+    ("drain s", ('drain_seconds',), False),
+]
+
+
+def _lookup(report: Dict, path) -> Optional[float]:
+    value = report
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(base: Dict, head: Dict):
+    """Print the headline metrics of two reports side by side"""
+    print(f"base {str(base.get('commit'))[:10]}  vs  head {str(head.get('commit'))[:10]}")
+    if base.get('config') != head.get('config'):
+        print("warning: the runs used different options")
+    print(f"\n{'metric':<20}{'base':>12}{'head':>12}{'change':>10}")
+    for label, path, higher_is_better in COMPARED_METRICS:
+        before, after = _lookup(base, path), _lookup(head, path)
+        if before is None or after is None:
+            continue
+        if not before:
+            print(f"{label:<20}{before:>12.2f}{after:>12.2f}{'n/a' if after else '':>10}")
+            continue
+        change = (after - before) / before
+        better = change > 0 if higher_is_better else change < 0
+        marker = "" if abs(change) < 0.05 else (" +" if better else " -")
+        print(f"{label:<20}{before:>12.2f}{after:>12.2f}{change:>9.1%}{marker}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=50)
+    parser.add_argument('--questions', type=int, default=5, help="questions per student")
+    parser.add_argument('--concurrency', type=int, default=0,
+                        help="students running at once (default: all)")
+    parser.add_argument('--ramp-up', type=float, default=0.0, help="seconds to start every student")
+    parser.add_argument('--think-time', type=float, default=0.0,
+                        help="mean pause before each question (exponential), seconds")
+    parser.add_argument('--latency', default="lognormal:0.8,0.5",
+                        help="model first-chunk latency distribution")
+    parser.add_argument('--chunk-delay', type=float, default=0.0)
+    parser.add_argument('--answer-words', type=int, default=60)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of model calls failing with 429")
+    parser.add_argument('--distinct-questions', type=int, default=200,
+                        help="size of the question pool (smaller means more cache hits and coalescing)")
+    parser.add_argument('--async', dest='use_async', action='store_true', help="GEMINI_ASYNC=true")
+    parser.add_argument('--no-coalesce', action='store_true', help="GEMINI_COALESCE=false")
+    parser.add_argument('--no-cache', action='store_true', help="RESPONSE_CACHE_ENABLED=false")
+    parser.add_argument('--gemini-rpm', type=float, default=100000,
+                        help="GEMINI_RPM for the run, unless already set in the environment")
+    parser.add_argument('--probe-interval', type=float, default=0.05, help="seconds between write-lock probes")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', help="keep the database in this directory instead of a temporary one")
+    parser.add_argument('--json', help="write the report to this file")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'), help="compare two JSON reports")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            head = json.load(f)
+        compare(base, head)
+        return
+
+    try:
+        parse_latency(args.latency, random.Random())
+    except ValueError as e:
+        parser.error(str(e))
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = os.path.abspath(args.workdir or tmp)
+        os.makedirs(workdir, exist_ok=True)
+        configure_environment(args, workdir)
+        os.chdir(workdir)
+        try:
+            report = run(args)
+        finally:
+            os.chdir(cwd)
+
+    print_report(report)
+    if args.json:
+        os.makedirs(os.path.dirname(args.json), exist_ok=True)
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,53 +6,50 @@ Usage: python consulta_banco.py
 
 import sqlite3
 from database import db
+from export import export_table, EXPORT_FORMATS
 from datetime import datetime
 
-def consulta_usuarios():
-    """Consulta todos os usuários"""
+def proxima_pagina():
+    """Pergunta se deve continuar para a próxima página"""
+    return input("\n[Enter] próxima página, [q] sair: ").strip().lower() != 'q'
+
+def consulta_usuarios(page_size=20):
+    """Consulta todos os usuários, página por página"""
     print("=== USUÁRIOS ===")
-    users = db.get_all_users()
-    for user in users:
-        print(f"ID: {user['id']}")
-        print(f"Nome: {user['name']}")
-        print(f"Email: {user['email']}")
-        print(f"Domínio: {user['domain']}")
-        print(f"Primeiro login: {user['first_login']}")
-        print(f"Último acesso: {user['last_access']}")
-        print(f"Quantidade de acessos: {user['access_count']}")
-        print("-" * 50)
+    for page, users in enumerate(db.iter_users(page_size=page_size), 1):
+        if page > 1 and not proxima_pagina():
+            break
+        for user in users:
+            print(f"ID: {user['id']}")
+            print(f"Nome: {user['name']}")
+            print(f"Email: {user['email']}")
+            print(f"Domínio: {user['domain']}")
+            print(f"Primeiro login: {user['first_login']}")
+            print(f"Último acesso: {user['last_access']}")
+            print(f"Quantidade de acessos: {user['access_count']}")
+            print("-" * 50)
 
-def consulta_mensagens(user_id=None):
-    """Consulta mensagens (de um usuário específico ou todas)"""
+def consulta_mensagens(user_id=None, page_size=20):
+    """Consulta mensagens (de um usuário específico ou todas), página por página"""
     print("=== MENSAGENS ===")
     
     if user_id:
-        messages = db.get_user_messages(user_id)
         print(f"Mensagens do usuário ID {user_id}:")
     else:
-        # Consulta todas as mensagens via SQL direto
-        conn = sqlite3.connect('editalbot.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT m.*, u.name, u.email 
-            FROM messages m 
-            JOIN users u ON m.user_id = u.id 
-            ORDER BY m.timestamp DESC
-        """)
-        messages = [dict(row) for row in cursor.fetchall()]
-        conn.close()
         print("Todas as mensagens:")
     
-    for msg in messages:
-        print(f"ID: {msg['id']}")
-        if 'name' in msg:
+    # Paginação por cursor (timestamp, id): memória constante mesmo com histórico grande
+    for page, messages in enumerate(db.iter_messages(page_size=page_size, user_id=user_id), 1):
+        if page > 1 and not proxima_pagina():
+            break
+        for msg in messages:
+            print(f"ID: {msg['id']}")
             print(f"Usuário: {msg['name']} ({msg['email']})")
-        print(f"Mensagem: {msg['user_message']}")
-        print(f"Resposta: {msg['bot_response']}")
-        print(f"Contexto: {msg['notice_context']}")
-        print(f"Timestamp: {msg['timestamp']}")
-        print("-" * 50)
+            print(f"Mensagem: {msg['user_message']}")
+            print(f"Resposta: {msg['bot_response']}")
+            print(f"Contexto: {msg['notice_context']}")
+            print(f"Timestamp: {msg['timestamp']}")
+            print("-" * 50)
 
 def estatisticas():
     """Mostra estatísticas gerais"""
@@ -74,6 +71,45 @@ def estatisticas():
         for usage in notice_usage:
             print(f"  {usage['notice_context']}: {usage['usage_count']} consultas")
 
+def busca_mensagens():
+    """Busca textual nas conversas (FTS5), com filtros opcionais"""
+    print("=== BUSCA NAS CONVERSAS ===")
+    query = input("Termos de busca: ").strip()
+    if not query:
+        return
+    notice = input("Edital (Enter para todos): ").strip() or None
+    since = input("Desde (AAAA-MM-DD, Enter para sempre): ").strip() or None
+    
+    results = db.search_messages(query, notice=notice, since=since, limit=50)
+    if not results:
+        print("Nenhuma mensagem encontrada.")
+        return
+    
+    for msg in results:
+        print(f"ID: {msg['id']}  [{msg['timestamp']}]  {msg['name']} ({msg['email']})")
+        print(f"Contexto: {msg['notice_context']}")
+        print(f"Mensagem: {msg['question_snippet']}")
+        print(f"Resposta: {msg['response_snippet']}")
+        print("-" * 50)
+    print(f"{len(results)} mensagens encontradas.")
+
+def exporta_dados():
+    """Exporta uma tabela para CSV, JSONL ou Parquet em blocos"""
+    print("=== EXPORTAR DADOS ===")
+    table = input(f"Tabela ({', '.join(sorted(db.EXPORT_TABLES))}): ").strip()
+    fmt = input(f"Formato ({', '.join(EXPORT_FORMATS)}) [parquet]: ").strip() or 'parquet'
+    since = input("Desde (AAAA-MM-DD, Enter para sempre): ").strip() or None
+    until = input("Até, exclusivo (AAAA-MM-DD, Enter para hoje): ").strip() or None
+    notice = None
+    if table == 'messages':
+        notice = input("Edital (Enter para todos): ").strip() or None
+    
+    try:
+        result = export_table(table, fmt=fmt, since=since, until=until, notice=notice)
+        print(f"{result['rows']} linhas exportadas para {result['path']} ({result['bytes']} bytes)")
+    except (ValueError, RuntimeError) as e:
+        print(f"Erro: {e}")
+
 def consulta_sql_personalizada():
     """Permite executar consultas SQL personalizadas"""
     print("=== CONSULTA SQL PERSONALIZADA ===")
@@ -123,6 +159,8 @@ def main():
         print("3. Consultar mensagens de um usuário específico")
         print("4. Estatísticas gerais")
         print("5. Consulta SQL personalizada")
+        print("6. Buscar nas conversas")
+        print("7. Exportar dados")
         print("0. Sair")
         
         escolha = input("\nEscolha uma opção: ").strip()
@@ -141,6 +179,10 @@ def main():
             estatisticas()
         elif escolha == "5":
             consulta_sql_personalizada()
+        elif escolha == "6":
+            busca_mensagens()
+        elif escolha == "7":
+            exporta_dados()
         elif escolha == "0":
             break
         else:
@@ -1,154 +1,171 @@
 import sqlite3
 import os
+import re
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Iterator, Tuple
 import hashlib
 
-class Database:
+from migrations import apply_migrations, has_table
+from sqlite_pool import ConnectionPool
+from storage import Storage, sql_timestamp
+
+
+# RETURNING needs SQLite 3.35+; older libraries re-read the row instead
+SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+class Database(Storage):
+    """SQLite storage backend (a local editalbot.db file)"""
+
+    backend = 'sqlite'
+    transient_errors = (sqlite3.OperationalError,)
+
     def __init__(self, db_path: str = "editalbot.db"):
+        super().__init__()
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path)
         self.init_database()
+
+    @contextmanager
+    def _connect(self):
+        """Yield this thread's pooled connection inside a transaction"""
+        conn = self.pool.connection()
+        with conn:
+            yield conn
+
+    def close(self):
+        """Close all pooled connections"""
+        self.pool.close_all()
+
+    def pool_stats(self) -> Dict:
+        """Return connection pool occupancy counters"""
+        return self.pool.stats()
     
     def init_database(self):
-        """Initialize database and create tables if they don't exist"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Users table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    email VARCHAR(255) UNIQUE NOT NULL,
-                    name VARCHAR(255) NOT NULL,
-                    profile_picture_url TEXT,
-                    domain VARCHAR(50) NOT NULL,
-                    first_login TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_access TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    access_count INTEGER DEFAULT 1,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # User sessions table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    session_start TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    session_end TIMESTAMP,
-                    ip_address VARCHAR(45),
-                    user_agent TEXT,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            """)
-            
-            # Messages table (conversations)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    user_message TEXT NOT NULL,
-                    bot_response TEXT,
-                    notice_context VARCHAR(255),
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            """)
-            
-            conn.commit()
+        """Initialize database, applying pending schema migrations"""
+        apply_migrations(self.pool.connection())
     
     def get_or_create_user(self, email: str, name: str, profile_picture_url: str = None) -> Dict:
-        """Get existing user or create new one"""
-        domain = email.split('@')[1].lower()
-        
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            # Check if user exists
-            cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-            user = cursor.fetchone()
-            
-            if user:
-                # Update last access and increment access count
-                cursor.execute("""
-                    UPDATE users 
-                    SET last_access = CURRENT_TIMESTAMP, 
-                        access_count = access_count + 1,
-                        name = ?,
-                        profile_picture_url = ?,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE email = ?
-                """, (name, profile_picture_url, email))
-                
-                # Get updated user
-                cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-                user = cursor.fetchone()
+        """Create the user or record a new access, in a single UPSERT"""
+        params = (email, name, profile_picture_url, email.split('@')[1].lower())
+        upsert = """
+            INSERT INTO users (email, name, profile_picture_url, domain)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (email) DO UPDATE SET
+                last_access = CURRENT_TIMESTAMP,
+                access_count = access_count + 1,
+                name = excluded.name,
+                profile_picture_url = excluded.profile_picture_url,
+                updated_at = CURRENT_TIMESTAMP
+        """
+        with self._connect() as conn:
+            if SQLITE_HAS_RETURNING:
+                user = conn.execute(upsert + " RETURNING *", params).fetchone()
             else:
-                # Create new user
-                cursor.execute("""
-                    INSERT INTO users (email, name, profile_picture_url, domain)
-                    VALUES (?, ?, ?, ?)
-                """, (email, name, profile_picture_url, domain))
-                
-                # Get created user
-                cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-                user = cursor.fetchone()
-            
-            conn.commit()
-            return dict(user) if user else None
-    
+                conn.execute(upsert, params)
+                user = conn.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+        return self._remember_user(email, dict(user) if user else None)
+
     def create_session(self, user_id: int, ip_address: str = None, user_agent: str = None) -> int:
         """Create a new user session"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                INSERT INTO user_sessions (user_id, ip_address, user_agent)
-                VALUES (?, ?, ?)
+                INSERT INTO user_sessions (user_id, ip_address, user_agent, last_activity)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
             """, (user_id, ip_address, user_agent))
-            conn.commit()
             return cursor.lastrowid
     
     def end_session(self, session_id: int):
         """End a user session"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 UPDATE user_sessions 
-                SET session_end = CURRENT_TIMESTAMP 
+                SET session_end = CURRENT_TIMESTAMP, last_activity = CURRENT_TIMESTAMP
                 WHERE id = ? AND session_end IS NULL
             """, (session_id,))
-            conn.commit()
+
+    def touch_sessions(self, activity: Dict[int, str]) -> List[int]:
+        """Record the last activity ('YYYY-MM-DD HH:MM:SS' UTC) of open sessions in one batch;
+        return the ids that are closed or gone"""
+        closed = []
+        with self._connect() as conn:
+            for session_id, timestamp in activity.items():
+                cursor = conn.execute("""
+                    UPDATE user_sessions SET last_activity = ?
+                    WHERE id = ? AND session_end IS NULL
+                """, (timestamp, session_id))
+                if cursor.rowcount == 0:
+                    closed.append(session_id)
+        return closed
+
+    def close_idle_sessions(self, idle_minutes: int = 30) -> List[int]:
+        """End every open session idle for idle_minutes, at its last activity; return their ids"""
+        cutoff = f'-{int(idle_minutes)} minutes'
+        close = """
+            UPDATE user_sessions SET session_end = last_activity
+            WHERE session_end IS NULL AND last_activity < datetime('now', ?)
+        """
+        with self._connect() as conn:
+            if SQLITE_HAS_RETURNING:
+                return [row[0] for row in conn.execute(close + " RETURNING id", (cutoff,))]
+            ids = [row[0] for row in conn.execute("""
+                SELECT id FROM user_sessions
+                WHERE session_end IS NULL AND last_activity < datetime('now', ?)
+            """, (cutoff,))]
+            conn.execute(close, (cutoff,))
+            return ids
     
-    def save_message(self, user_id: int, user_message: str, bot_response: str, notice_context: str = None):
-        """Save a message conversation"""
-        with sqlite3.connect(self.db_path) as conn:
+    def save_message(self, user_id: int, user_message: str, bot_response: str, notice_context: str = None,
+                     prompt_tokens: int = None, response_tokens: int = None,
+                     model_latency_ms: float = None, model_name: str = None):
+        """Save a message conversation with its token usage"""
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                INSERT INTO messages (user_id, user_message, bot_response, notice_context)
-                VALUES (?, ?, ?, ?)
-            """, (user_id, user_message, bot_response, notice_context))
-            conn.commit()
+                INSERT INTO messages (user_id, user_message, bot_response, notice_context,
+                                      prompt_tokens, response_tokens, model_latency_ms, model_name)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, user_message, bot_response, notice_context,
+                  prompt_tokens, response_tokens, model_latency_ms, model_name))
+
+    def save_messages(self, messages: List[Dict]):
+        """Save a batch of message conversations in a single transaction"""
+        # Usage fields are optional per message
+        rows = [{**dict.fromkeys(self.MESSAGE_USAGE_FIELDS), **message} for message in messages]
+        with self._connect() as conn:
+            conn.executemany("""
+                INSERT INTO messages (user_id, user_message, bot_response, notice_context,
+                                      prompt_tokens, response_tokens, model_latency_ms, model_name)
+                VALUES (:user_id, :user_message, :bot_response, :notice_context,
+                        :prompt_tokens, :response_tokens, :model_latency_ms, :model_name)
+            """, rows)
+    
+    def data_version(self) -> Tuple:
+        """Cheap marker that changes with every new message, session or login (a cache key)"""
+        # Three index lookups: rowid maxima and the (is_active, last_access) index
+        with self._connect() as conn:
+            return tuple(conn.execute("""
+                SELECT (SELECT MAX(id) FROM messages) AS messages,
+                       (SELECT MAX(id) FROM user_sessions) AS sessions,
+                       (SELECT MAX(last_access) FROM users WHERE is_active = 1) AS last_access
+            """).fetchone())
     
     def get_user_stats(self) -> Dict:
         """Get general user statistics"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             
-            # Total users
-            cursor.execute("SELECT COUNT(*) as total FROM users WHERE is_active = 1")
-            total_users = cursor.fetchone()[0]
-            
-            # Users by domain
+            # Active users by domain (rollup maintained by triggers)
             cursor.execute("""
-                SELECT domain, COUNT(*) as count 
-                FROM users 
-                WHERE is_active = 1 
-                GROUP BY domain
+                SELECT domain, user_count 
+                FROM domain_users 
+                WHERE user_count > 0
             """)
             domain_stats = dict(cursor.fetchall())
+            total_users = sum(domain_stats.values())
             
             # Recent users (last 7 days)
             cursor.execute("""
@@ -158,8 +175,8 @@ class Database:
             """)
             recent_users = cursor.fetchone()[0]
             
-            # Total messages
-            cursor.execute("SELECT COUNT(*) as total FROM messages")
+            # Total messages (sum of the daily rollup)
+            cursor.execute("SELECT COALESCE(SUM(message_count), 0) as total FROM usage_daily")
             total_messages = cursor.fetchone()[0]
             
             return {
@@ -171,8 +188,7 @@ class Database:
     
     def get_all_users(self, limit: int = 100) -> List[Dict]:
         """Get all users with pagination"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT * FROM users 
@@ -184,8 +200,7 @@ class Database:
     
     def get_user_messages(self, user_id: int, limit: int = 50) -> List[Dict]:
         """Get messages for a specific user"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT * FROM messages 
@@ -195,42 +210,440 @@ class Database:
             """, (user_id, limit))
             return [dict(row) for row in cursor.fetchall()]
     
-    def get_notice_usage(self) -> List[Dict]:
-        """Get statistics about notice usage"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+    def get_users_page(self, cursor: Optional[Tuple] = None, page_size: int = 50) -> Tuple[List[Dict], Optional[Tuple]]:
+        """Get a page of active users, most recent access first.
+
+        Keyset pagination on (last_access, id): pass the returned cursor to get
+        the next page; it is None when there are no more rows.
+        """
+        with self._connect() as conn:
+            if cursor is None:
+                rows = conn.execute("""
+                    SELECT * FROM users 
+                    WHERE is_active = 1 
+                    ORDER BY last_access DESC, id DESC 
+                    LIMIT ?
+                """, (page_size,)).fetchall()
+            else:
+                rows = conn.execute("""
+                    SELECT * FROM users 
+                    WHERE is_active = 1 AND (last_access, id) < (?, ?) 
+                    ORDER BY last_access DESC, id DESC 
+                    LIMIT ?
+                """, (*cursor, page_size)).fetchall()
+        rows = [dict(row) for row in rows]
+        next_cursor = (rows[-1]['last_access'], rows[-1]['id']) if len(rows) == page_size else None
+        return rows, next_cursor
+
+    def get_messages_page(self, cursor: Optional[Tuple] = None, page_size: int = 50,
+                          user_id: int = None) -> Tuple[List[Dict], Optional[Tuple]]:
+        """Get a page of messages (with user name and email), newest first.
+
+        Keyset pagination on (timestamp, id), optionally restricted to one
+        user: pass the returned cursor to get the next page; it is None when
+        there are no more rows.
+        """
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append("m.user_id = ?")
+            params.append(user_id)
+        if cursor is not None:
+            conditions.append("(m.timestamp, m.id) < (?, ?)")
+            params.extend(cursor)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._connect() as conn:
+            rows = conn.execute(f"""
+                SELECT m.*, u.name, u.email 
+                FROM messages m 
+                JOIN users u ON u.id = m.user_id 
+                {where} 
+                ORDER BY m.timestamp DESC, m.id DESC 
+                LIMIT ?
+            """, (*params, page_size)).fetchall()
+        rows = [dict(row) for row in rows]
+        next_cursor = (rows[-1]['timestamp'], rows[-1]['id']) if len(rows) == page_size else None
+        return rows, next_cursor
+
+    def search_messages(self, query: str, notice: str = None, since=None,
+                        limit: int = 20) -> List[Dict]:
+        """Full-text search over questions and answers, best matches first.
+
+        Each result carries the message, the user's name/email, highlighted
+        ``question_snippet``/``response_snippet`` and its bm25 ``rank`` (lower
+        is better). ``since`` accepts a datetime/date or an SQL timestamp string.
+        """
+        terms = re.findall(r"\w+", query)
+        if not terms:
+            return []
+        # Quote every term so user input can't break the FTS syntax; prefix-match the last one
+        match = " ".join(f'"{term}"' for term in terms) + "*"
+
+        conditions, params = ["messages_fts MATCH ?"], [match]
+        if notice:
+            conditions.append("m.notice_context = ?")
+            params.append(notice)
+        if since:
+            conditions.append("m.timestamp >= ?")
+            params.append(sql_timestamp(since))
+
+        with self._connect() as conn:
+            if has_table(conn, 'messages_fts'):
+                rows = conn.execute(f"""
+                    SELECT m.id, m.user_id, u.name, u.email, m.notice_context, m.timestamp,
+                           m.user_message, m.bot_response,
+                           snippet(messages_fts, 0, '**', '**', '…', 16) as question_snippet,
+                           snippet(messages_fts, 1, '**', '**', '…', 24) as response_snippet,
+                           bm25(messages_fts, 2.0, 1.0) as rank
+                    FROM messages_fts 
+                    JOIN messages m ON m.id = messages_fts.rowid 
+                    JOIN users u ON u.id = m.user_id 
+                    WHERE {' AND '.join(conditions)} 
+                    ORDER BY rank 
+                    LIMIT ?
+                """, (*params, limit)).fetchall()
+            else:
+                # No FTS5 in this SQLite build: slow substring scan
+                like = f"%{' '.join(terms)}%"
+                conditions[0] = "(m.user_message LIKE ? OR m.bot_response LIKE ?)"
+                params[0:1] = [like, like]
+                rows = conn.execute(f"""
+                    SELECT m.id, m.user_id, u.name, u.email, m.notice_context, m.timestamp,
+                           m.user_message, m.bot_response,
+                           m.user_message as question_snippet,
+                           substr(m.bot_response, 1, 200) as response_snippet,
+                           0 as rank
+                    FROM messages m 
+                    JOIN users u ON u.id = m.user_id 
+                    WHERE {' AND '.join(conditions)} 
+                    ORDER BY m.timestamp DESC 
+                    LIMIT ?
+                """, (*params, limit)).fetchall()
+            return [dict(row) for row in rows]
+
+    def get_table_columns(self, table: str) -> List[Tuple[str, str]]:
+        """Get (name, declared type) of the columns of an exportable table"""
+        if table not in self.EXPORT_TABLES:
+            raise ValueError(f"Unknown table: {table}")
+        with self._connect() as conn:
+            return [(row['name'], row['type']) for row in conn.execute(f"PRAGMA table_info({table})")]
+
+    def iter_export_rows(self, table: str, since=None, until=None, notice: str = None,
+                         chunk_size: int = 5000) -> Iterator[List[Dict]]:
+        """Yield rows of a table in id order, chunk_size rows at a time.
+
+        Keyset pagination on id keeps memory bounded regardless of table size.
+        ``since``/``until`` filter on the table's date column (inclusive/exclusive)
+        and ``notice`` filters messages by notice_context.
+        """
+        if table not in self.EXPORT_TABLES:
+            raise ValueError(f"Unknown table: {table}")
+        date_column = self.EXPORT_TABLES[table]
+
+        conditions, params = ["id > ?"], []
+        if since:
+            conditions.append(f"{date_column} >= ?")
+            params.append(sql_timestamp(since))
+        if until:
+            conditions.append(f"{date_column} < ?")
+            params.append(sql_timestamp(until))
+        if notice:
+            if table != 'messages':
+                raise ValueError("The notice filter only applies to messages")
+            conditions.append("notice_context = ?")
+            params.append(notice)
+
+        sql = f"""
+            SELECT * FROM {table} 
+            WHERE {' AND '.join(conditions)} 
+            ORDER BY id 
+            LIMIT ?
+        """
+        last_id = 0
+        while True:
+            with self._connect() as conn:
+                rows = conn.execute(sql, (last_id, *params, chunk_size)).fetchall()
+            if not rows:
+                return
+            yield [dict(row) for row in rows]
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1]['id']
+
+    def get_notice_usage(self, days: int = None) -> List[Dict]:
+        """Get statistics about notice usage (optionally for the last N days)"""
+        since = f'-{int(days)} days' if days else '-100 years'
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT notice_context, COUNT(*) as usage_count
-                FROM messages 
-                WHERE notice_context IS NOT NULL 
+                SELECT notice_context, SUM(message_count) as usage_count
+                FROM usage_daily 
+                WHERE notice_context != '' AND day >= date('now', ?) 
                 GROUP BY notice_context 
                 ORDER BY usage_count DESC
-            """)
+            """, (since,))
             return [dict(row) for row in cursor.fetchall()]
-    
-    def cleanup_old_sessions(self, days: int = 30):
-        """Clean up old sessions"""
-        with sqlite3.connect(self.db_path) as conn:
+
+    def get_activity_buckets(self, days: int = 7, bucket: str = 'day') -> List[Dict]:
+        """Get messages and active users per time bucket ('hour', 'day', 'week' or 'month')"""
+        since = f'-{int(days)} days'
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            if bucket == 'hour':
+                # Hourly resolution isn't rolled up; range scan on idx_messages_timestamp
+                cursor.execute("""
+                    SELECT strftime('%Y-%m-%d %H:00', timestamp) as bucket,
+                           COUNT(*) as messages,
+                           COUNT(DISTINCT user_id) as active_users
+                    FROM messages 
+                    WHERE timestamp >= datetime('now', ?) 
+                    GROUP BY bucket 
+                    ORDER BY bucket
+                """, (since,))
+            else:
+                bucket_expr = {
+                    'day': "day",
+                    'week': "date(day, '-6 days', 'weekday 1')",
+                    'month': "strftime('%Y-%m-01', day)",
+                }[bucket]
+                cursor.execute(f"""
+                    SELECT {bucket_expr} as bucket,
+                           SUM(message_count) as messages,
+                           COUNT(DISTINCT user_id) as active_users
+                    FROM user_daily_usage 
+                    WHERE day >= date('now', ?) 
+                    GROUP BY bucket 
+                    ORDER BY bucket
+                """, (since,))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_daily_usage(self, days: int = 30) -> List[Dict]:
+        """Get messages, sessions and active users per day for the last N days"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT day,
+                       SUM(message_count) as messages,
+                       SUM(session_count) as sessions,
+                       COUNT(*) as active_users
+                FROM user_daily_usage 
+                WHERE day >= date('now', ?) 
+                GROUP BY day 
+                ORDER BY day
+            """, (f'-{int(days)} days',))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_domain_usage(self, days: int = 30) -> List[Dict]:
+        """Get messages per day and user domain for the last N days"""
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                DELETE FROM user_sessions 
-                WHERE session_start < datetime('now', '-{} days')
-            """.format(days))
-            conn.commit()
+                SELECT day, domain, SUM(message_count) as messages
+                FROM usage_daily 
+                WHERE day >= date('now', ?) 
+                GROUP BY day, domain 
+                ORDER BY day
+            """, (f'-{int(days)} days',))
+            return [dict(row) for row in cursor.fetchall()]
     
-    def backup_database(self, backup_path: str = None):
-        """Create a backup of the database"""
+    def get_token_usage(self, days: int = 30, group_by: str = 'day') -> List[Dict]:
+        """Get messages, prompt/response tokens and model latency per day, notice or user"""
+        since = f'-{int(days)} days'
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            if group_by == 'user':
+                cursor.execute("""
+                    SELECT u.id as user_id, u.name, u.email,
+                           SUM(d.message_count) as messages,
+                           SUM(d.prompt_tokens) as prompt_tokens,
+                           SUM(d.response_tokens) as response_tokens
+                    FROM user_daily_usage d
+                    JOIN users u ON u.id = d.user_id
+                    WHERE d.day >= date('now', ?)
+                    GROUP BY d.user_id
+                    ORDER BY SUM(d.prompt_tokens + d.response_tokens) DESC
+                """, (since,))
+            elif group_by in ('day', 'notice'):
+                key = 'day' if group_by == 'day' else 'notice_context'
+                cursor.execute(f"""
+                    SELECT {key} as {group_by},
+                           SUM(message_count) as messages,
+                           SUM(prompt_tokens) as prompt_tokens,
+                           SUM(response_tokens) as response_tokens,
+                           SUM(model_latency_ms) / NULLIF(SUM(model_calls), 0) as avg_model_latency_ms
+                    FROM usage_daily
+                    WHERE day >= date('now', ?)
+                    GROUP BY {key}
+                    ORDER BY {key}
+                """, (since,))
+            else:
+                raise ValueError(f"Unknown grouping: {group_by}")
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_user_tokens_today(self, user_id: int) -> int:
+        """Get the tokens (prompt + response) a user spent today"""
+        with self._connect() as conn:
+            row = conn.execute("""
+                SELECT prompt_tokens + response_tokens FROM user_daily_usage
+                WHERE day = date('now') AND user_id = ?
+            """, (user_id,)).fetchone()
+            return row[0] if row else 0
+
+    def cleanup_old_sessions(self, days: int = 30, batch_size: int = 1000) -> int:
+        """Delete sessions older than N days in small transactions; return how many were removed
+
+        Use retention.py to archive them instead of deleting.
+        """
+        removed = 0
+        while True:
+            with self._connect() as conn:
+                cursor = conn.execute("""
+                    DELETE FROM user_sessions WHERE id IN (
+                        SELECT id FROM user_sessions
+                        WHERE session_start < datetime('now', ?)
+                        LIMIT ?
+                    )
+                """, (f'-{int(days)} days', batch_size))
+            removed += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return removed
+
+    def get_cached_response(self, notice: str, question_key: str, min_created: float) -> Optional[Dict]:
+        """Fresh cache entry (id, response) for an exact key, or None"""
+        with self._connect() as conn:
+            row = conn.execute("""
+                SELECT id, response FROM response_cache
+                WHERE notice_context = ? AND question_key = ? AND created_at >= ?
+            """, (notice, question_key, min_created)).fetchone()
+            return dict(row) if row else None
+
+    def get_cache_candidates(self, notice: str, min_created: float, limit: int) -> List[Dict]:
+        """Fresh entries of a notice with an embedding, most recently hit first"""
+        with self._connect() as conn:
+            rows = conn.execute("""
+                SELECT id, response, embedding FROM response_cache
+                WHERE notice_context = ? AND created_at >= ? AND embedding IS NOT NULL
+                ORDER BY last_hit_at DESC
+                LIMIT ?
+            """, (notice, min_created, limit)).fetchall()
+            return [dict(row) for row in rows]
+
+    def record_cache_hit(self, entry_id: int, now: float):
+        """Bump the hit count and last hit time of a cache entry"""
+        with self._connect() as conn:
+            conn.execute("""
+                UPDATE response_cache
+                SET last_hit_at = ?, hit_count = hit_count + 1
+                WHERE id = ?
+            """, (now, entry_id))
+
+    def put_cached_response(self, notice: str, question_key: str, question: str, response: str,
+                            embedding: Optional[bytes], now: float):
+        """Store an answer, replacing any previous one for the same key"""
+        with self._connect() as conn:
+            conn.execute("""
+                INSERT INTO response_cache
+                    (notice_context, question_key, question, response, embedding, created_at, last_hit_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (notice_context, question_key) DO UPDATE SET
+                    question = excluded.question,
+                    response = excluded.response,
+                    embedding = excluded.embedding,
+                    created_at = excluded.created_at,
+                    last_hit_at = excluded.last_hit_at,
+                    hit_count = 0
+            """, (notice, question_key, question, response, embedding, now, now))
+
+    def evict_cached_responses(self, min_created: float, max_entries: int) -> int:
+        """Drop expired entries and trim the cache to max_entries (LRU); return how many were removed"""
+        with self._connect() as conn:
+            removed = conn.execute("DELETE FROM response_cache WHERE created_at < ?",
+                                   (min_created,)).rowcount
+            removed += conn.execute("""
+                DELETE FROM response_cache WHERE id IN (
+                    SELECT id FROM response_cache
+                    ORDER BY last_hit_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+            """, (max_entries,)).rowcount
+            return removed
+
+    def clear_cached_responses(self, notice: str = None):
+        """Remove every cache entry, or only those of one notice"""
+        with self._connect() as conn:
+            if notice is None:
+                conn.execute("DELETE FROM response_cache")
+            else:
+                conn.execute("DELETE FROM response_cache WHERE notice_context = ?", (notice,))
+
+    def count_cached_responses(self) -> int:
+        """Number of stored cache entries"""
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+    def put_oauth_state(self, state: str, expires_at: float, purge_before: float = None):
+        """Register a state; also purge states expired before purge_before when given"""
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO oauth_states (state, expires_at) VALUES (?, ?)",
+                         (state, expires_at))
+            if purge_before is not None:
+                # Range delete on idx_oauth_states_expires
+                conn.execute("DELETE FROM oauth_states WHERE expires_at <= ?", (purge_before,))
+
+    def consume_oauth_state(self, state: str, now: float) -> bool:
+        """Delete the state and return True if it existed and had not expired"""
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM oauth_states WHERE state = ? AND expires_at > ?",
+                                  (state, now))
+            return cursor.rowcount == 1
+
+    def purge_oauth_states(self, now: float) -> int:
+        """Drop expired states; return how many were removed"""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM oauth_states WHERE expires_at <= ?", (now,)).rowcount
+    
+    def backup_database(self, backup_path: str = None, pages: int = 256, progress=None):
+        """Create a backup of the database, copying `pages` pages per step.
+
+        ``progress(status, remaining, total)`` is called after each step.
+        Blocks until done; use backup.backup_service for backups off the request thread.
+        """
         if backup_path is None:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_path = f"editalbot_backup_{timestamp}.db"
         
-        with sqlite3.connect(self.db_path) as source:
-            with sqlite3.connect(backup_path) as backup:
-                source.backup(backup)
+        # A step-wise backup restarts from page 1 whenever another connection
+        # writes between steps, so under steady traffic it would never finish.
+        # Holding a read transaction pins one WAL snapshot for the whole copy:
+        # writers carry on, the backup is consistent as of its start, and the
+        # only cost is that checkpoints can't get past the snapshot until it ends.
+        source = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        backup = sqlite3.connect(backup_path)
+        try:
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            source.backup(backup, pages=pages, progress=progress)
+            source.execute("COMMIT")
+        finally:
+            backup.close()
+            source.close()
         
         return backup_path
 
 
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "sqlite").lower()
+DATABASE_PATH = os.getenv("DATABASE_PATH", "editalbot.db")
+
+
+def create_database(backend: str = DATABASE_BACKEND) -> Storage:
+    """Build the storage backend selected by DATABASE_BACKEND"""
+    if backend == 'sqlite':
+        return Database(DATABASE_PATH)
+    if backend == 'postgres':
+        from database_postgres import PostgresDatabase
+        return PostgresDatabase()
+    raise ValueError(f"Unknown DATABASE_BACKEND: {backend}")
+
+
 # Global database instance
-db = Database()
+db = create_database()
@@ -0,0 +1,587 @@
+"""
+PostgreSQL storage backend
+
+Selected with DATABASE_BACKEND=postgres, so several Streamlit replicas can
+share one database. Connections come from a ``psycopg_pool.ConnectionPool``
+(POSTGRES_POOL_MIN..POSTGRES_POOL_MAX connections to DATABASE_URL, waiting at
+most POSTGRES_POOL_TIMEOUT seconds for a free one); exports stream through
+server-side (named) cursors so large tables never sit in memory.
+
+The schema (``POSTGRES_MIGRATIONS`` in migrations.py) mirrors the SQLite one,
+including the rollup triggers. Every connection runs in UTC so timestamps
+match SQLite's CURRENT_TIMESTAMP. Needs PostgreSQL 12+ and
+``pip install "psycopg[binary]" psycopg-pool``.
+"""
+
+import os
+import re
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+
+from migrations import apply_postgres_migrations
+from storage import Storage, sql_timestamp
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://editalbot@localhost:5432/editalbot")
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", "2"))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", "10"))
+POSTGRES_POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", "10"))
+
+# Text search configuration of messages.search
+SEARCH_CONFIG = 'portuguese'
+
+# Columns of messages returned to callers (everything but the generated search vector)
+MESSAGE_COLUMNS = ("m.id, m.user_id, m.user_message, m.bot_response, m.notice_context, m.timestamp, "
+                   "m.prompt_tokens, m.response_tokens, m.model_latency_ms, m.model_name")
+
+
+def _export_value(value):
+    """Render values like the SQLite export does (timestamp strings, 0/1 booleans)"""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    return value
+
+
+class PostgresDatabase(Storage):
+    """PostgreSQL storage backend shared by every app replica"""
+
+    backend = 'postgres'
+    transient_errors = (psycopg.OperationalError,)
+
+    CONNECTION_KWARGS = {'row_factory': dict_row, 'options': '-c timezone=UTC'}
+
+    def __init__(self, conninfo: str = DATABASE_URL, min_size: int = POSTGRES_POOL_MIN,
+                 max_size: int = POSTGRES_POOL_MAX, timeout: float = POSTGRES_POOL_TIMEOUT):
+        super().__init__()
+        self.conninfo = conninfo
+        self.pool = ConnectionPool(
+            conninfo,
+            min_size=min_size,
+            max_size=max_size,
+            timeout=timeout,
+            kwargs=self.CONNECTION_KWARGS,
+            open=True,
+        )
+        self.init_database()
+
+    @contextmanager
+    def _connect(self):
+        """Yield a pooled connection; commits on success, rolls back on error"""
+        with self.pool.connection() as conn:
+            yield conn
+
+    def close(self):
+        """Close all pooled connections"""
+        self.pool.close()
+
+    def pool_stats(self) -> Dict:
+        """Return connection pool occupancy counters"""
+        stats = self.pool.get_stats()
+        idle = stats.get('pool_available', 0)
+        return {
+            'in_use': stats.get('pool_size', 0) - idle,
+            'idle': idle,
+            'waiting': stats.get('requests_waiting', 0),
+            'timeouts': stats.get('requests_errors', 0),
+        }
+
+    def init_database(self):
+        """Initialize database, applying pending schema migrations"""
+        # Dedicated autocommit connection: every migration commits on its own,
+        # and the session-level migration lock is released when it closes
+        with psycopg.connect(self.conninfo, autocommit=True, **self.CONNECTION_KWARGS) as conn:
+            apply_postgres_migrations(conn)
+
+    def get_or_create_user(self, email: str, name: str, profile_picture_url: str = None) -> Dict:
+        """Create the user or record a new access, in a single UPSERT"""
+        with self._connect() as conn:
+            user = conn.execute("""
+                INSERT INTO users (email, name, profile_picture_url, domain)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (email) DO UPDATE SET
+                    last_access = LOCALTIMESTAMP,
+                    access_count = users.access_count + 1,
+                    name = EXCLUDED.name,
+                    profile_picture_url = EXCLUDED.profile_picture_url,
+                    updated_at = LOCALTIMESTAMP
+                RETURNING *
+            """, (email, name, profile_picture_url, email.split('@')[1].lower())).fetchone()
+        return self._remember_user(email, user)
+
+    def create_session(self, user_id: int, ip_address: str = None, user_agent: str = None) -> int:
+        """Create a new user session"""
+        with self._connect() as conn:
+            return conn.execute("""
+                INSERT INTO user_sessions (user_id, ip_address, user_agent, last_activity)
+                VALUES (%s, %s, %s, LOCALTIMESTAMP)
+                RETURNING id
+            """, (user_id, ip_address, user_agent)).fetchone()['id']
+
+    def end_session(self, session_id: int):
+        """End a user session"""
+        with self._connect() as conn:
+            conn.execute("""
+                UPDATE user_sessions
+                SET session_end = LOCALTIMESTAMP, last_activity = LOCALTIMESTAMP
+                WHERE id = %s AND session_end IS NULL
+            """, (session_id,))
+
+    def touch_sessions(self, activity: Dict[int, str]) -> List[int]:
+        """Record the last activity ('YYYY-MM-DD HH:MM:SS' UTC) of open sessions in one batch;
+        return the ids that are closed or gone"""
+        with self._connect() as conn:
+            rows = conn.execute("""
+                UPDATE user_sessions AS s SET last_activity = v.last_activity
+                FROM unnest(%s::bigint[], %s::timestamp[]) AS v (id, last_activity)
+                WHERE s.id = v.id AND s.session_end IS NULL
+                RETURNING s.id
+            """, (list(activity), list(activity.values()))).fetchall()
+        touched = {row['id'] for row in rows}
+        return [session_id for session_id in activity if session_id not in touched]
+
+    def close_idle_sessions(self, idle_minutes: int = 30) -> List[int]:
+        """End every open session idle for idle_minutes, at its last activity; return their ids"""
+        with self._connect() as conn:
+            rows = conn.execute("""
+                UPDATE user_sessions SET session_end = last_activity
+                WHERE session_end IS NULL
+                  AND last_activity < LOCALTIMESTAMP - make_interval(mins => %s::int)
+                RETURNING id
+            """, (int(idle_minutes),)).fetchall()
+            return [row['id'] for row in rows]
+
+    def cleanup_old_sessions(self, days: int = 30, batch_size: int = 1000) -> int:
+        """Delete sessions older than N days in small transactions; return how many were removed"""
+        removed = 0
+        while True:
+            with self._connect() as conn:
+                deleted = conn.execute("""
+                    DELETE FROM user_sessions WHERE id IN (
+                        SELECT id FROM user_sessions
+                        WHERE session_start < LOCALTIMESTAMP - make_interval(days => %s::int)
+                        LIMIT %s
+                    )
+                """, (int(days), batch_size)).rowcount
+            removed += deleted
+            if deleted < batch_size:
+                return removed
+
+    def save_message(self, user_id: int, user_message: str, bot_response: str, notice_context: str = None,
+                     prompt_tokens: int = None, response_tokens: int = None,
+                     model_latency_ms: float = None, model_name: str = None):
+        """Save a message conversation with its token usage"""
+        with self._connect() as conn:
+            conn.execute("""
+                INSERT INTO messages (user_id, user_message, bot_response, notice_context,
+                                      prompt_tokens, response_tokens, model_latency_ms, model_name)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """, (user_id, user_message, bot_response, notice_context,
+                  prompt_tokens, response_tokens, model_latency_ms, model_name))
+
+    def save_messages(self, messages: List[Dict]):
+        """Save a batch of message conversations in a single transaction"""
+        rows = [{**dict.fromkeys(self.MESSAGE_USAGE_FIELDS), **message} for message in messages]
+        with self._connect() as conn:
+            # executemany pipelines the inserts: one round trip for the whole batch
+            conn.cursor().executemany("""
+                INSERT INTO messages (user_id, user_message, bot_response, notice_context,
+                                      prompt_tokens, response_tokens, model_latency_ms, model_name)
+                VALUES (%(user_id)s, %(user_message)s, %(bot_response)s, %(notice_context)s,
+                        %(prompt_tokens)s, %(response_tokens)s, %(model_latency_ms)s, %(model_name)s)
+            """, rows)
+
+    def get_user_messages(self, user_id: int, limit: int = 50) -> List[Dict]:
+        """Get messages for a specific user"""
+        with self._connect() as conn:
+            return conn.execute(f"""
+                SELECT {MESSAGE_COLUMNS} FROM messages m
+                WHERE m.user_id = %s
+                ORDER BY m.timestamp DESC
+                LIMIT %s
+            """, (user_id, limit)).fetchall()
+
+    def get_all_users(self, limit: int = 100) -> List[Dict]:
+        """Get all users with pagination"""
+        with self._connect() as conn:
+            return conn.execute("""
+                SELECT * FROM users
+                WHERE is_active
+                ORDER BY last_access DESC
+                LIMIT %s
+            """, (limit,)).fetchall()
+
+    def get_users_page(self, cursor: Optional[Tuple] = None,
+                       page_size: int = 50) -> Tuple[List[Dict], Optional[Tuple]]:
+        """Get a page of active users, most recent access first (keyset on last_access, id)"""
+        with self._connect() as conn:
+            if cursor is None:
+                rows = conn.execute("""
+                    SELECT * FROM users
+                    WHERE is_active
+                    ORDER BY last_access DESC, id DESC
+                    LIMIT %s
+                """, (page_size,)).fetchall()
+            else:
+                rows = conn.execute("""
+                    SELECT * FROM users
+                    WHERE is_active AND (last_access, id) < (%s, %s)
+                    ORDER BY last_access DESC, id DESC
+                    LIMIT %s
+                """, (*cursor, page_size)).fetchall()
+        next_cursor = (rows[-1]['last_access'], rows[-1]['id']) if len(rows) == page_size else None
+        return rows, next_cursor
+
+    def get_messages_page(self, cursor: Optional[Tuple] = None, page_size: int = 50,
+                          user_id: int = None) -> Tuple[List[Dict], Optional[Tuple]]:
+        """Get a page of messages with user name and email, newest first (keyset on timestamp, id)"""
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append("m.user_id = %s")
+            params.append(user_id)
+        if cursor is not None:
+            conditions.append("(m.timestamp, m.id) < (%s, %s)")
+            params.extend(cursor)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._connect() as conn:
+            rows = conn.execute(f"""
+                SELECT {MESSAGE_COLUMNS}, u.name, u.email
+                FROM messages m
+                JOIN users u ON u.id = m.user_id
+                {where}
+                ORDER BY m.timestamp DESC, m.id DESC
+                LIMIT %s
+            """, (*params, page_size)).fetchall()
+        next_cursor = (rows[-1]['timestamp'], rows[-1]['id']) if len(rows) == page_size else None
+        return rows, next_cursor
+
+    def search_messages(self, query: str, notice: str = None, since=None,
+                        limit: int = 20) -> List[Dict]:
+        """Full-text search over questions and answers, best matches first.
+
+        Same result shape as the SQLite backend; ``rank`` is the negated
+        ts_rank so that lower is better there too.
+        """
+        terms = re.findall(r"\w+", query)
+        if not terms:
+            return []
+        # Only \w+ terms reach to_tsquery; prefix-match the last one
+        match = " & ".join(terms) + ":*"
+
+        conditions, params = ["m.search @@ q.query"], []
+        if notice:
+            conditions.append("m.notice_context = %s")
+            params.append(notice)
+        if since:
+            conditions.append("m.timestamp >= %s")
+            params.append(sql_timestamp(since))
+
+        with self._connect() as conn:
+            return conn.execute(f"""
+                SELECT m.id, m.user_id, u.name, u.email, m.notice_context, m.timestamp,
+                       m.user_message, m.bot_response,
+                       ts_headline('{SEARCH_CONFIG}', m.user_message, q.query,
+                                   'StartSel=**, StopSel=**, MaxWords=16, MinWords=6') as question_snippet,
+                       ts_headline('{SEARCH_CONFIG}', COALESCE(m.bot_response, ''), q.query,
+                                   'StartSel=**, StopSel=**, MaxWords=24, MinWords=8') as response_snippet,
+                       -ts_rank(m.search, q.query) as rank
+                FROM messages m
+                CROSS JOIN to_tsquery('{SEARCH_CONFIG}', %s) AS q(query)
+                JOIN users u ON u.id = m.user_id
+                WHERE {' AND '.join(conditions)}
+                ORDER BY rank
+                LIMIT %s
+            """, (match, *params, limit)).fetchall()
+
+    def get_table_columns(self, table: str) -> List[Tuple[str, str]]:
+        """Get (name, declared type) of the columns of an exportable table"""
+        if table not in self.EXPORT_TABLES:
+            raise ValueError(f"Unknown table: {table}")
+        with self._connect() as conn:
+            rows = conn.execute("""
+                SELECT column_name, data_type FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = %s
+                  AND is_generated = 'NEVER'
+                ORDER BY ordinal_position
+            """, (table,)).fetchall()
+        # Declared types as the exporters expect them (timestamps are written as text)
+        return [(row['column_name'], 'TEXT' if row['data_type'].startswith('timestamp')
+                 else row['data_type'].upper()) for row in rows]
+
+    def iter_export_rows(self, table: str, since=None, until=None, notice: str = None,
+                         chunk_size: int = 5000) -> Iterator[List[Dict]]:
+        """Yield rows of a table in id order, chunk_size rows at a time.
+
+        Streams through a server-side cursor: the server keeps the result
+        and sends chunk_size rows per fetch, so memory stays bounded. The
+        pooled connection is held until the iteration ends.
+        """
+        if table not in self.EXPORT_TABLES:
+            raise ValueError(f"Unknown table: {table}")
+        date_column = self.EXPORT_TABLES[table]
+        columns = ", ".join(name for name, _ in self.get_table_columns(table))
+
+        conditions, params = ["TRUE"], []
+        if since:
+            conditions.append(f"{date_column} >= %s")
+            params.append(sql_timestamp(since))
+        if until:
+            conditions.append(f"{date_column} < %s")
+            params.append(sql_timestamp(until))
+        if notice:
+            if table != 'messages':
+                raise ValueError("The notice filter only applies to messages")
+            conditions.append("notice_context = %s")
+            params.append(notice)
+
+        with self._connect() as conn:
+            with conn.cursor(name=f"export_{table}") as cursor:
+                cursor.itersize = chunk_size
+                cursor.execute(f"""
+                    SELECT {columns} FROM {table}
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY id
+                """, params)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        return
+                    yield [{key: _export_value(value) for key, value in row.items()} for row in rows]
+
+    def data_version(self) -> Tuple:
+        """Cheap marker that changes with every new message, session or login (a cache key)"""
+        with self._connect() as conn:
+            return tuple(conn.execute("""
+                SELECT (SELECT MAX(id) FROM messages) AS messages,
+                       (SELECT MAX(id) FROM user_sessions) AS sessions,
+                       (SELECT MAX(last_access) FROM users WHERE is_active) AS last_access
+            """).fetchone().values())
+
+    def get_user_stats(self) -> Dict:
+        """Get general user statistics"""
+        with self._connect() as conn:
+            # Active users by domain (rollup maintained by triggers)
+            domain_stats = {row['domain']: row['user_count'] for row in conn.execute("""
+                SELECT domain, user_count FROM domain_users WHERE user_count > 0
+            """)}
+            recent_users = conn.execute("""
+                SELECT COUNT(*) as recent FROM users
+                WHERE last_access >= LOCALTIMESTAMP - interval '7 days' AND is_active
+            """).fetchone()['recent']
+            total_messages = conn.execute("""
+                SELECT COALESCE(SUM(message_count), 0) as total FROM usage_daily
+            """).fetchone()['total']
+        return {
+            'total_users': sum(domain_stats.values()),
+            'domain_stats': domain_stats,
+            'recent_users': recent_users,
+            'total_messages': total_messages,
+        }
+
+    def get_notice_usage(self, days: int = None) -> List[Dict]:
+        """Get statistics about notice usage (optionally for the last N days)"""
+        since = "AND day >= CURRENT_DATE - %s::int" if days else ""
+        with self._connect() as conn:
+            return conn.execute(f"""
+                SELECT notice_context, SUM(message_count) as usage_count
+                FROM usage_daily
+                WHERE notice_context != '' {since}
+                GROUP BY notice_context
+                ORDER BY usage_count DESC
+            """, (int(days),) if days else ()).fetchall()
+
+    def get_activity_buckets(self, days: int = 7, bucket: str = 'day') -> List[Dict]:
+        """Get messages and active users per time bucket ('hour', 'day', 'week' or 'month')"""
+        with self._connect() as conn:
+            if bucket == 'hour':
+                # Hourly resolution isn't rolled up; range scan on idx_messages_timestamp
+                return conn.execute("""
+                    SELECT to_char(date_trunc('hour', timestamp), 'YYYY-MM-DD HH24:00') as bucket,
+                           COUNT(*) as messages,
+                           COUNT(DISTINCT user_id) as active_users
+                    FROM messages
+                    WHERE timestamp >= LOCALTIMESTAMP - make_interval(days => %s::int)
+                    GROUP BY 1
+                    ORDER BY 1
+                """, (int(days),)).fetchall()
+            # Weeks start on Monday, like the SQLite backend
+            bucket_expr = {
+                'day': "day",
+                'week': "date_trunc('week', day)::date",
+                'month': "date_trunc('month', day)::date",
+            }[bucket]
+            return conn.execute(f"""
+                SELECT {bucket_expr}::text as bucket,
+                       SUM(message_count) as messages,
+                       COUNT(DISTINCT user_id) as active_users
+                FROM user_daily_usage
+                WHERE day >= CURRENT_DATE - %s::int
+                GROUP BY 1
+                ORDER BY 1
+            """, (int(days),)).fetchall()
+
+    def get_daily_usage(self, days: int = 30) -> List[Dict]:
+        """Get messages, sessions and active users per day for the last N days"""
+        with self._connect() as conn:
+            return conn.execute("""
+                SELECT day::text as day,
+                       SUM(message_count) as messages,
+                       SUM(session_count) as sessions,
+                       COUNT(*) as active_users
+                FROM user_daily_usage
+                WHERE day >= CURRENT_DATE - %s::int
+                GROUP BY 1
+                ORDER BY 1
+            """, (int(days),)).fetchall()
+
+    def get_domain_usage(self, days: int = 30) -> List[Dict]:
+        """Get messages per day and user domain for the last N days"""
+        with self._connect() as conn:
+            return conn.execute("""
+                SELECT day::text as day, domain, SUM(message_count) as messages
+                FROM usage_daily
+                WHERE day >= CURRENT_DATE - %s::int
+                GROUP BY 1, 2
+                ORDER BY 1
+            """, (int(days),)).fetchall()
+
+    def get_token_usage(self, days: int = 30, group_by: str = 'day') -> List[Dict]:
+        """Get messages, prompt/response tokens and model latency per day, notice or user"""
+        with self._connect() as conn:
+            if group_by == 'user':
+                return conn.execute("""
+                    SELECT u.id as user_id, u.name, u.email,
+                           SUM(d.message_count) as messages,
+                           SUM(d.prompt_tokens) as prompt_tokens,
+                           SUM(d.response_tokens) as response_tokens
+                    FROM user_daily_usage d
+                    JOIN users u ON u.id = d.user_id
+                    WHERE d.day >= CURRENT_DATE - %s::int
+                    GROUP BY u.id
+                    ORDER BY SUM(d.prompt_tokens + d.response_tokens) DESC
+                """, (int(days),)).fetchall()
+            if group_by in ('day', 'notice'):
+                key = 'day::text' if group_by == 'day' else 'notice_context'
+                return conn.execute(f"""
+                    SELECT {key} as {group_by},
+                           SUM(message_count) as messages,
+                           SUM(prompt_tokens) as prompt_tokens,
+                           SUM(response_tokens) as response_tokens,
+                           SUM(model_latency_ms) / NULLIF(SUM(model_calls), 0) as avg_model_latency_ms
+                    FROM usage_daily
+                    WHERE day >= CURRENT_DATE - %s::int
+                    GROUP BY 1
+                    ORDER BY 1
+                """, (int(days),)).fetchall()
+            raise ValueError(f"Unknown grouping: {group_by}")
+
+    def get_user_tokens_today(self, user_id: int) -> int:
+        """Get the tokens (prompt + response) a user spent today"""
+        with self._connect() as conn:
+            row = conn.execute("""
+                SELECT prompt_tokens + response_tokens as tokens FROM user_daily_usage
+                WHERE day = CURRENT_DATE AND user_id = %s
+            """, (user_id,)).fetchone()
+            return row['tokens'] if row else 0
+
+    def get_cached_response(self, notice: str, question_key: str, min_created: float) -> Optional[Dict]:
+        """Fresh cache entry (id, response) for an exact key, or None"""
+        with self._connect() as conn:
+            return conn.execute("""
+                SELECT id, response FROM response_cache
+                WHERE notice_context = %s AND question_key = %s AND created_at >= %s
+            """, (notice, question_key, min_created)).fetchone()
+
+    def get_cache_candidates(self, notice: str, min_created: float, limit: int) -> List[Dict]:
+        """Fresh entries of a notice with an embedding, most recently hit first"""
+        with self._connect() as conn:
+            return conn.execute("""
+                SELECT id, response, embedding FROM response_cache
+                WHERE notice_context = %s AND created_at >= %s AND embedding IS NOT NULL
+                ORDER BY last_hit_at DESC
+                LIMIT %s
+            """, (notice, min_created, limit)).fetchall()
+
+    def record_cache_hit(self, entry_id: int, now: float):
+        """Bump the hit count and last hit time of a cache entry"""
+        with self._connect() as conn:
+            conn.execute("""
+                UPDATE response_cache
+                SET last_hit_at = %s, hit_count = hit_count + 1
+                WHERE id = %s
+            """, (now, entry_id))
+
+    def put_cached_response(self, notice: str, question_key: str, question: str, response: str,
+                            embedding: Optional[bytes], now: float):
+        """Store an answer, replacing any previous one for the same key"""
+        with self._connect() as conn:
+            conn.execute("""
+                INSERT INTO response_cache
+                    (notice_context, question_key, question, response, embedding, created_at, last_hit_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (notice_context, question_key) DO UPDATE SET
+                    question = EXCLUDED.question,
+                    response = EXCLUDED.response,
+                    embedding = EXCLUDED.embedding,
+                    created_at = EXCLUDED.created_at,
+                    last_hit_at = EXCLUDED.last_hit_at,
+                    hit_count = 0
+            """, (notice, question_key, question, response, embedding, now, now))
+
+    def evict_cached_responses(self, min_created: float, max_entries: int) -> int:
+        """Drop expired entries and trim the cache to max_entries (LRU); return how many were removed"""
+        with self._connect() as conn:
+            removed = conn.execute("DELETE FROM response_cache WHERE created_at < %s",
+                                   (min_created,)).rowcount
+            removed += conn.execute("""
+                DELETE FROM response_cache WHERE id IN (
+                    SELECT id FROM response_cache
+                    ORDER BY last_hit_at DESC
+                    OFFSET %s
+                )
+            """, (max_entries,)).rowcount
+            return removed
+
+    def clear_cached_responses(self, notice: str = None):
+        """Remove every cache entry, or only those of one notice"""
+        with self._connect() as conn:
+            if notice is None:
+                conn.execute("DELETE FROM response_cache")
+            else:
+                conn.execute("DELETE FROM response_cache WHERE notice_context = %s", (notice,))
+
+    def count_cached_responses(self) -> int:
+        """Number of stored cache entries"""
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) as entries FROM response_cache").fetchone()['entries']
+
+    def put_oauth_state(self, state: str, expires_at: float, purge_before: float = None):
+        """Register a state; also purge states expired before purge_before when given"""
+        with self._connect() as conn:
+            conn.execute("""
+                INSERT INTO oauth_states (state, expires_at) VALUES (%s, %s)
+                ON CONFLICT (state) DO UPDATE SET expires_at = EXCLUDED.expires_at
+            """, (state, expires_at))
+            if purge_before is not None:
+                conn.execute("DELETE FROM oauth_states WHERE expires_at <= %s", (purge_before,))
+
+    def consume_oauth_state(self, state: str, now: float) -> bool:
+        """Delete the state and return True if it existed and had not expired"""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM oauth_states WHERE state = %s AND expires_at > %s",
+                                (state, now)).rowcount == 1
+
+    def purge_oauth_states(self, now: float) -> int:
+        """Drop expired states; return how many were removed"""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM oauth_states WHERE expires_at <= %s", (now,)).rowcount
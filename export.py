@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Streaming export of EditalBot data to CSV, JSONL or Parquet
+
+Rows are read from the database in fixed-size chunks and written as they
+arrive, so memory stays bounded no matter how many messages are exported.
+CSV and JSONL files are gzip-compressed when the path ends with ``.gz``;
+Parquet files use zstd compression (requires pyarrow).
+
+Usage:
+    python export.py messages mensagens.parquet --since 2025-03-01 --until 2025-08-01
+    python export.py messages edital001.jsonl.gz --notice "Edital 001/2025"
+    python export.py users usuarios.csv
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import os
+from datetime import datetime
+from typing import Optional
+
+from database import db
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+
+
+def detect_format(path: str) -> str:
+    """Infer the export format from the file extension"""
+    name = path.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    for fmt in EXPORT_FORMATS:
+        if name.endswith('.' + fmt):
+            return fmt
+    raise ValueError(f"Cannot infer export format from {path!r}; use one of {EXPORT_FORMATS}")
+
+
+def default_export_path(table: str, fmt: str) -> str:
+    """Build a timestamped path inside EXPORT_DIR"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    suffix = 'parquet' if fmt == 'parquet' else f"{fmt}.gz"
+    return os.path.join(EXPORT_DIR, f"editalbot_{table}_{timestamp}.{suffix}")
+
+
+def _open_text(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+def _write_csv(chunks, path, columns) -> int:
+    rows = 0
+    with _open_text(path) as f:
+        writer = csv.DictWriter(f, fieldnames=[name for name, _ in columns])
+        writer.writeheader()
+        for chunk in chunks:
+            writer.writerows(chunk)
+            rows += len(chunk)
+    return rows
+
+
+def _write_jsonl(chunks, path, columns) -> int:
+    rows = 0
+    with _open_text(path) as f:
+        for chunk in chunks:
+            for row in chunk:
+                f.write(json.dumps(row, ensure_ascii=False, default=str))
+                f.write("\n")
+            rows += len(chunk)
+    return rows
+
+
+def _arrow_type(declared: str):
+    import pyarrow as pa
+    declared = (declared or '').upper()
+    if 'INT' in declared or 'BOOL' in declared:
+        return pa.int64()
+    if 'REAL' in declared or 'FLOA' in declared or 'DOUB' in declared:
+        return pa.float64()
+    if 'BLOB' in declared:
+        return pa.binary()
+    return pa.string()
+
+
+def _write_parquet(chunks, path, columns) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("pyarrow is required for Parquet export (pip install pyarrow)")
+
+    # Schema from the declared SQLite column types, so all-NULL chunks keep their type
+    schema = pa.schema([(name, _arrow_type(declared)) for name, declared in columns])
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+            rows += len(chunk)
+    return rows
+
+
+WRITERS = {
+    'csv': _write_csv,
+    'jsonl': _write_jsonl,
+    'parquet': _write_parquet,
+}
+
+
+def export_table(table: str, path: Optional[str] = None, fmt: Optional[str] = None,
+                 since=None, until=None, notice: Optional[str] = None,
+                 chunk_size: int = 5000, database=db) -> dict:
+    """Stream a table to a file; return the path and number of rows written"""
+    if fmt is None:
+        fmt = detect_format(path) if path else 'parquet'
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if path is None:
+        path = default_export_path(table, fmt)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    columns = database.get_table_columns(table)
+    chunks = database.iter_export_rows(table, since=since, until=until, notice=notice,
+                                       chunk_size=chunk_size)
+    rows = WRITERS[fmt](chunks, path, columns)
+    return {'path': path, 'rows': rows, 'format': fmt, 'bytes': os.path.getsize(path)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta dados do EditalBot")
+    parser.add_argument('table', choices=sorted(db.EXPORT_TABLES))
+    parser.add_argument('path', nargs='?', help="arquivo de saída (.csv, .jsonl, .parquet, opcionalmente .gz)")
+    parser.add_argument('--format', choices=EXPORT_FORMATS)
+    parser.add_argument('--since', help="data inicial (AAAA-MM-DD)")
+    parser.add_argument('--until', help="data final, exclusiva (AAAA-MM-DD)")
+    parser.add_argument('--notice', help="somente mensagens deste edital")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    result = export_table(args.table, args.path, args.format, since=args.since,
+                          until=args.until, notice=args.notice, chunk_size=args.chunk_size)
+    print(f"{result['rows']} linhas exportadas para {result['path']} ({result['bytes']} bytes)")
+
+
+if __name__ == "__main__":
+    main()
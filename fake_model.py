@@ -0,0 +1,161 @@
+"""
+Offline stand-in for google.generativeai.GenerativeModel.
+
+Returns canned answers split into chunks with configurable delays, so the
+streaming path can be exercised without network access or an API key:
+
+    from fake_model import FakeGenerativeModel
+    model = FakeGenerativeModel(first_chunk_delay=0.3, chunk_delay=0.05)
+    for chunk in model.generate_content("qual o prazo?", stream=True):
+        print(chunk.text, end="")
+
+``first_chunk_latency`` takes a callable returning seconds, sampled on every
+call instead of the fixed ``first_chunk_delay``, e.g. to model a latency
+distribution in bench/load_test.py.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from typing import AsyncIterator, Callable, Iterator, List, Optional
+
+
+class FakeAPIError(Exception):
+    """Mimics a google.api_core error carrying an HTTP status code"""
+
+    def __init__(self, code: int, message: str = "simulated API error"):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FakePart:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeUsageMetadata:
+    """Mimics GenerateContentResponse.usage_metadata"""
+
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+def _count_tokens(text) -> int:
+    return max(1, len(str(text)) // 4)
+
+
+class FakeResponse:
+    """Mimics a (chunk of a) GenerateContentResponse"""
+
+    def __init__(self, text: str, usage_metadata: Optional[FakeUsageMetadata] = None):
+        self.parts = [FakePart(text)] if text else []
+        self.usage_metadata = usage_metadata
+
+    @property
+    def text(self) -> str:
+        return "".join(part.text for part in self.parts)
+
+
+class FakeStreamResponse:
+    """Iterable of FakeResponse chunks, like generate_content(stream=True)"""
+
+    def __init__(self, chunks: Iterator[FakeResponse]):
+        self._chunks = chunks
+
+    def __iter__(self):
+        return self._chunks
+
+
+class FakeAsyncStreamResponse:
+    """Async iterable of FakeResponse chunks, like generate_content_async(stream=True)"""
+
+    def __init__(self, chunks: AsyncIterator[FakeResponse]):
+        self._chunks = chunks
+
+    def __aiter__(self):
+        return self._chunks
+
+
+class FakeGenerativeModel:
+    def __init__(self, response_text: Optional[str] = None,
+                 responder: Optional[Callable[[str], str]] = None,
+                 chunk_size: int = 24, first_chunk_delay: float = 0.2,
+                 chunk_delay: float = 0.05, model_name: str = "fake-model",
+                 failure_rate: float = 0.0, failure_code: int = 429, fail_first: int = 0,
+                 first_chunk_latency: Optional[Callable[[], float]] = None):
+        self.response_text = response_text
+        self.responder = responder
+        self.chunk_size = chunk_size
+        self.first_chunk_delay = first_chunk_delay
+        self.chunk_delay = chunk_delay
+        self.first_chunk_latency = first_chunk_latency
+        self.model_name = model_name
+        # Error injection: fail the first `fail_first` calls, then a `failure_rate` fraction
+        self.failure_rate = failure_rate
+        self.failure_code = failure_code
+        self.fail_first = fail_first
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _maybe_fail(self):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        if calls <= self.fail_first or (self.failure_rate and random.random() < self.failure_rate):
+            raise FakeAPIError(self.failure_code)
+
+    def _first_chunk_delay(self) -> float:
+        if self.first_chunk_latency is not None:
+            return max(0.0, self.first_chunk_latency())
+        return self.first_chunk_delay
+
+    def _answer(self, contents) -> str:
+        if self.responder is not None:
+            return self.responder(contents)
+        if self.response_text is not None:
+            return self.response_text
+        return f"Resposta simulada para: {contents}"
+
+    def _split(self, text: str) -> List[str]:
+        return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+
+    @staticmethod
+    def _usage(contents, pieces: List[str], upto: int) -> FakeUsageMetadata:
+        # Like the real API, streamed chunks report the running totals
+        return FakeUsageMetadata(_count_tokens(contents), _count_tokens("".join(pieces[:upto])))
+
+    def _iter_chunks(self, contents, pieces: List[str]) -> Iterator[FakeResponse]:
+        for index, piece in enumerate(pieces):
+            if index:
+                time.sleep(self.chunk_delay)
+            yield FakeResponse(piece, self._usage(contents, pieces, index + 1))
+
+    async def _aiter_chunks(self, contents, pieces: List[str]) -> AsyncIterator[FakeResponse]:
+        for index, piece in enumerate(pieces):
+            if index:
+                await asyncio.sleep(self.chunk_delay)
+            yield FakeResponse(piece, self._usage(contents, pieces, index + 1))
+
+    def generate_content(self, contents, stream: bool = False, **kwargs):
+        self._maybe_fail()
+        pieces = self._split(self._answer(contents))
+        if stream:
+            # Like the real client, the call returns once the first chunk has arrived
+            time.sleep(self._first_chunk_delay())
+            return FakeStreamResponse(self._iter_chunks(contents, pieces))
+
+        time.sleep(self._first_chunk_delay() + self.chunk_delay * (len(pieces) - 1))
+        return FakeResponse("".join(pieces), self._usage(contents, pieces, len(pieces)))
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        self._maybe_fail()
+        pieces = self._split(self._answer(contents))
+        if stream:
+            await asyncio.sleep(self._first_chunk_delay())
+            return FakeAsyncStreamResponse(self._aiter_chunks(contents, pieces))
+
+        await asyncio.sleep(self._first_chunk_delay() + self.chunk_delay * (len(pieces) - 1))
+        return FakeResponse("".join(pieces), self._usage(contents, pieces, len(pieces)))
@@ -1,5 +1,45 @@
+import logging
+import os
+import time
+import uuid
+from collections import deque
+
 import streamlit as st
 from database import db
+from message_writer import message_writer
+from session_tracker import session_tracker
+from notices import notice_index, build_notice_prompt
+from response_cache import response_cache, normalize_question
+from gemini_scheduler import gemini_scheduler, estimate_tokens
+from gemini_async import GEMINI_ASYNC, gemini_async
+from single_flight import GEMINI_COALESCE, request_coalescer
+from telemetry import telemetry, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+# Timings of the most recent streamed responses (seconds)
+response_timings = deque(maxlen=1000)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() != "false"
+
+# Expected answer size reserved against the tokens-per-minute limit
+RESPONSE_TOKEN_ESTIMATE = int(os.getenv("RESPONSE_TOKEN_ESTIMATE", "500"))
+
+# Daily token budget per user (prompt + response tokens); 0 disables it
+DAILY_TOKEN_QUOTA = int(os.getenv("DAILY_TOKEN_QUOTA", "0"))
+
+class TokenQuotaExceededError(Exception):
+    """Raised before calling the model when the user spent the daily token quota"""
+
+# Component counters exported next to the stage latencies
+telemetry.register_gauges('message_writer', message_writer.metrics)
+telemetry.register_gauges('gemini_scheduler', gemini_scheduler.metrics)
+telemetry.register_gauges('gemini_async', gemini_async.metrics)
+telemetry.register_gauges('coalescer', request_coalescer.metrics)
+telemetry.register_gauges('response_cache', response_cache.stats)
+telemetry.register_gauges('db_pool', db.pool_stats)
+telemetry.register_gauges('session_tracker', session_tracker.metrics)
+start_metrics_server()
 
 def map_role(role):
     if role == "model":
@@ -7,43 +47,318 @@ def map_role(role):
     else:
         return role
 
-def fetch_gemini_response(user_query):
-    response = st.session_state.chat_session.model.generate_content(user_query)
-    return response.parts[0].text
+def build_prompt(user_query, notice=None, history=None, k=4):
+    """Attach the conversation context and the most relevant notice passages to the question"""
+    prompt = user_query
+    if notice:
+        passages = notice_index.search(notice, user_query, k=k)
+        prompt = build_notice_prompt(user_query, notice, passages)
+
+    context = history.context() if history is not None else ""
+    if context:
+        prompt = f"{context}\n\n{prompt}"
+    return prompt
+
+def current_user_key():
+    """Key used to queue this session's model calls fairly"""
+    return st.session_state.get('user_id') or st.session_state.get('user_email')
+
+def current_session_key():
+    """Identifies this browser session; a new question cancels its pending call"""
+    if 'gemini_session_key' not in st.session_state:
+        st.session_state['gemini_session_key'] = uuid.uuid4().hex
+    return st.session_state['gemini_session_key']
+
+def generate(model, prompt, user_key=None, cancel_key=None):
+    """Run a model call on the async backend or through the threaded scheduler"""
+    tokens = estimate_tokens(prompt) + RESPONSE_TOKEN_ESTIMATE
+    if GEMINI_ASYNC:
+        return gemini_async.call(lambda: model.generate_content_async(prompt),
+                                 user_key=user_key, estimated_tokens=tokens, cancel_key=cancel_key)
+    return gemini_scheduler.call(lambda: model.generate_content(prompt),
+                                 user_key=user_key, estimated_tokens=tokens)
+
+def generate_stream(model, prompt, user_key=None, cancel_key=None):
+    """Open a streaming model call; returns an iterable of chunks"""
+    tokens = estimate_tokens(prompt) + RESPONSE_TOKEN_ESTIMATE
+    if GEMINI_ASYNC:
+        return gemini_async.stream(lambda: model.generate_content_async(prompt, stream=True),
+                                   user_key=user_key, estimated_tokens=tokens, cancel_key=cancel_key)
+    # The scheduler gates the call until the first chunk has arrived
+    return gemini_scheduler.call(lambda: model.generate_content(prompt, stream=True),
+                                 user_key=user_key, estimated_tokens=tokens)
+
+def model_name(model):
+    return getattr(model, 'model_name', type(model).__name__)
+
+def flight_key(model, prompt, notice=None):
+    """Concurrent requests with the same key share one upstream call"""
+    return (notice or '', normalize_question(prompt), model_name(model))
+
+def response_usage(response, prompt, text, model, latency):
+    """Token counts from usage_metadata (estimated when absent) and model latency"""
+    metadata = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(metadata, 'prompt_token_count', None)
+    response_tokens = getattr(metadata, 'candidates_token_count', None)
+    return {
+        'prompt_tokens': prompt_tokens if prompt_tokens is not None else estimate_tokens(prompt),
+        'response_tokens': response_tokens if response_tokens is not None else estimate_tokens(text),
+        'model_latency_ms': latency * 1000,
+        'model_name': model_name(model),
+    }
+
+def check_token_quota():
+    """Refuse new model calls once the user reached DAILY_TOKEN_QUOTA"""
+    if not DAILY_TOKEN_QUOTA or 'user_id' not in st.session_state:
+        return
+    used = db.get_user_tokens_today(st.session_state['user_id'])
+    if used >= DAILY_TOKEN_QUOTA:
+        raise TokenQuotaExceededError(f"Daily token quota reached ({used}/{DAILY_TOKEN_QUOTA})")
+
+def is_cacheable(history=None):
+    """Answers depend on the conversation once there is one, so only a fresh question is cached"""
+    return RESPONSE_CACHE_ENABLED and (history is None or not history.context())
+
+def get_cached_response(user_query, notice=None):
+    """Return a cached answer for the question, if caching is enabled"""
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    return response_cache.get(notice, user_query)
+
+def cache_response(user_query, notice, response_text):
+    """Store an answer for later identical (or similar) questions"""
+    if RESPONSE_CACHE_ENABLED:
+        response_cache.put(notice, user_query, response_text)
+
+def summary_generator(model):
+    """Model call for history.model_summarizer, under the scheduler and the daily token quota"""
+    def call(prompt):
+        check_token_quota()
+        return generate(model, prompt, user_key=current_user_key())
+    return call
+
+@telemetry.timed('gemini')
+def fetch_gemini_response(user_query, notice=None, history=None, model=None):
+    """Return (answer text, token usage); usage is None for cached answers"""
+    cacheable = is_cacheable(history)
+    cached = get_cached_response(user_query, notice) if cacheable else None
+    if cached is not None:
+        return cached, None
+
+    if model is None:
+        model = st.session_state.chat_session.model
+    check_token_quota()
+    prompt = build_prompt(user_query, notice, history)
+    user_key, cancel_key = current_user_key(), current_session_key()
+
+    def call():
+        started = time.perf_counter()
+        response = generate(model, prompt, user_key=user_key, cancel_key=cancel_key)
+        return response, response_usage(response, prompt, response.parts[0].text, model,
+                                        time.perf_counter() - started)
+
+    # Coalesced callers share the usage of the one upstream call, so each of
+    # them is charged for the answer it received
+    if GEMINI_COALESCE:
+        response, usage = request_coalescer.do(flight_key(model, prompt, notice), call)
+    else:
+        response, usage = call()
+    response_text = response.parts[0].text
+    if cacheable:
+        cache_response(user_query, notice, response_text)
+    return response_text, usage
+
+def _chunk_text(chunk):
+    """Extract the text of a streamed chunk, ignoring chunks without parts"""
+    return "".join(part.text for part in getattr(chunk, 'parts', []) if getattr(part, 'text', None))
+
+class ResponseStream:
+    """Iterable over a streamed Gemini answer.
+
+    Yields text chunks as they arrive (suitable for ``st.write_stream``) and,
+    once exhausted, exposes the assembled ``text`` together with
+    ``first_chunk_latency``, ``total_latency`` and ``render_time`` (time the
+    consumer spent between chunks) in seconds. ``on_complete``
+    is called with the full text when the stream finishes successfully.
+    A stream built with ``cached_text`` yields that text without calling the model.
+    ``usage`` holds the token counts and model latency of the upstream call,
+    shared by every reader of a coalesced stream (None for cached answers).
+    """
+
+    def __init__(self, model, user_query, on_complete=None, cached_text=None, user_key=None,
+                 cancel_key=None, flight_key=None):
+        self.model = model
+        self.user_query = user_query
+        self.user_key = user_key
+        self.cancel_key = cancel_key
+        self.flight_key = flight_key
+        self.on_complete = on_complete
+        self.cached_text = cached_text
+        self.cached = cached_text is not None
+        self.text = ""
+        self.first_chunk_latency = None
+        self.total_latency = None
+        self.render_time = 0.0
+        self.usage = None
+
+    def _chunks(self):
+        if self.cached:
+            yield self.cached_text
+            return
+        if self.flight_key is not None:
+            self.usage = yield from request_coalescer.stream(self.flight_key, self._upstream_chunks)
+        else:
+            self.usage = yield from self._upstream_chunks()
+
+    def _upstream_chunks(self):
+        """Yield the text chunks of the model call and return its usage
+
+        Under coalescing any reader may be the one pulling the chunks, so the
+        model latency only counts time spent in here, not while suspended at
+        a yield (whichever reader is rendering).
+        """
+        resumed = time.perf_counter()
+        latency = 0.0
+        response = generate_stream(self.model, self.user_query,
+                                   user_key=self.user_key, cancel_key=self.cancel_key)
+        last_chunk, parts = None, []
+        for chunk in response:
+            last_chunk = chunk
+            text = _chunk_text(chunk)
+            if text:
+                parts.append(text)
+                latency += time.perf_counter() - resumed
+                yield text
+                resumed = time.perf_counter()
+        latency += time.perf_counter() - resumed
+        # The last chunk carries the usage totals of the whole stream
+        return response_usage(last_chunk, self.user_query, "".join(parts), self.model, latency)
+
+    def __iter__(self):
+        started = time.perf_counter()
+        parts = []
+        completed = False
+        try:
+            for text in self._chunks():
+                if self.first_chunk_latency is None:
+                    self.first_chunk_latency = time.perf_counter() - started
+                parts.append(text)
+                yielded = time.perf_counter()
+                yield text
+                self.render_time += time.perf_counter() - yielded
+            completed = True
+        finally:
+            self.text = "".join(parts)
+            self.total_latency = time.perf_counter() - started
+            response_timings.append({
+                'first_chunk_latency': self.first_chunk_latency,
+                'total_latency': self.total_latency,
+                'chars': len(self.text),
+                'render_time': self.render_time,
+                'cached': self.cached,
+            })
+            if not self.cached:
+                if self.first_chunk_latency is not None:
+                    telemetry.observe('gemini_first_chunk', self.first_chunk_latency)
+                telemetry.observe('gemini_stream', self.total_latency - self.render_time)
+            telemetry.observe('render', self.render_time)
+            logger.info("Gemini stream: first chunk %.3fs, total %.3fs, %d chars%s",
+                        self.first_chunk_latency or 0.0, self.total_latency, len(self.text),
+                        " (cached)" if self.cached else "")
+
+        if completed and not self.cached and self.on_complete is not None:
+            self.on_complete(self.text)
+
+def stream_gemini_response(user_query, model=None, notice=None, history=None):
+    """Stream the Gemini answer for user_query chunk by chunk"""
+    # Decided up front: the history grows by this exchange before the stream completes
+    cacheable = is_cacheable(history)
+    cached = get_cached_response(user_query, notice) if cacheable else None
+    if cached is not None:
+        return ResponseStream(None, user_query, cached_text=cached)
+
+    if model is None:
+        model = st.session_state.chat_session.model
+    check_token_quota()
+    prompt = build_prompt(user_query, notice, history)
+    return ResponseStream(
+        model,
+        prompt,
+        on_complete=(lambda text: cache_response(user_query, notice, text)) if cacheable else None,
+        user_key=current_user_key(),
+        # A shared stream outlives any one session, so it is only cancelled
+        # once every reader has gone, not when one session moves on
+        cancel_key=None if GEMINI_COALESCE else current_session_key(),
+        flight_key=flight_key(model, prompt, notice) if GEMINI_COALESCE else None,
+    )
 
 def get_available_notices():
     # Changed from 'editais' to 'notices' as requested
-    # Here you can implement the logic to fetch notices from database or API
-    # For now, using a fixed list as example
-    return ['Notice 001/2025', 'Notice 002/2025', 'Notice 003/2025']
+    # Notices come from the local index (files in NOTICES_DIR); the fixed list
+    # is kept as an example while no notice has been ingested
+    notice_index.ensure_synced()
+    return notice_index.list_notices() or ['Notice 001/2025', 'Notice 002/2025', 'Notice 003/2025']
 
-def save_user_message(user_message: str, bot_response: str, notice_context: str = None):
-    """Save user message and bot response to database"""
+@telemetry.timed('db_save_message')
+def save_user_message(user_message: str, bot_response: str, notice_context: str = None,
+                      usage: dict = None):
+    """Queue user message, bot response and token usage for persistence in the database"""
     if 'user_id' in st.session_state:
-        db.save_message(
+        message_writer.submit(
             user_id=st.session_state.user_id,
             user_message=user_message,
             bot_response=bot_response,
-            notice_context=notice_context
+            notice_context=notice_context,
+            **(usage or {})
         )
 
+@telemetry.timed('db_login')
 def register_user_login(email: str, name: str, profile_picture_url: str = None):
-    """Register user login in database"""
+    """Register user login in database, once per browser session"""
+    # Reruns and reconnects of this browser session reuse the registration
+    if st.session_state.get('registered_email') == email and 'user_id' in st.session_state:
+        return st.session_state.user_db_info
+
+    # A new browser session is a new access: bump access_count/last_access and
+    # refresh name and picture (db.get_cached_user is only for read paths)
     user = db.get_or_create_user(email, name, profile_picture_url)
     if user:
         st.session_state.user_id = user['id']
         st.session_state.user_db_info = user
+        st.session_state.registered_email = email
         
         # Create session
-        session_id = db.create_session(user['id'])
+        session_id = db.create_session(user['id'], *client_info())
         st.session_state.session_id = session_id
         
         return user
     return None
 
+def client_info():
+    """IP address and user agent of the browser, when Streamlit exposes them"""
+    try:
+        context = st.context
+        ip_address = getattr(context, 'ip_address', None)
+        user_agent = context.headers.get('User-Agent')
+    except Exception:
+        return None, None
+    return ip_address, user_agent
+
+def touch_user_session():
+    """Record activity of the current session (in memory, flushed in batches)"""
+    session_id = st.session_state.get('session_id')
+    if session_id is None or 'user_id' not in st.session_state:
+        return
+    if not session_tracker.touch(session_id):
+        # Closed while the tab was away (idle sweep on any replica): start a new session
+        session_tracker.forget(session_id)
+        st.session_state.session_id = db.create_session(st.session_state.user_id, *client_info())
+
+@telemetry.timed('db_end_session')
 def end_user_session():
     """End current user session"""
     if 'session_id' in st.session_state:
+        session_tracker.forget(st.session_state.session_id)
         db.end_session(st.session_state.session_id)
         del st.session_state.session_id
 
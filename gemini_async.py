@@ -0,0 +1,244 @@
+"""
+Asyncio backend for Gemini calls
+
+With ``GEMINI_ASYNC=true`` model calls use ``generate_content_async`` and run
+as tasks on one event loop owned by a dedicated thread, instead of blocking a
+scheduler worker thread for the whole network round trip. Streamlit sessions
+submit coroutines and wait on the returned futures, so hundreds of concurrent
+conversations share a single thread.
+
+Rate limits are shared with gemini_scheduler: both paths draw from the same
+request and token buckets and use the same retry policy. Calls are cancelled
+when the waiting session stops reading (rerun, navigation, closed stream) or
+when the same session submits a newer question.
+"""
+
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Hashable, Iterator, Optional
+
+from gemini_scheduler import GeminiOverloadedError, gemini_scheduler, is_retryable
+
+logger = logging.getLogger(__name__)
+
+GEMINI_ASYNC = os.getenv("GEMINI_ASYNC", "false").lower() == "true"
+GEMINI_ASYNC_MAX_IN_FLIGHT = int(os.getenv("GEMINI_ASYNC_MAX_IN_FLIGHT", "64"))
+GEMINI_MAX_PER_USER = int(os.getenv("GEMINI_MAX_PER_USER", "2"))
+
+_DONE = object()
+
+
+class AsyncGeminiWorker:
+    """Runs Gemini coroutines on a background event loop"""
+
+    def __init__(self, scheduler=gemini_scheduler,
+                 max_in_flight: int = GEMINI_ASYNC_MAX_IN_FLIGHT,
+                 max_per_user: int = GEMINI_MAX_PER_USER):
+        self.scheduler = scheduler
+        self.max_in_flight = max_in_flight
+        self.max_per_user = max_per_user
+
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        # Loop-thread state, only touched from coroutines
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._user_slots: Dict[Hashable, list] = {}
+        # Latest call per cancel_key (browser session)
+        self._pending: Dict[Hashable, Future] = {}
+        self._queue_waits = deque(maxlen=1000)
+        self._in_flight = 0
+        self._metrics = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'cancelled': 0,
+            'superseded': 0,
+            'retries': 0,
+        }
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """Start the event loop thread on first use"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                self._thread = threading.Thread(target=self._run_loop, args=(loop, ready),
+                                                name="gemini-async", daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def _run_loop(self, loop: asyncio.AbstractEventLoop, ready: threading.Event):
+        asyncio.set_event_loop(loop)
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._user_slots = {}
+        loop.call_soon(ready.set)
+        loop.run_forever()
+
+    def _count(self, name: str, amount=1):
+        with self._lock:
+            self._metrics[name] += amount
+
+    async def _throttle(self, tokens: int):
+        wait = max(self.scheduler.request_bucket.reserve(1),
+                   self.scheduler.token_bucket.reserve(tokens))
+        if wait:
+            await asyncio.sleep(wait)
+
+    async def _call_with_retries(self, coro_fn: Callable[[], Awaitable], tokens: int):
+        await self._throttle(tokens)
+        attempt = 0
+        while True:
+            try:
+                return await coro_fn()
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                if attempt >= self.scheduler.max_retries:
+                    raise GeminiOverloadedError(
+                        f"Gemini unavailable after {attempt + 1} attempts: {e}") from e
+                attempt += 1
+                delay = self.scheduler.backoff_delay(attempt)
+                self._count('retries')
+                logger.warning("Gemini call failed (%s), retry %d in %.1fs", e, attempt, delay)
+                await asyncio.sleep(delay)
+                await self._throttle(1)
+
+    async def _run(self, coro_fn, user_key, tokens, consume, submitted_at):
+        slot = None
+        if user_key is not None and self.max_per_user:
+            # Per-user cap: one user's burst can't take every slot
+            slot = self._user_slots.setdefault(user_key, [asyncio.Semaphore(self.max_per_user), 0])
+            slot[1] += 1
+        try:
+            if slot is not None:
+                await slot[0].acquire()
+            try:
+                async with self._semaphore:
+                    self._queue_waits.append(time.monotonic() - submitted_at)
+                    self._in_flight += 1
+                    try:
+                        result = await self._call_with_retries(coro_fn, tokens)
+                        if consume is not None:
+                            await consume(result)
+                    finally:
+                        self._in_flight -= 1
+            finally:
+                if slot is not None:
+                    slot[0].release()
+        except asyncio.CancelledError:
+            self._count('cancelled')
+            raise
+        except Exception:
+            self._count('failed')
+            raise
+        finally:
+            if slot is not None:
+                slot[1] -= 1
+                if not slot[1]:
+                    self._user_slots.pop(user_key, None)
+
+        self._count('completed')
+        return result
+
+    def submit(self, coro_fn: Callable[[], Awaitable], user_key: Hashable = None,
+               estimated_tokens: int = 1, cancel_key: Hashable = None,
+               consume: Optional[Callable] = None) -> Future:
+        """Schedule coro_fn() on the event loop and return a concurrent Future
+
+        A call submitted with the same cancel_key as a still-pending one
+        cancels the older call (the session moved on to a new question).
+        """
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(coro_fn, user_key, estimated_tokens, consume, time.monotonic()), loop)
+        self._count('submitted')
+
+        if cancel_key is not None:
+            with self._lock:
+                previous = self._pending.get(cancel_key)
+                self._pending[cancel_key] = future
+            if previous is not None and previous.cancel():
+                self._count('superseded')
+            future.add_done_callback(lambda f: self._forget(cancel_key, f))
+        return future
+
+    def _forget(self, cancel_key, future: Future):
+        with self._lock:
+            if self._pending.get(cancel_key) is future:
+                del self._pending[cancel_key]
+
+    def call(self, coro_fn: Callable[[], Awaitable], user_key: Hashable = None,
+             estimated_tokens: int = 1, cancel_key: Hashable = None,
+             timeout: Optional[float] = None):
+        """Run coro_fn() on the event loop and wait for its result"""
+        future = self.submit(coro_fn, user_key, estimated_tokens, cancel_key)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            # Timeout or the script run was stopped: don't leave the call running
+            future.cancel()
+            raise
+
+    def stream(self, open_stream: Callable[[], Awaitable], user_key: Hashable = None,
+               estimated_tokens: int = 1, cancel_key: Hashable = None) -> Iterator:
+        """Run an async streaming call and yield its chunks in the calling thread
+
+        Only opening the stream is retried; closing the iterator early cancels
+        the upstream call.
+        """
+        chunks = queue.Queue()
+
+        async def consume(response):
+            async for chunk in response:
+                chunks.put(chunk)
+
+        future = self.submit(open_stream, user_key, estimated_tokens, cancel_key, consume)
+        future.add_done_callback(lambda f: chunks.put(_DONE))
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is _DONE:
+                    break
+                yield chunk
+            future.result()  # re-raise upstream errors
+        finally:
+            if not future.done():
+                future.cancel()
+
+    def metrics(self) -> Dict:
+        """Return call, cancellation, retry and queue-wait metrics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['pending_sessions'] = len(self._pending)
+        metrics['in_flight'] = self._in_flight
+        waits = sorted(self._queue_waits)
+
+        def percentile(p):
+            return waits[min(len(waits) - 1, int(p * len(waits)))] if waits else 0.0
+
+        metrics['queue_wait_p50'] = percentile(0.50)
+        metrics['queue_wait_p95'] = percentile(0.95)
+        metrics['queue_wait_max'] = waits[-1] if waits else 0.0
+        return metrics
+
+    def shutdown(self):
+        """Stop the event loop thread"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is not None and thread is not None and thread.is_alive():
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout=5)
+
+
+# Global async worker shared by every session in this process
+gemini_async = AsyncGeminiWorker()
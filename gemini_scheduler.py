@@ -0,0 +1,249 @@
+"""
+Process-wide scheduler for Gemini calls
+
+Every model call from every Streamlit session goes through one scheduler that
+
+- caps the number of calls in flight (``max_in_flight`` worker threads),
+- enforces token-bucket rate limits on requests and tokens per minute,
+- retries 429/5xx errors with jittered exponential backoff,
+- serves queued requests round-robin per user, so one user firing many
+  questions can't starve everybody else,
+- records queue-wait and retry metrics.
+
+It is model-agnostic (it runs callables), so it can be exercised against
+fake_model.FakeGenerativeModel with injected failures.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MAX_IN_FLIGHT = int(os.getenv("GEMINI_MAX_IN_FLIGHT", "8"))
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+GEMINI_MAX_QUEUED = int(os.getenv("GEMINI_MAX_QUEUED", "500"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RETRYABLE_NAMES = {
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable',
+    'InternalServerError', 'DeadlineExceeded', 'GatewayTimeout',
+}
+
+
+class GeminiOverloadedError(Exception):
+    """Raised when a call can't be completed because of rate limits or overload"""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """True for quota (429) and transient server (5xx) errors"""
+    code = getattr(exc, 'code', None)
+    try:
+        if code is not None and int(code) in RETRYABLE_STATUS:
+            return True
+    except (TypeError, ValueError):
+        pass
+    return type(exc).__name__ in RETRYABLE_NAMES
+
+
+# Rough Gemini token estimate (≈4 characters per token for Portuguese/English text)
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text) -> int:
+    """Cheap token count estimate, good enough for budgeting prompts and rate limits"""
+    return max(1, len(str(text)) // CHARS_PER_TOKEN) if text else 0
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """Take amount tokens (possibly going into debt); return seconds to wait before using them"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate if self.rate else float('inf')
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Block until amount tokens are available; return the time waited"""
+        wait = self.reserve(amount)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class _Ticket:
+    __slots__ = ('fn', 'tokens', 'future', 'enqueued_at', 'user_key')
+
+    def __init__(self, fn, tokens, user_key):
+        self.fn = fn
+        self.tokens = tokens
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        self.user_key = user_key
+
+
+class GeminiScheduler:
+    def __init__(self, max_in_flight: int = GEMINI_MAX_IN_FLIGHT,
+                 requests_per_minute: float = GEMINI_RPM,
+                 tokens_per_minute: float = GEMINI_TPM,
+                 max_retries: int = GEMINI_MAX_RETRIES,
+                 max_queued: int = GEMINI_MAX_QUEUED,
+                 base_delay: float = 1.0, max_delay: float = 30.0):
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.max_queued = max_queued
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+
+        self._cond = threading.Condition()
+        self._queues: "OrderedDict[Hashable, deque]" = OrderedDict()
+        self._queued = 0
+        self._in_flight = 0
+        self._workers = []
+        self._queue_waits = deque(maxlen=1000)
+        self._metrics = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'retries': 0,
+            'throttle_wait_seconds': 0.0,
+        }
+
+    def _ensure_workers(self):
+        """Start worker threads lazily (lock held)"""
+        self._workers = [worker for worker in self._workers if worker.is_alive()]
+        while len(self._workers) < self.max_in_flight:
+            worker = threading.Thread(target=self._work, name=f"gemini-worker-{len(self._workers)}",
+                                      daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, fn: Callable, user_key: Hashable = None, estimated_tokens: int = 1) -> Future:
+        """Queue fn for execution and return a Future with its result"""
+        ticket = _Ticket(fn, estimated_tokens, user_key)
+        with self._cond:
+            if self._queued >= self.max_queued:
+                self._metrics['rejected'] += 1
+                raise GeminiOverloadedError("Too many queued Gemini requests")
+            self._ensure_workers()
+            self._queues.setdefault(user_key, deque()).append(ticket)
+            self._queued += 1
+            self._metrics['submitted'] += 1
+            self._cond.notify()
+        return ticket.future
+
+    def call(self, fn: Callable, user_key: Hashable = None, estimated_tokens: int = 1,
+             timeout: Optional[float] = None):
+        """Run fn through the scheduler and wait for its result"""
+        return self.submit(fn, user_key, estimated_tokens).result(timeout)
+
+    def _next_ticket(self) -> _Ticket:
+        """Pop the next ticket round-robin across users (blocks while idle)"""
+        with self._cond:
+            while not self._queued:
+                self._cond.wait()
+            user_key, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            # Rotate: this user goes to the back of the line
+            del self._queues[user_key]
+            if queue:
+                self._queues[user_key] = queue
+            self._queued -= 1
+            self._in_flight += 1
+            return ticket
+
+    def _work(self):
+        while True:
+            ticket = self._next_ticket()
+            try:
+                if ticket.future.set_running_or_notify_cancel():
+                    self._execute(ticket)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Jittered exponential delay before retry number attempt (1-based)"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
+    def _execute(self, ticket: _Ticket):
+        throttled = self.request_bucket.acquire(1) + self.token_bucket.acquire(ticket.tokens)
+        wait = time.monotonic() - ticket.enqueued_at
+        with self._cond:
+            self._queue_waits.append(wait)
+            self._metrics['throttle_wait_seconds'] += throttled
+
+        attempt = 0
+        while True:
+            try:
+                result = ticket.fn()
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    with self._cond:
+                        self._metrics['failed'] += 1
+                    if is_retryable(e):
+                        error = GeminiOverloadedError(f"Gemini unavailable after {attempt + 1} attempts: {e}")
+                        error.__cause__ = e
+                        ticket.future.set_exception(error)
+                    else:
+                        ticket.future.set_exception(e)
+                    return
+                attempt += 1
+                delay = self.backoff_delay(attempt)
+                with self._cond:
+                    self._metrics['retries'] += 1
+                logger.warning("Gemini call failed (%s), retry %d in %.1fs", e, attempt, delay)
+                time.sleep(delay)
+                self.request_bucket.acquire(1)
+                continue
+
+            with self._cond:
+                self._metrics['completed'] += 1
+            ticket.future.set_result(result)
+            return
+
+    def metrics(self) -> Dict:
+        """Return queue, in-flight, retry and queue-wait metrics"""
+        with self._cond:
+            metrics = dict(self._metrics)
+            waits = sorted(self._queue_waits)
+            metrics['queued'] = self._queued
+            metrics['in_flight'] = self._in_flight
+            metrics['users_waiting'] = len(self._queues)
+
+        def percentile(p):
+            return waits[min(len(waits) - 1, int(p * len(waits)))] if waits else 0.0
+
+        metrics['queue_wait_p50'] = percentile(0.50)
+        metrics['queue_wait_p95'] = percentile(0.95)
+        metrics['queue_wait_max'] = waits[-1] if waits else 0.0
+        return metrics
+
+
+# Global scheduler shared by every session in this process
+gemini_scheduler = GeminiScheduler()
@@ -0,0 +1,124 @@
+from typing import Callable, Iterator, List, Optional
+
+from gemini_scheduler import CHARS_PER_TOKEN, estimate_tokens
+
+ROLE_LABELS = {'user': "Aluno", 'model': "EditalBot"}
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, on a word boundary"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(' ', 1)[0]
+    return cut + "…"
+
+
+class Turn:
+    """One chat message; slots keep long sessions cheap to hold in session state"""
+
+    __slots__ = ('role', 'content', 'tokens')
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+        self.tokens = estimate_tokens(content)
+
+    def __repr__(self):
+        return f"Turn({self.role!r}, {self.content[:30]!r})"
+
+
+def extractive_summarizer(summary: str, turns: List[Turn], max_tokens: int) -> str:
+    """Append a one-line digest of each turn and keep the newest lines within budget"""
+    lines = [line for line in summary.split("\n") if line]
+    for turn in turns:
+        label = ROLE_LABELS.get(turn.role, turn.role)
+        digest = truncate_to_tokens(" ".join(turn.content.split()), 40)
+        lines.append(f"{label}: {digest}")
+
+    kept, used = [], 0
+    for line in reversed(lines):
+        cost = estimate_tokens(line)
+        if kept and used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(reversed(kept))
+
+
+def model_summarizer(generate: Callable[[str], object]) -> Callable[[str, List[Turn], int], str]:
+    """Summarizer that asks the model to fold turns into the running summary
+
+    generate(prompt) runs the model call and returns its response; pass
+    functions.summary_generator(model) so summaries go through the Gemini
+    scheduler and the daily token quota like any other call.
+    """
+    def summarize(summary: str, turns: List[Turn], max_tokens: int) -> str:
+        transcript = "\n".join(f"{ROLE_LABELS.get(t.role, t.role)}: {t.content}" for t in turns)
+        prompt = (
+            f"Resuma em no máximo {max_tokens * CHARS_PER_TOKEN // 6} palavras a conversa abaixo, "
+            f"mantendo fatos, datas e editais citados.\n\n"
+            f"Resumo anterior:\n{summary or '(vazio)'}\n\nNovas mensagens:\n{transcript}"
+        )
+        try:
+            response = generate(prompt)
+            return truncate_to_tokens(response.parts[0].text.strip(), max_tokens)
+        except Exception:
+            return extractive_summarizer(summary, turns, max_tokens)
+    return summarize
+
+
+class ConversationHistory:
+    """Bounded chat history.
+
+    The last ``max_turns`` messages are kept verbatim; older ones are folded
+    into a running ``summary`` capped at ``summary_tokens``. Prompt size,
+    memory and render time therefore stay constant however long the session.
+    """
+
+    def __init__(self, max_turns: int = 8, summary_tokens: int = 300,
+                 summarizer: Optional[Callable[[str, List[Turn], int], str]] = None):
+        self.max_turns = max_turns
+        self.summary_tokens = summary_tokens
+        self.summarizer = summarizer or extractive_summarizer
+        self.turns: List[Turn] = []
+        self.summary = ""
+        self.summarized_count = 0
+
+    def __len__(self):
+        return self.summarized_count + len(self.turns)
+
+    def __iter__(self) -> Iterator[Turn]:
+        return iter(self.turns)
+
+    def append(self, role: str, content: str):
+        """Add a message and compact the history if it exceeds max_turns"""
+        self.turns.append(Turn(role, content))
+        if len(self.turns) > self.max_turns:
+            self._compact()
+
+    def add_exchange(self, user_message: str, bot_response: str):
+        self.append('user', user_message)
+        self.append('model', bot_response)
+
+    def _compact(self):
+        # Fold whole user/model pairs so the verbatim window starts on a question
+        overflow = len(self.turns) - self.max_turns
+        overflow += overflow % 2
+        dropped, self.turns = self.turns[:overflow], self.turns[overflow:]
+        self.summary = self.summarizer(self.summary, dropped, self.summary_tokens)
+        self.summarized_count += len(dropped)
+
+    def context(self) -> str:
+        """Render summary and recent turns as a prompt preamble ('' when empty)"""
+        sections = []
+        if self.summary:
+            sections.append(f"Resumo da conversa anterior:\n{self.summary}")
+        if self.turns:
+            recent = "\n".join(f"{ROLE_LABELS.get(t.role, t.role)}: {t.content}" for t in self.turns)
+            sections.append(f"Mensagens recentes:\n{recent}")
+        return "\n\n".join(sections)
+
+    def prompt_tokens(self) -> int:
+        """Estimated tokens the history adds to each prompt"""
+        return estimate_tokens(self.summary) + sum(turn.tokens for turn in self.turns)
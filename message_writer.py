@@ -0,0 +1,247 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class MessageWriter:
+    """Write-behind queue for chat messages.
+
+    Streamlit sessions hand rows to ``submit`` and return immediately; a single
+    background thread drains the queue and inserts the rows in grouped
+    transactions, committing when ``batch_size`` rows are pending or
+    ``flush_interval`` seconds have passed since the first pending row.
+    When the queue is full, ``submit`` blocks the caller (backpressure)
+    instead of dropping the row; a locked database is retried for as long as
+    it stays locked, so the queue fills and callers block rather than lose
+    messages. Only rows the database rejects outright are dropped. Once ``stop`` has run (at exit), the writer
+    refuses new messages.
+    """
+
+    def __init__(self, database, max_queue: int = 1000, batch_size: int = 50,
+                 flush_interval: float = 0.5, retry_delay: float = 0.5, max_retry_delay: float = 5.0):
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._stop_deadline = None  # monotonic time after which stop() stops retrying
+        self._metrics = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'write_errors': 0,
+            'dropped': 0,
+            'blocked_submits': 0,
+            'max_queue_depth': 0,
+            'last_batch_size': 0,
+            'last_batch_ms': 0.0,
+        }
+
+    def start(self):
+        """Start the background writer thread if it isn't running (never after stop)"""
+        with self._lock:
+            if self._stopping or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, user_id: int, user_message: str, bot_response: str, notice_context: str = None,
+               **usage):
+        """Queue a message for persistence, blocking while the queue is full
+
+        usage holds the optional token fields of Database.save_message.
+        Raises RuntimeError once the writer has been stopped.
+        """
+        if self._stopping:
+            raise RuntimeError("Message writer is stopped")
+
+        self.start()
+        row = {
+            'user_id': user_id,
+            'user_message': user_message,
+            'bot_response': bot_response,
+            'notice_context': notice_context,
+            **usage,
+        }
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self._metrics['blocked_submits'] += 1
+            self._queue.put(row)
+
+        with self._lock:
+            self._metrics['enqueued'] += 1
+            depth = self._queue.qsize()
+            if depth > self._metrics['max_queue_depth']:
+                self._metrics['max_queue_depth'] = depth
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued message is committed; return False on timeout"""
+        if self._thread is None or not self._thread.is_alive():
+            return self._queue.unfinished_tasks == 0
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        """Flush pending messages and stop the writer thread
+
+        A busy database is retried until timeout runs out (forever when None).
+        """
+        with self._lock:
+            thread = self._thread
+            self._stopping = True
+            if timeout is not None:
+                self._stop_deadline = time.monotonic() + timeout
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def metrics(self) -> Dict:
+        """Return queue depth and throughput counters"""
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics['queue_depth'] = self._queue.qsize()
+        metrics['running'] = self._thread is not None and self._thread.is_alive()
+        return metrics
+
+    def _next_batch(self):
+        """Block for the first row, then collect more until size or time limit"""
+        batch = []
+        item = self._queue.get()
+        if item is _STOP:
+            return batch, True
+        batch.append(item)
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _save(self, rows) -> bool:
+        """Insert rows, retrying transient (locked/busy) errors with capped backoff
+
+        While the database stays busy the batch is held, so the queue fills
+        up and ``submit`` blocks. Returns False only when ``stop`` is waiting
+        and its timeout would run out; other errors are raised.
+        """
+        attempts = 0
+        while True:
+            try:
+                self.database.save_messages(rows)
+                return True
+            except self.database.transient_errors:
+                attempts += 1
+                with self._lock:
+                    self._metrics['write_errors'] += 1
+                logger.warning("Database busy writing %d messages (attempt %d)", len(rows), attempts,
+                               exc_info=True)
+                delay = min(self.retry_delay * attempts, self.max_retry_delay)
+                deadline = self._stop_deadline
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    return False
+                time.sleep(delay)
+
+    def _give_up(self, rows):
+        with self._lock:
+            self._metrics['dropped'] += len(rows)
+        logger.error("Stopping with the database still busy: %d messages were not saved", len(rows))
+
+    def _write(self, batch):
+        """Insert a batch; a batch rejected by a non-transient error is written row by row"""
+        started = time.perf_counter()
+        try:
+            saved = self._save(batch)
+        except Exception:
+            with self._lock:
+                self._metrics['write_errors'] += 1
+            logger.exception("Failed to write a batch of %d messages; writing rows one by one",
+                             len(batch))
+            self._write_rows(batch)
+            return
+        if not saved:
+            self._give_up(batch)
+            return
+
+        with self._lock:
+            self._metrics['written'] += len(batch)
+            self._metrics['batches'] += 1
+            self._metrics['last_batch_size'] = len(batch)
+            self._metrics['last_batch_ms'] = (time.perf_counter() - started) * 1000
+
+    def _write_rows(self, batch):
+        """Insert rows individually, logging and dropping only the rows the database rejects"""
+        written = 0
+        for index, row in enumerate(batch):
+            try:
+                saved = self._save([row])
+            except Exception:
+                with self._lock:
+                    self._metrics['dropped'] += 1
+                logger.exception("Dropping message of user %s: %r", row.get('user_id'),
+                                 row.get('user_message', '')[:80])
+                continue
+            if not saved:
+                self._give_up(batch[index:])
+                break
+            written += 1
+        with self._lock:
+            self._metrics['written'] += written
+
+    def _run(self):
+        while True:
+            batch, stop = self._next_batch()
+            if batch:
+                self._write(batch)
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                self._queue.task_done()
+                # Drain whatever was queued behind the stop marker
+                drained = []
+                while True:
+                    try:
+                        drained.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                remaining = [row for row in drained if row is not _STOP]
+                if remaining:
+                    self._write(remaining)
+                for _ in drained:
+                    self._queue.task_done()
+                return
+
+
+# Global writer instance
+message_writer = MessageWriter(db)
+atexit.register(message_writer.stop)
@@ -0,0 +1,623 @@
+"""
+Versioned schema migrations for editalbot.db
+
+The schema version is stored in ``PRAGMA user_version``. Each migration is a
+(version, description, steps) entry; a step is either an SQL statement or a
+callable receiving the connection. Pending migrations run in order at startup,
+each one in its own ``BEGIN IMMEDIATE`` transaction so concurrent app
+processes never apply the same migration twice.
+
+To change the schema, append a new entry with the next version number;
+never edit a migration that has already shipped.
+
+The PostgreSQL backend has its own list, ``POSTGRES_MIGRATIONS``, whose
+version is kept in the ``schema_version`` table and whose migrations are
+serialized across replicas with an advisory lock. Its version 1 is the
+SQLite schema at version 8; schema changes need an entry in both lists.
+"""
+
+import logging
+import sqlite3
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _create_messages_fts(conn: sqlite3.Connection):
+    """External-content FTS5 index over messages, synced by triggers"""
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                user_message, bot_response,
+                content='messages', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5: search_messages falls back to LIKE and
+        # apply_migrations retries at the next startup
+        logger.warning("FTS5 unavailable, skipping messages_fts: %s", e)
+        return
+
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_messages_fts_insert AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO messages_fts (rowid, user_message, bot_response)
+            VALUES (NEW.id, NEW.user_message, NEW.bot_response);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_messages_fts_delete AFTER DELETE ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, user_message, bot_response)
+            VALUES ('delete', OLD.id, OLD.user_message, OLD.bot_response);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_messages_fts_update
+        AFTER UPDATE OF user_message, bot_response ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, user_message, bot_response)
+            VALUES ('delete', OLD.id, OLD.user_message, OLD.bot_response);
+            INSERT INTO messages_fts (rowid, user_message, bot_response)
+            VALUES (NEW.id, NEW.user_message, NEW.bot_response);
+        END
+    """)
+    # Index the rows that already exist
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+
+MIGRATIONS = [
+    (1, "initial schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email VARCHAR(255) UNIQUE NOT NULL,
+            name VARCHAR(255) NOT NULL,
+            profile_picture_url TEXT,
+            domain VARCHAR(50) NOT NULL,
+            first_login TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_access TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            access_count INTEGER DEFAULT 1,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            session_start TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            session_end TIMESTAMP,
+            ip_address VARCHAR(45),
+            user_agent TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            user_message TEXT NOT NULL,
+            bot_response TEXT,
+            notice_context VARCHAR(255),
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS response_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            notice_context VARCHAR(255) NOT NULL DEFAULT '',
+            question_key TEXT NOT NULL,
+            question TEXT NOT NULL,
+            response TEXT NOT NULL,
+            embedding BLOB,
+            created_at REAL NOT NULL,
+            last_hit_at REAL NOT NULL,
+            hit_count INTEGER DEFAULT 0,
+            UNIQUE (notice_context, question_key)
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_response_cache_last_hit
+        ON response_cache (last_hit_at)
+        """,
+    ]),
+    (2, "indexes for message, notice, session and user access paths", [
+        # get_user_messages: WHERE user_id = ? ORDER BY timestamp DESC
+        "CREATE INDEX IF NOT EXISTS idx_messages_user_timestamp ON messages (user_id, timestamp)",
+        # get_notice_usage: GROUP BY notice_context (index-only scan)
+        "CREATE INDEX IF NOT EXISTS idx_messages_notice ON messages (notice_context)",
+        # cleanup_old_sessions: WHERE session_start < ?
+        "CREATE INDEX IF NOT EXISTS idx_user_sessions_start ON user_sessions (session_start)",
+        "CREATE INDEX IF NOT EXISTS idx_user_sessions_user ON user_sessions (user_id)",
+        # get_all_users / recent users: WHERE is_active = 1 ORDER BY last_access
+        "CREATE INDEX IF NOT EXISTS idx_users_active_last_access ON users (is_active, last_access)",
+    ]),
+    (3, "usage rollup tables maintained by triggers", [
+        # Messages per day, notice and user domain ('' when notice is unknown)
+        """
+        CREATE TABLE IF NOT EXISTS usage_daily (
+            day DATE NOT NULL,
+            notice_context VARCHAR(255) NOT NULL DEFAULT '',
+            domain VARCHAR(50) NOT NULL DEFAULT '',
+            message_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, notice_context, domain)
+        ) WITHOUT ROWID
+        """,
+        # Per-user daily activity; a row means the user was active that day
+        """
+        CREATE TABLE IF NOT EXISTS user_daily_usage (
+            day DATE NOT NULL,
+            user_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            session_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id)
+        ) WITHOUT ROWID
+        """,
+        # Active users per domain
+        """
+        CREATE TABLE IF NOT EXISTS domain_users (
+            domain VARCHAR(50) PRIMARY KEY,
+            user_count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_messages_rollup AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO usage_daily (day, notice_context, domain, message_count)
+            VALUES (
+                date(NEW.timestamp),
+                COALESCE(NEW.notice_context, ''),
+                COALESCE((SELECT domain FROM users WHERE id = NEW.user_id), ''),
+                1
+            )
+            ON CONFLICT (day, notice_context, domain)
+            DO UPDATE SET message_count = message_count + 1;
+
+            INSERT INTO user_daily_usage (day, user_id, message_count)
+            VALUES (date(NEW.timestamp), NEW.user_id, 1)
+            ON CONFLICT (day, user_id)
+            DO UPDATE SET message_count = message_count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_user_sessions_rollup AFTER INSERT ON user_sessions
+        BEGIN
+            INSERT INTO user_daily_usage (day, user_id, session_count)
+            VALUES (date(NEW.session_start), NEW.user_id, 1)
+            ON CONFLICT (day, user_id)
+            DO UPDATE SET session_count = session_count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_users_insert_rollup AFTER INSERT ON users
+        WHEN NEW.is_active
+        BEGIN
+            INSERT INTO domain_users (domain, user_count) VALUES (NEW.domain, 1)
+            ON CONFLICT (domain) DO UPDATE SET user_count = user_count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_users_update_rollup
+        AFTER UPDATE OF is_active, domain ON users
+        WHEN OLD.is_active IS NOT NEW.is_active OR OLD.domain IS NOT NEW.domain
+        BEGIN
+            UPDATE domain_users SET user_count = user_count - 1
+            WHERE OLD.is_active AND domain = OLD.domain;
+            INSERT INTO domain_users (domain, user_count)
+            SELECT NEW.domain, 1 WHERE NEW.is_active
+            ON CONFLICT (domain) DO UPDATE SET user_count = user_count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_users_delete_rollup AFTER DELETE ON users
+        WHEN OLD.is_active
+        BEGIN
+            UPDATE domain_users SET user_count = user_count - 1 WHERE domain = OLD.domain;
+        END
+        """,
+        # Backfill from existing rows
+        """
+        INSERT INTO usage_daily (day, notice_context, domain, message_count)
+        SELECT date(m.timestamp), COALESCE(m.notice_context, ''), COALESCE(u.domain, ''), COUNT(*)
+        FROM messages m LEFT JOIN users u ON u.id = m.user_id
+        GROUP BY 1, 2, 3
+        """,
+        """
+        INSERT INTO user_daily_usage (day, user_id, message_count, session_count)
+        SELECT day, user_id, SUM(message_count), SUM(session_count) FROM (
+            SELECT date(timestamp) AS day, user_id, COUNT(*) AS message_count, 0 AS session_count
+            FROM messages GROUP BY 1, 2
+            UNION ALL
+            SELECT date(session_start), user_id, 0, COUNT(*)
+            FROM user_sessions GROUP BY 1, 2
+        )
+        GROUP BY day, user_id
+        """,
+        """
+        INSERT INTO domain_users (domain, user_count)
+        SELECT domain, COUNT(*) FROM users WHERE is_active = 1 GROUP BY domain
+        """,
+    ]),
+    (4, "index messages by timestamp for time-bucketed queries", [
+        # get_activity_buckets(bucket='hour'): WHERE timestamp >= ?
+        "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)",
+    ]),
+    (5, "full-text search over messages (FTS5)", [
+        _create_messages_fts,
+    ]),
+    (6, "token usage and model latency per message", [
+        "ALTER TABLE messages ADD COLUMN prompt_tokens INTEGER",
+        "ALTER TABLE messages ADD COLUMN response_tokens INTEGER",
+        "ALTER TABLE messages ADD COLUMN model_latency_ms REAL",
+        "ALTER TABLE messages ADD COLUMN model_name VARCHAR(100)",
+        "ALTER TABLE usage_daily ADD COLUMN prompt_tokens INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE usage_daily ADD COLUMN response_tokens INTEGER NOT NULL DEFAULT 0",
+        # Sum and count of model latencies, for averages per day/notice
+        "ALTER TABLE usage_daily ADD COLUMN model_latency_ms REAL NOT NULL DEFAULT 0",
+        "ALTER TABLE usage_daily ADD COLUMN model_calls INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE user_daily_usage ADD COLUMN prompt_tokens INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE user_daily_usage ADD COLUMN response_tokens INTEGER NOT NULL DEFAULT 0",
+        "DROP TRIGGER IF EXISTS trg_messages_rollup",
+        """
+        CREATE TRIGGER trg_messages_rollup AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO usage_daily (day, notice_context, domain, message_count,
+                                     prompt_tokens, response_tokens, model_latency_ms, model_calls)
+            VALUES (
+                date(NEW.timestamp),
+                COALESCE(NEW.notice_context, ''),
+                COALESCE((SELECT domain FROM users WHERE id = NEW.user_id), ''),
+                1,
+                COALESCE(NEW.prompt_tokens, 0),
+                COALESCE(NEW.response_tokens, 0),
+                COALESCE(NEW.model_latency_ms, 0),
+                NEW.model_latency_ms IS NOT NULL
+            )
+            ON CONFLICT (day, notice_context, domain)
+            DO UPDATE SET message_count = message_count + 1,
+                          prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                          response_tokens = response_tokens + excluded.response_tokens,
+                          model_latency_ms = model_latency_ms + excluded.model_latency_ms,
+                          model_calls = model_calls + excluded.model_calls;
+
+            INSERT INTO user_daily_usage (day, user_id, message_count, prompt_tokens, response_tokens)
+            VALUES (date(NEW.timestamp), NEW.user_id, 1,
+                    COALESCE(NEW.prompt_tokens, 0), COALESCE(NEW.response_tokens, 0))
+            ON CONFLICT (day, user_id)
+            DO UPDATE SET message_count = message_count + 1,
+                          prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                          response_tokens = response_tokens + excluded.response_tokens;
+        END
+        """,
+    ]),
+    (7, "OAuth state store", [
+        """
+        CREATE TABLE IF NOT EXISTS oauth_states (
+            state TEXT PRIMARY KEY,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_oauth_states_expires ON oauth_states (expires_at)",
+    ]),
+    (8, "last activity of user sessions", [
+        "ALTER TABLE user_sessions ADD COLUMN last_activity TIMESTAMP",
+        "UPDATE user_sessions SET last_activity = COALESCE(session_end, session_start)",
+        # close_idle_sessions: open sessions ordered by last activity
+        """
+        CREATE INDEX IF NOT EXISTS idx_user_sessions_open_activity
+        ON user_sessions (last_activity) WHERE session_end IS NULL
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def has_table(conn: sqlite3.Connection, name: str) -> bool:
+    """True if a table (or virtual table) named name exists"""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (name,)).fetchone() is not None
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Return the schema version recorded in the database file"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection, target: Optional[int] = None) -> int:
+    """Apply pending migrations up to target (default: latest); return the final version"""
+    target = LATEST_VERSION if target is None else target
+
+    for version, description, steps in MIGRATIONS:
+        if version > target:
+            break
+        if get_schema_version(conn) >= version:
+            continue
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-check under the write lock: another process may have migrated meanwhile
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception("Migration %d (%s) failed", version, description)
+            raise
+        logger.info("Applied migration %d: %s", version, description)
+
+    # Migration 5 is recorded even when this SQLite build lacks FTS5; retry
+    # at every startup so the index appears once a build with FTS5 is used
+    if get_schema_version(conn) >= 5 and not has_table(conn, 'messages_fts'):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not has_table(conn, 'messages_fts'):
+                _create_messages_fts(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    conn.execute("PRAGMA optimize")
+    return get_schema_version(conn)
+
+
+# Timestamps are stored as UTC TIMESTAMP (without time zone), like SQLite's CURRENT_TIMESTAMP
+_PG_NOW = "(now() AT TIME ZONE 'UTC')"
+
+POSTGRES_MIGRATIONS = [
+    (1, "initial schema", [
+        f"""
+        CREATE TABLE IF NOT EXISTS users (
+            id BIGSERIAL PRIMARY KEY,
+            email VARCHAR(255) UNIQUE NOT NULL,
+            name VARCHAR(255) NOT NULL,
+            profile_picture_url TEXT,
+            domain VARCHAR(50) NOT NULL,
+            first_login TIMESTAMP DEFAULT {_PG_NOW},
+            last_access TIMESTAMP DEFAULT {_PG_NOW},
+            access_count INTEGER DEFAULT 1,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT {_PG_NOW},
+            updated_at TIMESTAMP DEFAULT {_PG_NOW}
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL REFERENCES users (id),
+            session_start TIMESTAMP DEFAULT {_PG_NOW},
+            session_end TIMESTAMP,
+            ip_address VARCHAR(45),
+            user_agent TEXT,
+            last_activity TIMESTAMP
+        )
+        """,
+        # search: weighted full-text vector, kept current by PostgreSQL itself
+        f"""
+        CREATE TABLE IF NOT EXISTS messages (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL REFERENCES users (id),
+            user_message TEXT NOT NULL,
+            bot_response TEXT,
+            notice_context VARCHAR(255),
+            timestamp TIMESTAMP DEFAULT {_PG_NOW},
+            prompt_tokens INTEGER,
+            response_tokens INTEGER,
+            model_latency_ms DOUBLE PRECISION,
+            model_name VARCHAR(100),
+            search TSVECTOR GENERATED ALWAYS AS (
+                setweight(to_tsvector('portuguese', COALESCE(user_message, '')), 'A') ||
+                setweight(to_tsvector('portuguese', COALESCE(bot_response, '')), 'B')
+            ) STORED
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS response_cache (
+            id BIGSERIAL PRIMARY KEY,
+            notice_context VARCHAR(255) NOT NULL DEFAULT '',
+            question_key TEXT NOT NULL,
+            question TEXT NOT NULL,
+            response TEXT NOT NULL,
+            embedding BYTEA,
+            created_at DOUBLE PRECISION NOT NULL,
+            last_hit_at DOUBLE PRECISION NOT NULL,
+            hit_count INTEGER DEFAULT 0,
+            UNIQUE (notice_context, question_key)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS oauth_states (
+            state TEXT PRIMARY KEY,
+            expires_at DOUBLE PRECISION NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS usage_daily (
+            day DATE NOT NULL,
+            notice_context VARCHAR(255) NOT NULL DEFAULT '',
+            domain VARCHAR(50) NOT NULL DEFAULT '',
+            message_count INTEGER NOT NULL DEFAULT 0,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            response_tokens INTEGER NOT NULL DEFAULT 0,
+            model_latency_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+            model_calls INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, notice_context, domain)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_daily_usage (
+            day DATE NOT NULL,
+            user_id BIGINT NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            session_count INTEGER NOT NULL DEFAULT 0,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            response_tokens INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS domain_users (
+            domain VARCHAR(50) PRIMARY KEY,
+            user_count INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_response_cache_last_hit ON response_cache (last_hit_at)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_user_timestamp ON messages (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_notice ON messages (notice_context)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING GIN (search)",
+        "CREATE INDEX IF NOT EXISTS idx_user_sessions_start ON user_sessions (session_start)",
+        "CREATE INDEX IF NOT EXISTS idx_user_sessions_user ON user_sessions (user_id)",
+        """
+        CREATE INDEX IF NOT EXISTS idx_user_sessions_open_activity
+        ON user_sessions (last_activity) WHERE session_end IS NULL
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_users_active_last_access ON users (is_active, last_access)",
+        "CREATE INDEX IF NOT EXISTS idx_oauth_states_expires ON oauth_states (expires_at)",
+        # Rollup triggers, same bookkeeping as the SQLite ones
+        """
+        CREATE OR REPLACE FUNCTION messages_rollup() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO usage_daily (day, notice_context, domain, message_count,
+                                     prompt_tokens, response_tokens, model_latency_ms, model_calls)
+            VALUES (
+                NEW.timestamp::date,
+                COALESCE(NEW.notice_context, ''),
+                COALESCE((SELECT domain FROM users WHERE id = NEW.user_id), ''),
+                1,
+                COALESCE(NEW.prompt_tokens, 0),
+                COALESCE(NEW.response_tokens, 0),
+                COALESCE(NEW.model_latency_ms, 0),
+                (NEW.model_latency_ms IS NOT NULL)::int
+            )
+            ON CONFLICT (day, notice_context, domain)
+            DO UPDATE SET message_count = usage_daily.message_count + 1,
+                          prompt_tokens = usage_daily.prompt_tokens + EXCLUDED.prompt_tokens,
+                          response_tokens = usage_daily.response_tokens + EXCLUDED.response_tokens,
+                          model_latency_ms = usage_daily.model_latency_ms + EXCLUDED.model_latency_ms,
+                          model_calls = usage_daily.model_calls + EXCLUDED.model_calls;
+
+            INSERT INTO user_daily_usage (day, user_id, message_count, prompt_tokens, response_tokens)
+            VALUES (NEW.timestamp::date, NEW.user_id, 1,
+                    COALESCE(NEW.prompt_tokens, 0), COALESCE(NEW.response_tokens, 0))
+            ON CONFLICT (day, user_id)
+            DO UPDATE SET message_count = user_daily_usage.message_count + 1,
+                          prompt_tokens = user_daily_usage.prompt_tokens + EXCLUDED.prompt_tokens,
+                          response_tokens = user_daily_usage.response_tokens + EXCLUDED.response_tokens;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION user_sessions_rollup() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO user_daily_usage (day, user_id, session_count)
+            VALUES (NEW.session_start::date, NEW.user_id, 1)
+            ON CONFLICT (day, user_id)
+            DO UPDATE SET session_count = user_daily_usage.session_count + 1;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION users_rollup() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.is_active THEN
+                UPDATE domain_users SET user_count = user_count - 1 WHERE domain = OLD.domain;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.is_active THEN
+                INSERT INTO domain_users (domain, user_count) VALUES (NEW.domain, 1)
+                ON CONFLICT (domain) DO UPDATE SET user_count = domain_users.user_count + 1;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS trg_messages_rollup ON messages",
+        """
+        CREATE TRIGGER trg_messages_rollup AFTER INSERT ON messages
+        FOR EACH ROW EXECUTE FUNCTION messages_rollup()
+        """,
+        "DROP TRIGGER IF EXISTS trg_user_sessions_rollup ON user_sessions",
+        """
+        CREATE TRIGGER trg_user_sessions_rollup AFTER INSERT ON user_sessions
+        FOR EACH ROW EXECUTE FUNCTION user_sessions_rollup()
+        """,
+        "DROP TRIGGER IF EXISTS trg_users_rollup ON users",
+        """
+        CREATE TRIGGER trg_users_rollup AFTER INSERT OR DELETE OR UPDATE OF is_active, domain ON users
+        FOR EACH ROW EXECUTE FUNCTION users_rollup()
+        """,
+    ]),
+]
+
+POSTGRES_LATEST_VERSION = POSTGRES_MIGRATIONS[-1][0]
+
+# Arbitrary key of the advisory lock serializing migrations across replicas
+_PG_MIGRATION_LOCK = 7_215_036
+
+
+def get_postgres_schema_version(conn) -> int:
+    """Return the schema version recorded in the schema_version table"""
+    row = conn.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_version").fetchone()
+    return row['version']
+
+
+def apply_postgres_migrations(conn, target: Optional[int] = None) -> int:
+    """Apply pending PostgreSQL migrations up to target (default: latest); return the final version
+
+    conn must be in autocommit mode, so each migration below commits on its
+    own instead of becoming a savepoint of one long outer transaction.
+    """
+    if not conn.autocommit:
+        raise ValueError("apply_postgres_migrations needs an autocommit connection")
+    target = POSTGRES_LATEST_VERSION if target is None else target
+
+    # Session-level lock taken before any DDL: other replicas starting at the
+    # same time wait here, then find the migrations already recorded
+    conn.execute("SELECT pg_advisory_lock(%s)", (_PG_MIGRATION_LOCK,))
+    try:
+        with conn.transaction():
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'UTC')
+                )
+            """)
+
+        for version, description, steps in POSTGRES_MIGRATIONS:
+            if version > target:
+                break
+            if get_postgres_schema_version(conn) >= version:
+                continue
+
+            try:
+                with conn.transaction():
+                    for step in steps:
+                        if callable(step):
+                            step(conn)
+                        else:
+                            conn.execute(step)
+                    conn.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                                 (version, description))
+            except Exception:
+                logger.exception("PostgreSQL migration %d (%s) failed", version, description)
+                raise
+            logger.info("Applied PostgreSQL migration %d: %s", version, description)
+
+        return get_postgres_schema_version(conn)
+    finally:
+        conn.execute("SELECT pg_advisory_unlock(%s)", (_PG_MIGRATION_LOCK,))
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Notice (edital) ingestion and retrieval for the EditalBot
+
+Notices placed in NOTICES_DIR (PDF, .txt or .md) are split into overlapping
+chunks and indexed with BM25 in a SQLite file (NOTICE_INDEX_PATH). Questions
+are answered with the top-k passages of the selected notice instead of the
+whole document.
+
+Usage:
+    python notices.py sync                       # index every file in NOTICES_DIR
+    python notices.py ingest edital.pdf --name "Edital 001/2025"
+    python notices.py search "Edital 001/2025" "qual o prazo de inscrição?"
+"""
+
+import argparse
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional
+
+from sqlite_pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+NOTICES_DIR = os.getenv("NOTICES_DIR", "editais")
+NOTICE_INDEX_PATH = os.getenv("NOTICE_INDEX_PATH", "notices.db")
+SUPPORTED_EXTENSIONS = ('.pdf', '.txt', '.md')
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = {
+    'a', 'ao', 'aos', 'as', 'com', 'da', 'das', 'de', 'do', 'dos', 'e', 'em',
+    'na', 'nas', 'no', 'nos', 'o', 'os', 'ou', 'para', 'pela', 'pelas', 'pelo',
+    'pelos', 'por', 'que', 'se', 'um', 'uma', 'qual', 'quais', 'como', 'quando',
+    'the', 'of', 'and', 'to', 'in', 'is',
+}
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase and strip accents"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into normalized index terms"""
+    return [
+        token for token in _TOKEN_RE.findall(normalize_text(text))
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def extract_text(path: str) -> str:
+    """Read the text of a PDF or plain text notice"""
+    if path.lower().endswith('.pdf'):
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise RuntimeError("pypdf is required to ingest PDF notices (pip install pypdf)")
+        reader = PdfReader(path)
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read()
+
+
+def chunk_text(text: str, chunk_words: int = 180, overlap_words: int = 40) -> List[str]:
+    """Split text into overlapping word windows"""
+    words = text.split()
+    if not words:
+        return []
+
+    step = max(chunk_words - overlap_words, 1)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+def notice_name_from_path(path: str) -> str:
+    """Derive a display name from a notice file name"""
+    return os.path.splitext(os.path.basename(path))[0].replace('_', ' ')
+
+
+class NoticeIndex:
+    """Persistent BM25 index of notice chunks stored in SQLite"""
+
+    def __init__(self, index_path: str = NOTICE_INDEX_PATH):
+        self.index_path = index_path
+        self.pool = ConnectionPool(index_path)
+        self._sync_lock = threading.Lock()
+        self._synced_dirs = set()
+        self.init_index()
+
+    def init_index(self):
+        """Create the index tables if they don't exist"""
+        with self.pool.connection() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS notices (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name VARCHAR(255) UNIQUE NOT NULL,
+                    source_path TEXT,
+                    checksum VARCHAR(64) NOT NULL,
+                    source_mtime REAL,
+                    source_size INTEGER,
+                    chunk_count INTEGER NOT NULL DEFAULT 0,
+                    avg_chunk_length REAL NOT NULL DEFAULT 0,
+                    ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+
+                CREATE TABLE IF NOT EXISTS notice_chunks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    notice_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    length INTEGER NOT NULL,
+                    FOREIGN KEY (notice_id) REFERENCES notices (id)
+                );
+
+                CREATE INDEX IF NOT EXISTS idx_notice_chunks_notice
+                    ON notice_chunks (notice_id, position);
+
+                CREATE TABLE IF NOT EXISTS notice_postings (
+                    notice_id INTEGER NOT NULL,
+                    term TEXT NOT NULL,
+                    chunk_id INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (notice_id, term, chunk_id)
+                ) WITHOUT ROWID;
+            """)
+            # Indexes created before files were tracked by modification time and size
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(notices)")}
+            for column, declared in (('source_mtime', 'REAL'), ('source_size', 'INTEGER')):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE notices ADD COLUMN {column} {declared}")
+
+    def ingest_text(self, name: str, text: str, source_path: str = None,
+                    source_stat: os.stat_result = None) -> int:
+        """Index the text of a notice, replacing any previous version; return chunk count"""
+        source_mtime = source_stat.st_mtime if source_stat else None
+        source_size = source_stat.st_size if source_stat else None
+        checksum = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        chunks = chunk_text(text)
+        chunk_terms = [Counter(tokenize(chunk)) for chunk in chunks]
+        lengths = [sum(terms.values()) for terms in chunk_terms]
+        avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, checksum FROM notices WHERE name = ?", (name,))
+            existing = cursor.fetchone()
+            if existing and existing['checksum'] == checksum:
+                # Same content (e.g. a touched file): only refresh the stat
+                cursor.execute("""
+                    UPDATE notices SET source_path = ?, source_mtime = ?, source_size = ?
+                    WHERE id = ?
+                """, (source_path, source_mtime, source_size, existing['id']))
+                return len(chunks)
+
+            if existing:
+                notice_id = existing['id']
+                cursor.execute("DELETE FROM notice_postings WHERE notice_id = ?", (notice_id,))
+                cursor.execute("DELETE FROM notice_chunks WHERE notice_id = ?", (notice_id,))
+                cursor.execute("""
+                    UPDATE notices
+                    SET source_path = ?, checksum = ?, source_mtime = ?, source_size = ?,
+                        chunk_count = ?, avg_chunk_length = ?, ingested_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """, (source_path, checksum, source_mtime, source_size, len(chunks), avg_length,
+                      notice_id))
+            else:
+                cursor.execute("""
+                    INSERT INTO notices (name, source_path, checksum, source_mtime, source_size,
+                                         chunk_count, avg_chunk_length)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (name, source_path, checksum, source_mtime, source_size, len(chunks), avg_length))
+                notice_id = cursor.lastrowid
+
+            for position, (chunk, terms, length) in enumerate(zip(chunks, chunk_terms, lengths)):
+                cursor.execute("""
+                    INSERT INTO notice_chunks (notice_id, position, text, length)
+                    VALUES (?, ?, ?, ?)
+                """, (notice_id, position, chunk, length))
+                chunk_id = cursor.lastrowid
+                cursor.executemany("""
+                    INSERT INTO notice_postings (notice_id, term, chunk_id, tf)
+                    VALUES (?, ?, ?, ?)
+                """, [(notice_id, term, chunk_id, tf) for term, tf in terms.items()])
+
+        return len(chunks)
+
+    def ingest_file(self, path: str, name: str = None) -> int:
+        """Parse and index a notice file"""
+        stat = os.stat(path)
+        return self.ingest_text(name or notice_name_from_path(path), extract_text(path),
+                                source_path=path, source_stat=stat)
+
+    def remove_notice(self, name: str):
+        """Drop a notice and its chunks from the index"""
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT id FROM notices WHERE name = ?", (name,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM notice_postings WHERE notice_id = ?", (row['id'],))
+                conn.execute("DELETE FROM notice_chunks WHERE notice_id = ?", (row['id'],))
+                conn.execute("DELETE FROM notices WHERE id = ?", (row['id'],))
+
+    def sync_directory(self, directory: str = NOTICES_DIR) -> Dict[str, int]:
+        """Index every supported file in directory and drop notices whose file is gone
+
+        Files whose modification time and size match the indexed version are
+        skipped without being read, so a restart doesn't re-extract every PDF.
+        A file that can't be read or parsed is logged and left out; the other
+        notices are still indexed.
+        """
+        results = {}
+        if not os.path.isdir(directory):
+            return results
+
+        with self.pool.connection() as conn:
+            indexed = {row['name']: row for row in conn.execute(
+                "SELECT name, source_path, source_mtime, source_size, chunk_count FROM notices"
+            )}
+
+        for filename in sorted(os.listdir(directory)):
+            if filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                path = os.path.join(directory, filename)
+                name = notice_name_from_path(path)
+                try:
+                    stat = os.stat(path)
+                    known = indexed.get(name)
+                    if (known and known['source_path'] == path and known['source_mtime'] == stat.st_mtime
+                            and known['source_size'] == stat.st_size):
+                        results[name] = known['chunk_count']
+                    else:
+                        results[name] = self.ingest_file(path)
+                except Exception:
+                    # A previously indexed version stays in the index
+                    logger.exception("Skipping notice file %s", path)
+
+        # Notices ingested from this directory whose file has been removed
+        directory = os.path.normpath(directory)
+        for name, known in indexed.items():
+            source_path = known['source_path']
+            if (name not in results and source_path
+                    and os.path.dirname(os.path.normpath(source_path)) == directory
+                    and not os.path.exists(source_path)):
+                self.remove_notice(name)
+        return results
+
+    def ensure_synced(self, directory: str = NOTICES_DIR):
+        """Sync directory once per process; a failed sync is logged, not retried on every rerun"""
+        if directory in self._synced_dirs:
+            return
+        with self._sync_lock:
+            if directory not in self._synced_dirs:
+                try:
+                    self.sync_directory(directory)
+                except Exception:
+                    logger.exception("Failed to sync notices from %s", directory)
+                self._synced_dirs.add(directory)
+
+    def list_notices(self) -> List[str]:
+        """Return the names of the indexed notices"""
+        with self.pool.connection() as conn:
+            cursor = conn.execute("SELECT name FROM notices ORDER BY name")
+            return [row['name'] for row in cursor.fetchall()]
+
+    def search(self, notice: str, query: str, k: int = 4) -> List[Dict]:
+        """Return the top-k BM25 passages of a notice for query"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, chunk_count, avg_chunk_length FROM notices WHERE name = ?
+            """, (notice,))
+            info = cursor.fetchone()
+            if not info or not info['chunk_count']:
+                return []
+
+            placeholders = ",".join("?" * len(terms))
+            cursor.execute(f"""
+                SELECT p.term, p.chunk_id, p.tf, c.length
+                FROM notice_postings p
+                JOIN notice_chunks c ON c.id = p.chunk_id
+                WHERE p.notice_id = ? AND p.term IN ({placeholders})
+            """, (info['id'], *terms))
+            postings = cursor.fetchall()
+
+            doc_freq = Counter(row['term'] for row in postings)
+            total = info['chunk_count']
+            avg_length = info['avg_chunk_length'] or 1.0
+
+            scores = Counter()
+            for row in postings:
+                df = doc_freq[row['term']]
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                tf = row['tf']
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * row['length'] / avg_length)
+                scores[row['chunk_id']] += idf * tf * (BM25_K1 + 1) / norm
+
+            top = scores.most_common(k)
+            if not top:
+                return []
+
+            ids = [chunk_id for chunk_id, _ in top]
+            cursor.execute(f"""
+                SELECT id, position, text FROM notice_chunks
+                WHERE id IN ({",".join("?" * len(ids))})
+            """, ids)
+            chunks = {row['id']: row for row in cursor.fetchall()}
+
+        return [
+            {
+                'chunk_id': chunk_id,
+                'position': chunks[chunk_id]['position'],
+                'text': chunks[chunk_id]['text'],
+                'score': score,
+            }
+            for chunk_id, score in top
+        ]
+
+
+def build_notice_prompt(question: str, notice: Optional[str], passages: List[Dict]) -> str:
+    """Build the model prompt from the question and the retrieved passages"""
+    if not notice or not passages:
+        return question
+
+    # Keep passages in document order so the model reads them in context
+    ordered = sorted(passages, key=lambda passage: passage['position'])
+    context = "\n\n".join(f"[Trecho {i}]\n{p['text']}" for i, p in enumerate(ordered, 1))
+    return (
+        f"Você é o EditalBot da UNIRIO. Responda à pergunta usando apenas os trechos "
+        f"do edital \"{notice}\" abaixo. Se a resposta não estiver nos trechos, diga "
+        f"que não encontrou a informação no edital.\n\n"
+        f"{context}\n\n"
+        f"Pergunta: {question}"
+    )
+
+
+# Global notice index instance
+notice_index = NoticeIndex()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gerencia o índice de editais do EditalBot")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sync_parser = subparsers.add_parser('sync', help="Indexa todos os editais do diretório")
+    sync_parser.add_argument('directory', nargs='?', default=NOTICES_DIR)
+
+    ingest_parser = subparsers.add_parser('ingest', help="Indexa um arquivo de edital")
+    ingest_parser.add_argument('path')
+    ingest_parser.add_argument('--name', help="Nome exibido do edital")
+
+    search_parser = subparsers.add_parser('search', help="Busca trechos em um edital")
+    search_parser.add_argument('notice')
+    search_parser.add_argument('query')
+    search_parser.add_argument('-k', type=int, default=4)
+
+    args = parser.parse_args()
+
+    if args.command == 'sync':
+        for name, count in notice_index.sync_directory(args.directory).items():
+            print(f"{name}: {count} trechos")
+    elif args.command == 'ingest':
+        count = notice_index.ingest_file(args.path, args.name)
+        print(f"{args.name or notice_name_from_path(args.path)}: {count} trechos")
+    elif args.command == 'search':
+        for passage in notice_index.search(args.notice, args.query, args.k):
+            print(f"[{passage['score']:.2f}] #{passage['position']}")
+            print(passage['text'])
+            print("-" * 50)
+
+
+if __name__ == "__main__":
+    main()
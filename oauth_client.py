@@ -0,0 +1,109 @@
+"""
+HTTP client for the Google OAuth endpoints
+
+One ``requests.Session`` is shared by every login in the process, so TCP and
+TLS connections to Google are kept alive and reused. Every request has a
+bounded (connect, read) timeout, connection failures are retried, and GET
+requests are also retried on 429/5xx. The token exchange POST is never
+resent after reaching the server, because authorization codes are single-use.
+
+User info is cached per access token for a few minutes. The endpoints can be
+overridden with OAUTH_AUTH_URL, OAUTH_TOKEN_URL and OAUTH_USERINFO_URL, e.g.
+to run the login flow against a local stub server.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+OAUTH_AUTH_URL = os.getenv("OAUTH_AUTH_URL", "https://accounts.google.com/o/oauth2/auth")
+OAUTH_TOKEN_URL = os.getenv("OAUTH_TOKEN_URL", "https://oauth2.googleapis.com/token")
+OAUTH_USERINFO_URL = os.getenv("OAUTH_USERINFO_URL", "https://www.googleapis.com/oauth2/v2/userinfo")
+
+# (connect, read) timeout in seconds
+OAUTH_TIMEOUT = (float(os.getenv("OAUTH_CONNECT_TIMEOUT", "3.05")),
+                 float(os.getenv("OAUTH_READ_TIMEOUT", "10")))
+USERINFO_CACHE_TTL = float(os.getenv("OAUTH_USERINFO_CACHE_TTL", "300"))
+
+
+def create_http_session(pool_maxsize: int = 16, retries: int = 3) -> requests.Session:
+    """Session with a keep-alive connection pool and a retry policy"""
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        # Only idempotent requests are resent after reaching the server
+        allowed_methods=frozenset(['GET']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class OAuthClient:
+    def __init__(self, session: Optional[requests.Session] = None,
+                 auth_url: str = OAUTH_AUTH_URL, token_url: str = OAUTH_TOKEN_URL,
+                 userinfo_url: str = OAUTH_USERINFO_URL, timeout=OAUTH_TIMEOUT,
+                 userinfo_ttl: float = USERINFO_CACHE_TTL, userinfo_max_entries: int = 1024):
+        self.session = session if session is not None else create_http_session()
+        self.auth_url = auth_url
+        self.token_url = token_url
+        self.userinfo_url = userinfo_url
+        self.timeout = timeout
+        self.userinfo_ttl = userinfo_ttl
+        self.userinfo_max_entries = userinfo_max_entries
+        self._userinfo: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def exchange_code(self, code: str, client_id: str, client_secret: str, redirect_uri: str) -> Dict:
+        """Trade an authorization code for tokens; raises requests.RequestException"""
+        response = self.session.post(self.token_url, data={
+            'client_id': client_id,
+            'client_secret': client_secret,
+            'code': code,
+            'grant_type': 'authorization_code',
+            'redirect_uri': redirect_uri,
+        }, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get_user_info(self, access_token: str) -> Dict:
+        """Profile of the token's owner, cached per token; raises requests.RequestException"""
+        # Key on a digest so raw tokens don't sit in memory longer than needed
+        key = hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+        now = time.monotonic()
+        with self._lock:
+            cached = self._userinfo.get(key)
+            if cached is not None and cached[0] > now:
+                self._userinfo.move_to_end(key)
+                return dict(cached[1])
+
+        # Bearer header instead of a query parameter: keeps the token out of URLs and logs
+        response = self.session.get(self.userinfo_url, timeout=self.timeout,
+                                    headers={'Authorization': f'Bearer {access_token}'})
+        response.raise_for_status()
+        user_info = response.json()
+
+        with self._lock:
+            self._userinfo[key] = (now + self.userinfo_ttl, user_info)
+            self._userinfo.move_to_end(key)
+            while len(self._userinfo) > self.userinfo_max_entries:
+                self._userinfo.popitem(last=False)
+        return dict(user_info)
+
+
+# Global client (shared connection pool)
+oauth_client = OAuthClient()
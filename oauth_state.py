@@ -0,0 +1,110 @@
+"""
+Storage for OAuth ``state`` values between the login redirect and the callback
+
+A state is issued once per browser session and consumed (single use) when
+Google redirects back. Two stores are available, selected with
+OAUTH_STATE_STORE:
+
+- ``memory`` (default): a dict in this process, with expired entries swept
+  periodically. Fine for a single Streamlit server.
+- ``database`` (or ``sqlite``): the ``oauth_states`` table of the configured
+  database (migration 7), for several app processes or replicas behind one
+  hostname.
+
+Both validate in O(1) and leave nothing on disk outside the database.
+"""
+
+import os
+import threading
+import time
+from typing import Dict
+
+OAUTH_STATE_STORE = os.getenv("OAUTH_STATE_STORE", "memory").lower()
+OAUTH_STATE_TTL = int(os.getenv("OAUTH_STATE_TTL", "900"))
+
+
+class MemoryStateStore:
+    """In-process TTL dict of pending OAuth states"""
+
+    def __init__(self, ttl: float = OAUTH_STATE_TTL, sweep_interval: float = 60.0):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._states: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def put(self, state: str) -> float:
+        """Register a state; return its expiry as a time.time() timestamp"""
+        now = time.monotonic()
+        with self._lock:
+            self._states[state] = now + self.ttl
+            if now - self._last_sweep >= self.sweep_interval:
+                self._sweep(now)
+        return time.time() + self.ttl
+
+    def consume(self, state: str) -> bool:
+        """Remove the state and return True if it existed and had not expired"""
+        with self._lock:
+            expires_at = self._states.pop(state, None)
+        return expires_at is not None and expires_at > time.monotonic()
+
+    def _sweep(self, now: float) -> int:
+        expired = [state for state, expires_at in self._states.items() if expires_at <= now]
+        for state in expired:
+            del self._states[state]
+        self._last_sweep = now
+        return len(expired)
+
+    def sweep(self) -> int:
+        """Drop expired states; return how many were removed"""
+        with self._lock:
+            return self._sweep(time.monotonic())
+
+    def __len__(self):
+        return len(self._states)
+
+
+class DatabaseStateStore:
+    """OAuth states in the oauth_states table, shared by every app process"""
+
+    def __init__(self, database, ttl: float = OAUTH_STATE_TTL, sweep_interval: float = 60.0):
+        self.database = database
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+
+    def put(self, state: str) -> float:
+        """Register a state; return its expiry as a time.time() timestamp"""
+        now = time.time()
+        purge_before = None
+        if now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            purge_before = now
+        self.database.put_oauth_state(state, now + self.ttl, purge_before)
+        return now + self.ttl
+
+    def consume(self, state: str) -> bool:
+        """Remove the state and return True if it existed and had not expired"""
+        return self.database.consume_oauth_state(state, time.time())
+
+    def sweep(self) -> int:
+        """Drop expired states; return how many were removed"""
+        return self.database.purge_oauth_states(time.time())
+
+
+# Former name, from when the table only existed in SQLite
+SQLiteStateStore = DatabaseStateStore
+
+
+def create_state_store(kind: str = OAUTH_STATE_STORE):
+    """Build the store selected by OAUTH_STATE_STORE"""
+    if kind == 'memory':
+        return MemoryStateStore()
+    if kind in ('database', 'sqlite'):
+        from database import db
+        return DatabaseStateStore(db)
+    raise ValueError(f"Unknown OAUTH_STATE_STORE: {kind}")
+
+
+# Global state store
+oauth_state_store = create_state_store()
@@ -0,0 +1,168 @@
+import array
+import math
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from database import db
+from notices import normalize_text
+
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question for exact cache lookups (case, accents, punctuation)"""
+    text = _PUNCTUATION_RE.sub(" ", normalize_text(question))
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def _pack(vector: List[float]) -> bytes:
+    return array.array('f', vector).tobytes()
+
+
+def _unpack(blob: bytes) -> array.array:
+    vector = array.array('f')
+    vector.frombytes(blob)
+    return vector
+
+
+def _cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def gemini_embedding(text: str) -> List[float]:
+    """Embed text with the Gemini embedding model"""
+    import google.generativeai as gpt
+    result = gpt.embed_content(model="models/text-embedding-004", content=text,
+                               task_type="semantic_similarity")
+    return result['embedding']
+
+
+class ResponseCache:
+    """Answer cache keyed on (notice, normalized question).
+
+    Entries live in the ``response_cache`` table of the database, expire after
+    ``ttl`` seconds and are evicted least-recently-hit first once the table
+    holds more than ``max_entries`` rows. When ``embed`` is given, a miss on
+    the exact key falls back to the most similar cached question of the same
+    notice above ``similarity`` (cosine).
+    """
+
+    def __init__(self, database, ttl: int = RESPONSE_CACHE_TTL,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 embed: Optional[Callable[[str], List[float]]] = None,
+                 similarity: float = RESPONSE_CACHE_SIMILARITY,
+                 semantic_candidates: int = 500):
+        self.database = database
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embed = embed
+        self.similarity = similarity
+        self.semantic_candidates = semantic_candidates
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self._counters = {'hits': 0, 'semantic_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _embed(self, question: str) -> Optional[List[float]]:
+        if self.embed is None:
+            return None
+        try:
+            return self.embed(question)
+        except Exception:
+            # Similarity tier is best effort; exact lookups keep working
+            return None
+
+    def get(self, notice: Optional[str], question: str) -> Optional[str]:
+        """Return the cached answer for question, or None on a miss"""
+        notice = notice or ''
+        key = normalize_question(question)
+        now = time.time()
+        min_created = now - self.ttl
+
+        row = self.database.get_cached_response(notice, key, min_created)
+
+        if row is None and self.embed is not None:
+            row = self._similar(notice, question, min_created)
+            if row is not None:
+                self._count('semantic_hits')
+
+        if row is None:
+            self._count('misses')
+            return None
+
+        self.database.record_cache_hit(row['id'], now)
+        self._count('hits')
+        return row['response']
+
+    def _similar(self, notice: str, question: str, min_created: float):
+        """Find the most similar fresh question of the same notice"""
+        vector = self._embed(question)
+        if vector is None:
+            return None
+
+        best, best_score = None, self.similarity
+        for row in self.database.get_cache_candidates(notice, min_created, self.semantic_candidates):
+            score = _cosine(vector, _unpack(row['embedding']))
+            if score >= best_score:
+                best, best_score = row, score
+        return best
+
+    def put(self, notice: Optional[str], question: str, response: str):
+        """Store an answer, replacing any previous one for the same key"""
+        if not response:
+            return
+        notice = notice or ''
+        key = normalize_question(question)
+        vector = self._embed(question)
+        embedding = _pack(vector) if vector is not None else None
+        now = time.time()
+
+        self.database.put_cached_response(notice, key, question, response, embedding, now)
+
+        self._count('stores')
+        with self._lock:
+            self._puts_since_evict += 1
+            evict = self._puts_since_evict >= 100
+            if evict:
+                self._puts_since_evict = 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """Drop expired entries and trim the table to max_entries (LRU)"""
+        removed = self.database.evict_cached_responses(time.time() - self.ttl, self.max_entries)
+        self._count('evictions', removed)
+        return removed
+
+    def clear(self, notice: Optional[str] = None):
+        """Remove every entry, or only those of one notice"""
+        self.database.clear_cached_responses(notice)
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters and the number of stored entries"""
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['entries'] = self.database.count_cached_responses()
+        return stats
+
+
+# Global cache instance; RESPONSE_CACHE_EMBEDDINGS=true enables the similarity tier
+response_cache = ResponseCache(
+    db,
+    embed=gemini_embedding if os.getenv("RESPONSE_CACHE_EMBEDDINGS", "false").lower() == "true" else None,
+)
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Data retention and archival for editalbot.db
+
+Messages and sessions older than a configurable horizon are moved out of the
+hot database into one archive per month, in small transactions:
+
+- ``sqlite`` (default): ``archive/editalbot_archive_YYYY-MM.db`` holding
+  ``messages`` and ``user_sessions`` tables with the same columns. Each batch
+  is copied with ``INSERT OR IGNORE`` and then deleted from editalbot.db, so
+  an interrupted run is simply resumed by the next one.
+- ``jsonl``: ``archive/<table>_YYYY-MM.jsonl.gz``, appended batch by batch
+  (a batch interrupted before its delete is written again: dedupe on ``id``).
+
+The admin page runs the archival on a background thread (``start_run``)
+and polls ``status()`` for progress, like backups. Freed pages are then
+returned to the filesystem with ``PRAGMA incremental_vacuum`` (new databases are created with ``auto_vacuum =
+INCREMENTAL``; run ``--vacuum`` once to convert an existing file). The usage
+rollups are not touched, so dashboard totals keep the archived history.
+
+Usage:
+    python retention.py                       # archive with the configured horizons
+    python retention.py --messages-days 180 --dry-run
+    python retention.py --vacuum              # one-off full VACUUM enabling auto_vacuum
+    python retention.py query "SELECT COUNT(*) AS n FROM messages"
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+RETENTION_MESSAGES_DAYS = int(os.getenv("RETENTION_MESSAGES_DAYS", "365"))
+RETENTION_SESSIONS_DAYS = int(os.getenv("RETENTION_SESSIONS_DAYS", "180"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_FORMAT = os.getenv("ARCHIVE_FORMAT", "sqlite").lower()
+
+# Archivable table -> timestamp column that decides its age
+ARCHIVE_TABLES = {
+    'messages': 'timestamp',
+    'user_sessions': 'session_start',
+}
+ARCHIVE_NAME_RE = re.compile(r"^editalbot_archive_(\d{4}-\d{2})\.db$")
+
+
+class RetentionService:
+    """Moves old rows into monthly archives and reclaims the freed space"""
+
+    def __init__(self, database, archive_dir: str = ARCHIVE_DIR, fmt: str = ARCHIVE_FORMAT,
+                 batch_size: int = 500, batch_delay: float = 0.05, vacuum_pages: int = 2000):
+        if fmt not in ('sqlite', 'jsonl'):
+            raise ValueError(f"Unknown archive format: {fmt}")
+        self.database = database
+        self.archive_dir = archive_dir
+        self.fmt = fmt
+        # <= 999 so the id list fits in the parameter limit of old SQLite builds
+        self.batch_size = min(batch_size, 999)
+        self.batch_delay = batch_delay
+        self.vacuum_pages = vacuum_pages
+        self._lock = threading.Lock()
+        self._thread = None
+        self._job: Dict = {}
+
+    def _open(self) -> sqlite3.Connection:
+        # Dedicated connection: ATTACH must not leak into pooled app connections
+        conn = sqlite3.connect(self.database.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def archive_path(self, table: str, month: str) -> str:
+        if self.fmt == 'sqlite':
+            return os.path.join(self.archive_dir, f"editalbot_archive_{month}.db")
+        return os.path.join(self.archive_dir, f"{table}_{month}.jsonl.gz")
+
+    def pending(self, table: str, days: int) -> Dict[str, int]:
+        """Rows older than the horizon, per month (what a run would archive)"""
+        column = ARCHIVE_TABLES[table]
+        conn = self._open()
+        try:
+            rows = conn.execute(f"""
+                SELECT substr({column}, 1, 7) AS month, COUNT(*) AS rows
+                FROM {table} WHERE {column} < datetime('now', ?)
+                GROUP BY month ORDER BY month
+            """, (f'-{int(days)} days',)).fetchall()
+            return {row['month']: row['rows'] for row in rows}
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _ensure_archive_table(conn: sqlite3.Connection, table: str, columns: List[tuple]):
+        """Create the archive table, or add columns added to the hot schema since"""
+        existing = {row[1] for row in conn.execute(f"PRAGMA archive.table_info({table})")}
+        if not existing:
+            definition = ", ".join(
+                f"{name} {declared or ''}{' PRIMARY KEY' if name == 'id' else ''}"
+                for name, declared in columns
+            )
+            conn.execute(f"CREATE TABLE archive.{table} ({definition})")
+            conn.execute(f"CREATE INDEX archive.idx_{table}_{ARCHIVE_TABLES[table]} "
+                         f"ON {table} ({ARCHIVE_TABLES[table]})")
+            return
+        for name, declared in columns:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {name} {declared or ''}")
+
+    def _batches(self, conn, table: str, cutoff: str) -> Iterator[List[sqlite3.Row]]:
+        """Oldest (id, month) batches older than cutoff, via the timestamp index"""
+        column = ARCHIVE_TABLES[table]
+        while True:
+            batch = conn.execute(f"""
+                SELECT id, substr({column}, 1, 7) AS month FROM {table}
+                WHERE {column} < datetime('now', ?)
+                ORDER BY {column}, id LIMIT ?
+            """, (cutoff, self.batch_size)).fetchall()
+            if not batch:
+                return
+            yield batch
+            if self.batch_delay:
+                time.sleep(self.batch_delay)  # let app writers in between batches
+
+    def archive_table(self, table: str, days: int,
+                      progress: Optional[Callable[[int], None]] = None) -> Dict[str, int]:
+        """Move rows older than `days` days into monthly archives; return rows per month
+
+        progress(rows) is called after each committed batch.
+        """
+        if table not in ARCHIVE_TABLES:
+            raise ValueError(f"Unknown table: {table}")
+        os.makedirs(self.archive_dir, exist_ok=True)
+        cutoff = f'-{int(days)} days'
+        moved: Dict[str, int] = {}
+
+        conn = self._open()
+        attached = None
+        try:
+            columns = [(row['name'], row['type']) for row in conn.execute(f"PRAGMA table_info({table})")]
+            names = ", ".join(name for name, _ in columns)
+            for batch in self._batches(conn, table, cutoff):
+                by_month: Dict[str, List[int]] = {}
+                for row in batch:
+                    by_month.setdefault(row['month'], []).append(row['id'])
+
+                for month, ids in by_month.items():
+                    placeholders = ", ".join("?" * len(ids))
+                    if self.fmt == 'sqlite' and attached != month:
+                        if attached is not None:
+                            conn.execute("DETACH DATABASE archive")
+                        conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path(table, month),))
+                        attached = month
+                        self._ensure_archive_table(conn, table, columns)
+
+                    conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        if self.fmt == 'sqlite':
+                            conn.execute(f"""
+                                INSERT OR IGNORE INTO archive.{table} ({names})
+                                SELECT {names} FROM main.{table} WHERE id IN ({placeholders})
+                            """, ids)
+                        else:
+                            rows = conn.execute(
+                                f"SELECT {names} FROM {table} WHERE id IN ({placeholders}) ORDER BY id", ids)
+                            # One gzip member per batch; readers see a single stream
+                            with gzip.open(self.archive_path(table, month), 'at', encoding='utf-8') as f:
+                                for row in rows:
+                                    f.write(json.dumps(dict(row), ensure_ascii=False, default=str))
+                                    f.write("\n")
+                        conn.execute(f"DELETE FROM main.{table} WHERE id IN ({placeholders})", ids)
+                        conn.execute("COMMIT")
+                    except Exception:
+                        conn.execute("ROLLBACK")
+                        raise
+                    moved[month] = moved.get(month, 0) + len(ids)
+                    if progress is not None:
+                        progress(len(ids))
+        finally:
+            if attached is not None:
+                conn.execute("DETACH DATABASE archive")
+            conn.close()
+
+        if moved:
+            logger.info("Archived %d %s rows (%s)", sum(moved.values()), table,
+                        ", ".join(f"{month}: {count}" for month, count in sorted(moved.items())))
+        return moved
+
+    def incremental_vacuum(self, pages: Optional[int] = None) -> Dict:
+        """Release up to `pages` free pages to the filesystem (needs auto_vacuum=INCREMENTAL)"""
+        conn = self._open()
+        try:
+            mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if mode != 2:
+                return {'auto_vacuum': mode, 'free_pages': free_before, 'released': 0}
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages or self.vacuum_pages)})").fetchall()
+            free_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            return {'auto_vacuum': mode, 'free_pages': free_after, 'released': free_before - free_after}
+        finally:
+            conn.close()
+
+    def enable_auto_vacuum(self):
+        """Switch an existing database to auto_vacuum=INCREMENTAL (full VACUUM, blocks writers)"""
+        conn = self._open()
+        try:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    def run(self, messages_days: int = RETENTION_MESSAGES_DAYS,
+            sessions_days: int = RETENTION_SESSIONS_DAYS,
+            progress: Optional[Callable[[int], None]] = None) -> Dict:
+        """Archive messages and sessions past their horizons, then reclaim space"""
+        result = {
+            'messages': self.archive_table('messages', messages_days, progress),
+            'user_sessions': self.archive_table('user_sessions', sessions_days, progress),
+        }
+        result['vacuum'] = self.incremental_vacuum()
+        if result['vacuum']['auto_vacuum'] != 2 and result['vacuum']['free_pages']:
+            logger.info("%d free pages kept in the file; run `python retention.py --vacuum` "
+                        "once to enable incremental vacuum", result['vacuum']['free_pages'])
+        return result
+
+    def status(self) -> Dict:
+        """Return the state of the current or last background run"""
+        with self._lock:
+            return dict(self._job)
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start_run(self, messages_days: int = RETENTION_MESSAGES_DAYS,
+                  sessions_days: int = RETENTION_SESSIONS_DAYS) -> Dict:
+        """Start run() on a background thread (no-op if one is running)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return dict(self._job)
+            self._job = {
+                'state': 'running',
+                'progress': 0.0,
+                'rows_total': None,
+                'rows_done': 0,
+                'started_at': time.time(),
+                'finished_at': None,
+                'result': None,
+                'error': None,
+            }
+            self._thread = threading.Thread(target=self._run, args=(messages_days, sessions_days),
+                                            name="db-retention", daemon=True)
+            self._thread.start()
+            return dict(self._job)
+
+    def _progress(self, rows: int):
+        with self._lock:
+            self._job['rows_done'] += rows
+            total = self._job['rows_total']
+            self._job['progress'] = min(self._job['rows_done'] / total, 1.0) if total else 1.0
+
+    def _run(self, messages_days: int, sessions_days: int):
+        try:
+            total = (sum(self.pending('messages', messages_days).values())
+                     + sum(self.pending('user_sessions', sessions_days).values()))
+            with self._lock:
+                self._job['rows_total'] = total
+            result = self.run(messages_days, sessions_days, progress=self._progress)
+        except Exception as e:
+            logger.exception("Archiving failed")
+            with self._lock:
+                self._job.update(state='failed', error=str(e), finished_at=time.time())
+            return
+        with self._lock:
+            self._job.update(state='done', progress=1.0, result=result, finished_at=time.time())
+
+    def list_archives(self) -> List[str]:
+        """Monthly SQLite archives, oldest first"""
+        paths = glob.glob(os.path.join(self.archive_dir, "editalbot_archive_*.db"))
+        return sorted(path for path in paths if ARCHIVE_NAME_RE.match(os.path.basename(path)))
+
+    def query_archives(self, sql: str, params=(), since_month: str = None,
+                       until_month: str = None) -> Iterator[Dict]:
+        """Run a read-only query against every monthly archive; rows get an 'archive' key"""
+        for path in self.list_archives():
+            month = ARCHIVE_NAME_RE.match(os.path.basename(path)).group(1)
+            if (since_month and month < since_month) or (until_month and month > until_month):
+                continue
+            conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+            conn.row_factory = sqlite3.Row
+            try:
+                for row in conn.execute(sql, params):
+                    yield {'archive': month, **dict(row)}
+            except sqlite3.OperationalError as e:
+                # A month that only archived sessions has no messages table (and
+                # vice versa); any other error is a real problem with the query
+                if 'no such table' not in str(e):
+                    raise
+                logger.debug("Skipping %s: %s", path, e)
+            finally:
+                conn.close()
+
+
+# Global retention service
+retention_service = RetentionService(db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retenção e arquivamento de dados do EditalBot")
+    parser.add_argument('command', nargs='?', choices=['run', 'query'], default='run')
+    parser.add_argument('sql', nargs='?', help="consulta SQL executada em cada arquivo mensal (query)")
+    parser.add_argument('--messages-days', type=int, default=RETENTION_MESSAGES_DAYS)
+    parser.add_argument('--sessions-days', type=int, default=RETENTION_SESSIONS_DAYS)
+    parser.add_argument('--format', choices=['sqlite', 'jsonl'], default=ARCHIVE_FORMAT)
+    parser.add_argument('--dry-run', action='store_true', help="apenas mostrar o que seria arquivado")
+    parser.add_argument('--vacuum', action='store_true',
+                        help="VACUUM completo ativando auto_vacuum incremental (bloqueia escritas)")
+    args = parser.parse_args()
+    if db.backend != 'sqlite':
+        parser.error("o arquivamento exige DATABASE_BACKEND=sqlite")
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    service = RetentionService(db, fmt=args.format)
+
+    if args.command == 'query':
+        if not args.sql:
+            parser.error("query precisa de uma consulta SQL")
+        for row in service.query_archives(args.sql):
+            print(json.dumps(row, ensure_ascii=False, default=str))
+        return
+
+    if args.vacuum:
+        service.enable_auto_vacuum()
+        print("auto_vacuum incremental ativado")
+        return
+
+    if args.dry_run:
+        for table, days in (('messages', args.messages_days), ('user_sessions', args.sessions_days)):
+            for month, count in service.pending(table, days).items():
+                print(f"{table} {month}: {count} linhas")
+        return
+
+    result = service.run(args.messages_days, args.sessions_days)
+    for table in ARCHIVE_TABLES:
+        print(f"{table}: {sum(result[table].values())} linhas arquivadas")
+    print(f"Páginas liberadas: {result['vacuum']['released']}")
+
+
+if __name__ == "__main__":
+    main()
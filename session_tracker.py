@@ -0,0 +1,163 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+SESSION_IDLE_MINUTES = int(os.getenv("SESSION_IDLE_MINUTES", "30"))
+
+
+def _utc_timestamp(seconds: float) -> str:
+    """Format like SQLite's CURRENT_TIMESTAMP"""
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class SessionTracker:
+    """Heartbeat and idle-session sweeper for user_sessions.
+
+    ``touch`` only records the time of the latest activity of a session in
+    memory. A background thread writes the pending heartbeats in one batch
+    every ``flush_interval`` seconds and, every ``sweep_interval`` seconds,
+    closes the sessions idle for more than ``idle_minutes`` with a single
+    UPDATE that sets ``session_end`` to their last activity. Reruns therefore
+    cost no database writes, and abandoned tabs still get an accurate end.
+    A heartbeat whose session is already closed in the database (by this
+    sweeper, another replica's or before a restart) is reported back by the
+    flush, and the next ``touch`` returns False so the tab starts a new
+    session. Closed session ids are remembered for ``closed_ttl`` seconds;
+    older ones are pruned at each sweep and detected again by the next flush.
+    """
+
+    def __init__(self, database, flush_interval: float = 30.0, sweep_interval: float = 60.0,
+                 idle_minutes: int = SESSION_IDLE_MINUTES, closed_ttl: float = 24 * 3600):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self.idle_minutes = idle_minutes
+        self.closed_ttl = closed_ttl
+        self._pending: Dict[int, float] = {}
+        self._closed: Dict[int, float] = {}  # session id -> time.monotonic() when closed
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._metrics = {
+            'touches': 0,
+            'flushes': 0,
+            'flushed_sessions': 0,
+            'closed_idle': 0,
+            'closed_elsewhere': 0,
+            'errors': 0,
+        }
+
+    def start(self):
+        """Start the background flusher/sweeper thread if it isn't running"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="session-tracker", daemon=True)
+            self._thread.start()
+
+    def touch(self, session_id: int) -> bool:
+        """Record activity; False if this session is known to be closed"""
+        self.start()
+        with self._lock:
+            if session_id in self._closed:
+                return False
+            self._pending[session_id] = time.time()
+            self._metrics['touches'] += 1
+        return True
+
+    def forget(self, session_id: int):
+        """Drop pending activity of a session that is being ended explicitly"""
+        with self._lock:
+            self._pending.pop(session_id, None)
+            self._closed.pop(session_id, None)
+
+    def flush(self):
+        """Write pending heartbeats in one batch"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            closed = self.database.touch_sessions({session_id: _utc_timestamp(seen)
+                                                   for session_id, seen in pending.items()})
+        except Exception:
+            logger.exception("Failed to flush %d session heartbeats", len(pending))
+            with self._lock:
+                self._metrics['errors'] += 1
+                # Keep the newest activity for the next attempt
+                for session_id, seen in pending.items():
+                    if seen > self._pending.get(session_id, 0):
+                        self._pending[session_id] = seen
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._closed.update(dict.fromkeys(closed, now))
+            self._metrics['flushes'] += 1
+            self._metrics['flushed_sessions'] += len(pending)
+            self._metrics['closed_elsewhere'] += len(closed)
+
+    def sweep(self) -> int:
+        """Flush heartbeats, then close idle sessions; return how many were closed"""
+        self.flush()
+        try:
+            closed = self.database.close_idle_sessions(self.idle_minutes)
+        except Exception:
+            logger.exception("Failed to close idle sessions")
+            with self._lock:
+                self._metrics['errors'] += 1
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            expired = [session_id for session_id, closed_at in self._closed.items()
+                       if now - closed_at > self.closed_ttl]
+            for session_id in expired:
+                del self._closed[session_id]
+            self._closed.update(dict.fromkeys(closed, now))
+            self._metrics['closed_idle'] += len(closed)
+        return len(closed)
+
+    def _run(self):
+        next_sweep = time.monotonic()
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if time.monotonic() >= next_sweep:
+                self.sweep()
+                next_sweep = time.monotonic() + self.sweep_interval
+            else:
+                self.flush()
+        self.flush()
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        """Flush pending heartbeats and stop the background thread"""
+        with self._lock:
+            thread = self._thread
+            self._stopping = True
+        self._wakeup.set()
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        else:
+            self.flush()
+
+    def metrics(self) -> Dict:
+        """Return heartbeat and sweeper counters"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['pending'] = len(self._pending)
+            metrics['closed_tracked'] = len(self._closed)
+        return metrics
+
+
+# Global tracker; pending heartbeats are written at interpreter exit
+session_tracker = SessionTracker(db)
+atexit.register(session_tracker.stop)
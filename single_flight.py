@@ -0,0 +1,178 @@
+"""
+Single-flight coalescing of identical in-flight Gemini requests
+
+When many students ask the same question about the same notice at the same
+time, only the first request (the leader) calls the model; the others wait
+for it and receive the same answer. Streams are shared too: every consumer
+replays the chunks received so far and then follows the upstream stream
+live. Whichever consumer is waiting pulls the next chunk, so the stream
+keeps going if the leader leaves, and it is closed once every consumer has
+gone. The return value of the upstream iterator (a generator's ``return``,
+e.g. the token usage of the call) is returned to every consumer.
+
+Only requests that are in flight at the same time are coalesced; finished
+answers are reused by response_cache.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import CancelledError, Future
+from typing import Callable, Dict, Hashable, Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+GEMINI_COALESCE = os.getenv("GEMINI_COALESCE", "true").lower() != "false"
+
+
+class _Flight:
+    """Upstream stream shared by several consumers"""
+
+    __slots__ = ('open_chunks', 'source', 'chunks', 'done', 'result', 'error', 'consumers', 'pull_lock')
+
+    def __init__(self, open_chunks: Callable[[], Iterable]):
+        self.open_chunks = open_chunks
+        self.source = None
+        self.chunks = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self.consumers = 0
+        self.pull_lock = threading.Lock()
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._streams: Dict[Hashable, _Flight] = {}
+        self._metrics = {
+            'calls': 0,
+            'upstream_calls': 0,
+            'saved_calls': 0,
+            'streams': 0,
+            'upstream_streams': 0,
+            'saved_streams': 0,
+        }
+
+    def do(self, key: Hashable, fn: Callable):
+        """Return fn(), sharing the result with concurrent callers of the same key"""
+        with self._lock:
+            self._metrics['calls'] += 1
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    self._calls[key] = future
+                    self._metrics['upstream_calls'] += 1
+
+            if leader:
+                try:
+                    result = fn()
+                except BaseException as e:
+                    if isinstance(e, Exception) and not isinstance(e, CancelledError):
+                        future.set_exception(e)
+                    else:
+                        # Cancelled or the leader's script run stopped: followers retry
+                        future.cancel()
+                    raise
+                else:
+                    future.set_result(result)
+                    return result
+                finally:
+                    with self._lock:
+                        if self._calls.get(key) is future:
+                            del self._calls[key]
+
+            try:
+                result = future.result()
+            except CancelledError:
+                continue  # the leader gave up; run the call again
+            with self._lock:
+                self._metrics['saved_calls'] += 1
+            return result
+
+    def stream(self, key: Hashable, open_chunks: Callable[[], Iterable]) -> Iterator:
+        """Iterate open_chunks(), sharing one upstream stream per key
+
+        ``yield from`` the returned generator evaluates to the upstream
+        iterator's return value, for every consumer.
+        """
+        with self._lock:
+            self._metrics['streams'] += 1
+            flight = self._streams.get(key)
+            if flight is None:
+                flight = _Flight(open_chunks)
+                self._streams[key] = flight
+                self._metrics['upstream_streams'] += 1
+            else:
+                self._metrics['saved_streams'] += 1
+            flight.consumers += 1
+        return self._consume(key, flight)
+
+    def _consume(self, key: Hashable, flight: _Flight) -> Iterator:
+        index = 0
+        try:
+            while True:
+                if index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                    continue
+                with flight.pull_lock:
+                    if index < len(flight.chunks):
+                        continue  # another consumer pulled it meanwhile
+                    if flight.error is not None:
+                        raise flight.error
+                    if flight.done:
+                        return flight.result
+                    try:
+                        if flight.source is None:
+                            flight.source = iter(flight.open_chunks())
+                        chunk = next(flight.source)
+                    except StopIteration as stop:
+                        flight.result = stop.value
+                        flight.done = True
+                        self._finish(key, flight)
+                        return flight.result
+                    except Exception as e:
+                        flight.error = e
+                        flight.done = True
+                        self._finish(key, flight)
+                        raise
+                    flight.chunks.append(chunk)
+        finally:
+            self._leave(key, flight)
+
+    def _finish(self, key: Hashable, flight: _Flight):
+        """Stop routing new consumers to a finished flight"""
+        with self._lock:
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+
+    def _leave(self, key: Hashable, flight: _Flight):
+        with self._lock:
+            flight.consumers -= 1
+            abandoned = not flight.consumers and not flight.done
+            if abandoned and self._streams.get(key) is flight:
+                del self._streams[key]
+        if abandoned and flight.source is not None:
+            # Nobody is reading any more: close (and cancel) the upstream call
+            close = getattr(flight.source, 'close', None)
+            if close is not None:
+                close()
+
+    def metrics(self) -> Dict:
+        """Return call counters, including how many upstream calls were saved"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['in_flight_calls'] = len(self._calls)
+            metrics['in_flight_streams'] = len(self._streams)
+        return metrics
+
+
+# Global coalescer for Gemini requests
+request_coalescer = SingleFlight()
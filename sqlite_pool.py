@@ -0,0 +1,99 @@
+"""
+SQLite connection pool shared by the app database and the notice index
+
+Kept apart from database.py so components with their own SQLite file (the
+notice index) can use it without building the global ``db``.
+"""
+
+import sqlite3
+import threading
+from typing import Dict
+
+
+class ConnectionPool:
+    """Thread-aware SQLite connection pool.
+
+    Each thread (one per Streamlit script run) gets its own long-lived
+    connection. Connections owned by threads that have finished are handed
+    back to an idle list and reused by the next thread that asks for one,
+    so connection setup and pragma configuration happen once per connection
+    instead of once per query.
+    """
+
+    def __init__(self, db_path: str, max_idle: int = 8, busy_timeout_ms: int = 5000,
+                 cache_size_kb: int = 16000):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Keyed by the Thread object rather than its ident: idents are reused
+        # once a thread exits, which would overwrite (and leak) the old entry
+        self._in_use: Dict[threading.Thread, sqlite3.Connection] = {}
+        self._idle = []
+
+    def _open(self) -> sqlite3.Connection:
+        """Open a new connection with the pool pragmas applied"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        # Only takes effect on a new, empty file (before WAL mode is set); lets
+        # retention.py return pages freed by archiving with incremental_vacuum
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL lets readers proceed while a writer commits
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        # NORMAL is durable in WAL mode except on power loss, and avoids an fsync per commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _reclaim(self):
+        """Move connections of finished threads back to the idle list (lock held)"""
+        for thread, conn in list(self._in_use.items()):
+            if thread.is_alive():
+                continue
+            del self._in_use[thread]
+            if conn.in_transaction:
+                conn.rollback()
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+            else:
+                conn.close()
+
+    def connection(self) -> sqlite3.Connection:
+        """Return the connection bound to the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+
+        with self._lock:
+            self._reclaim()
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._open()
+            self._in_use[threading.current_thread()] = conn
+
+        self._local.conn = conn
+        return conn
+
+    def stats(self) -> Dict:
+        """Return pool occupancy counters"""
+        with self._lock:
+            return {'in_use': len(self._in_use), 'idle': len(self._idle)}
+
+    def close_all(self):
+        """Close every pooled connection"""
+        with self._lock:
+            for conn in self._in_use.values():
+                conn.close()
+            for conn in self._idle:
+                conn.close()
+            self._in_use.clear()
+            self._idle.clear()
+            self._local = threading.local()
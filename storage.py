@@ -0,0 +1,259 @@
+"""
+Storage interface of EditalBot
+
+Every component talks to the database through the ``Storage`` methods
+(``db`` in database.py), so the backend can be swapped with DATABASE_BACKEND:
+
+- ``sqlite`` (default): ``database.Database``, a local editalbot.db file.
+  Simple and fast, but only one app server can use it.
+- ``postgres``: ``database_postgres.PostgresDatabase``, for several Streamlit
+  replicas behind a load balancer.
+
+Both backends return rows as plain dicts and take timestamps as
+'YYYY-MM-DD HH:MM:SS' UTC strings or datetimes.
+"""
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+def sql_timestamp(value):
+    """Format a datetime/date filter like CURRENT_TIMESTAMP; strings pass through"""
+    return value.strftime("%Y-%m-%d %H:%M:%S") if hasattr(value, 'strftime') else value
+
+
+class Storage(ABC):
+    # Backend name ('sqlite' or 'postgres'); file-level tools (backups, archives) need 'sqlite'
+    backend = None
+
+    # Exceptions worth retrying (locked/busy database, dropped connection)
+    transient_errors: Tuple[type, ...] = ()
+
+    # Seconds a user row fetched at login stays in the in-process cache,
+    # and how many users it holds (least recently used are dropped first)
+    USER_CACHE_TTL = 300
+    USER_CACHE_MAX_ENTRIES = 1000
+
+    # Tables that can be exported, with the column used for date filters
+    EXPORT_TABLES = {
+        'messages': 'timestamp',
+        'users': 'first_login',
+        'user_sessions': 'session_start',
+    }
+
+    MESSAGE_USAGE_FIELDS = ('prompt_tokens', 'response_tokens', 'model_latency_ms', 'model_name')
+
+    def __init__(self):
+        self._user_cache: 'OrderedDict[str, Tuple[float, Dict]]' = OrderedDict()
+        self._user_cache_lock = threading.Lock()
+
+    # Connections
+
+    @abstractmethod
+    def close(self):
+        """Close all pooled connections"""
+
+    @abstractmethod
+    def pool_stats(self) -> Dict:
+        """Return connection pool occupancy counters"""
+
+    # Users and sessions
+
+    @abstractmethod
+    def get_or_create_user(self, email: str, name: str, profile_picture_url: str = None) -> Dict:
+        """Create the user or record a new access, in a single UPSERT"""
+
+    def _remember_user(self, email: str, user: Optional[Dict]) -> Optional[Dict]:
+        if user:
+            with self._user_cache_lock:
+                self._user_cache[email] = (time.monotonic(), user)
+                self._user_cache.move_to_end(email)
+                while len(self._user_cache) > self.USER_CACHE_MAX_ENTRIES:
+                    self._user_cache.popitem(last=False)
+        return user
+
+    def get_cached_user(self, email: str, max_age: float = None) -> Optional[Dict]:
+        """Return the user row cached by a recent get_or_create_user, if still fresh
+
+        For read paths only: logins must go through get_or_create_user so the
+        access is recorded.
+        """
+        max_age = self.USER_CACHE_TTL if max_age is None else max_age
+        with self._user_cache_lock:
+            entry = self._user_cache.get(email)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > max_age:
+                del self._user_cache[email]
+                return None
+            self._user_cache.move_to_end(email)
+            return dict(entry[1])
+
+    @abstractmethod
+    def create_session(self, user_id: int, ip_address: str = None, user_agent: str = None) -> int:
+        """Create a new user session"""
+
+    @abstractmethod
+    def end_session(self, session_id: int):
+        """End a user session"""
+
+    @abstractmethod
+    def touch_sessions(self, activity: Dict[int, str]) -> List[int]:
+        """Record the last activity ('YYYY-MM-DD HH:MM:SS' UTC) of open sessions in one batch;
+        return the ids that are closed or gone"""
+
+    @abstractmethod
+    def close_idle_sessions(self, idle_minutes: int = 30) -> List[int]:
+        """End every open session idle for idle_minutes, at its last activity; return their ids"""
+
+    @abstractmethod
+    def cleanup_old_sessions(self, days: int = 30, batch_size: int = 1000) -> int:
+        """Delete sessions older than N days in small transactions; return how many were removed"""
+
+    # Messages
+
+    @abstractmethod
+    def save_message(self, user_id: int, user_message: str, bot_response: str, notice_context: str = None,
+                     prompt_tokens: int = None, response_tokens: int = None,
+                     model_latency_ms: float = None, model_name: str = None):
+        """Save a message conversation with its token usage"""
+
+    @abstractmethod
+    def save_messages(self, messages: List[Dict]):
+        """Save a batch of message conversations in a single transaction"""
+
+    @abstractmethod
+    def get_user_messages(self, user_id: int, limit: int = 50) -> List[Dict]:
+        """Get messages for a specific user"""
+
+    @abstractmethod
+    def get_all_users(self, limit: int = 100) -> List[Dict]:
+        """Get all users with pagination"""
+
+    @abstractmethod
+    def get_users_page(self, cursor: Optional[Tuple] = None,
+                       page_size: int = 50) -> Tuple[List[Dict], Optional[Tuple]]:
+        """Get a page of active users, most recent access first (keyset on last_access, id)"""
+
+    @abstractmethod
+    def get_messages_page(self, cursor: Optional[Tuple] = None, page_size: int = 50,
+                          user_id: int = None) -> Tuple[List[Dict], Optional[Tuple]]:
+        """Get a page of messages with user name and email, newest first (keyset on timestamp, id)"""
+
+    def iter_messages(self, page_size: int = 100, user_id: int = None) -> Iterator[List[Dict]]:
+        """Lazily yield pages of messages, newest first, with constant memory"""
+        cursor = None
+        while True:
+            rows, cursor = self.get_messages_page(cursor, page_size, user_id)
+            if rows:
+                yield rows
+            if cursor is None:
+                return
+
+    def iter_users(self, page_size: int = 100) -> Iterator[List[Dict]]:
+        """Lazily yield pages of active users, most recent access first"""
+        cursor = None
+        while True:
+            rows, cursor = self.get_users_page(cursor, page_size)
+            if rows:
+                yield rows
+            if cursor is None:
+                return
+
+    @abstractmethod
+    def search_messages(self, query: str, notice: str = None, since=None,
+                        limit: int = 20) -> List[Dict]:
+        """Full-text search over questions and answers, best matches (lowest rank) first"""
+
+    # Export
+
+    @abstractmethod
+    def get_table_columns(self, table: str) -> List[Tuple[str, str]]:
+        """Get (name, declared type) of the columns of an exportable table"""
+
+    @abstractmethod
+    def iter_export_rows(self, table: str, since=None, until=None, notice: str = None,
+                         chunk_size: int = 5000) -> Iterator[List[Dict]]:
+        """Yield rows of a table in id order, chunk_size rows at a time"""
+
+    # Analytics (read from the usage rollups)
+
+    @abstractmethod
+    def data_version(self) -> Tuple:
+        """Cheap marker that changes with every new message, session or login (a cache key)"""
+
+    @abstractmethod
+    def get_user_stats(self) -> Dict:
+        """Get general user statistics"""
+
+    @abstractmethod
+    def get_notice_usage(self, days: int = None) -> List[Dict]:
+        """Get statistics about notice usage (optionally for the last N days)"""
+
+    @abstractmethod
+    def get_activity_buckets(self, days: int = 7, bucket: str = 'day') -> List[Dict]:
+        """Get messages and active users per time bucket ('hour', 'day', 'week' or 'month')"""
+
+    @abstractmethod
+    def get_daily_usage(self, days: int = 30) -> List[Dict]:
+        """Get messages, sessions and active users per day for the last N days"""
+
+    @abstractmethod
+    def get_domain_usage(self, days: int = 30) -> List[Dict]:
+        """Get messages per day and user domain for the last N days"""
+
+    @abstractmethod
+    def get_token_usage(self, days: int = 30, group_by: str = 'day') -> List[Dict]:
+        """Get messages, prompt/response tokens and model latency per day, notice or user"""
+
+    @abstractmethod
+    def get_user_tokens_today(self, user_id: int) -> int:
+        """Get the tokens (prompt + response) a user spent today"""
+
+    # Response cache (response_cache.py)
+
+    @abstractmethod
+    def get_cached_response(self, notice: str, question_key: str, min_created: float) -> Optional[Dict]:
+        """Fresh cache entry (id, response) for an exact key, or None"""
+
+    @abstractmethod
+    def get_cache_candidates(self, notice: str, min_created: float, limit: int) -> List[Dict]:
+        """Fresh entries of a notice with an embedding (id, response, embedding), most recently hit first"""
+
+    @abstractmethod
+    def record_cache_hit(self, entry_id: int, now: float):
+        """Bump the hit count and last hit time of a cache entry"""
+
+    @abstractmethod
+    def put_cached_response(self, notice: str, question_key: str, question: str, response: str,
+                            embedding: Optional[bytes], now: float):
+        """Store an answer, replacing any previous one for the same key"""
+
+    @abstractmethod
+    def evict_cached_responses(self, min_created: float, max_entries: int) -> int:
+        """Drop entries created before min_created and all but the max_entries most recently hit"""
+
+    @abstractmethod
+    def clear_cached_responses(self, notice: str = None):
+        """Remove every cache entry, or only those of one notice"""
+
+    @abstractmethod
+    def count_cached_responses(self) -> int:
+        """Number of stored cache entries"""
+
+    # OAuth states (oauth_state.DatabaseStateStore)
+
+    @abstractmethod
+    def put_oauth_state(self, state: str, expires_at: float, purge_before: float = None):
+        """Register a state; also purge states expired before purge_before when given"""
+
+    @abstractmethod
+    def consume_oauth_state(self, state: str, now: float) -> bool:
+        """Delete the state and return True if it existed and had not expired"""
+
+    @abstractmethod
+    def purge_oauth_states(self, now: float) -> int:
+        """Drop expired states; return how many were removed"""
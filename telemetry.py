@@ -0,0 +1,230 @@
+"""
+Per-stage latency instrumentation for EditalBot
+
+Stages (OAuth, SQLite, Gemini, rendering) are timed with ``telemetry.stage``
+or the ``telemetry.timed`` decorator and recorded in fixed-bucket histograms.
+A ``telemetry.trace`` wraps one user-visible request (a login, a chat turn),
+collects the stages run inside it and logs the breakdown when the request
+is slower than SLOW_REQUEST_SECONDS.
+
+Metrics are exported in the Prometheus text format, together with gauges
+registered by other components (message writer, Gemini scheduler, cache...).
+Set METRICS_PORT to serve them over HTTP at ``/metrics``.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "5"))
+METRICS_PORT = os.getenv("METRICS_PORT")
+
+# Upper bounds in seconds, Prometheus-style (an implicit +Inf bucket follows)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_NAME_RE = re.compile(r"[^a-zA-Z0-9_]")
+
+
+class Histogram:
+    """Cumulative bucket counts plus a window of recent samples for percentiles"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, window: int = 2048):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def summary(self) -> Dict:
+        samples = sorted(self.samples)
+
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))] if samples else 0.0
+
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': percentile(0.50),
+            'p95': percentile(0.95),
+            'p99': percentile(0.99),
+            'max': samples[-1] if samples else 0.0,
+        }
+
+
+class Telemetry:
+    def __init__(self, slow_request_seconds: float = SLOW_REQUEST_SECONDS):
+        self.slow_request_seconds = slow_request_seconds
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Histogram] = {}
+        self._requests: Dict[str, Histogram] = {}
+        self._gauges: Dict[str, Callable[[], Dict]] = {}
+        self._local = threading.local()
+        self._server = None
+
+    def _observe(self, family: Dict[str, Histogram], name: str, seconds: float):
+        with self._lock:
+            histogram = family.get(name)
+            if histogram is None:
+                histogram = family[name] = Histogram()
+            histogram.observe(seconds)
+
+    def observe(self, stage: str, seconds: float):
+        """Record a stage duration (and attach it to the current request trace)"""
+        self._observe(self._stages, stage, seconds)
+        spans = getattr(self._local, 'spans', None)
+        if spans is not None:
+            spans.append((stage, seconds))
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as one stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def timed(self, name: str):
+        """Decorator timing every call of a function as a stage"""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def trace(self, name: str, **context):
+        """Time a whole request; log its stage breakdown when it is slow"""
+        parent = getattr(self._local, 'spans', None)
+        spans = self._local.spans = []
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._local.spans = parent
+            self._observe(self._requests, name, elapsed)
+            if elapsed >= self.slow_request_seconds:
+                breakdown = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in spans)
+                extra = " ".join(f"{key}={value}" for key, value in context.items())
+                logger.warning("Slow request %s: %.0fms [%s] %s",
+                               name, elapsed * 1000, breakdown or "no stages", extra)
+
+    def register_gauges(self, component: str, fn: Callable[[], Dict]):
+        """Export the numeric values of fn() as editalbot_<component>_<key> gauges"""
+        with self._lock:
+            self._gauges[component] = fn
+
+    def stage_stats(self) -> Dict[str, Dict]:
+        """Return count, sum and p50/p95/p99/max per stage (seconds)"""
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in self._stages.items()}
+
+    def request_stats(self) -> Dict[str, Dict]:
+        """Return count, sum and p50/p95/p99/max per request type (seconds)"""
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in self._requests.items()}
+
+    def gauges(self) -> Dict[str, Dict]:
+        """Collect the values of every registered gauge source"""
+        with self._lock:
+            sources = dict(self._gauges)
+        values = {}
+        for component, fn in sources.items():
+            try:
+                values[component] = {key: value for key, value in fn().items()
+                                     if isinstance(value, (int, float))}
+            except Exception:
+                logger.exception("Gauge source %s failed", component)
+        return values
+
+    def render_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            families = (
+                ('editalbot_stage_seconds', 'stage', "Latency of request stages",
+                 {name: (h.buckets, list(h.counts), h.sum, h.count) for name, h in self._stages.items()}),
+                ('editalbot_request_seconds', 'request', "Latency of whole requests",
+                 {name: (h.buckets, list(h.counts), h.sum, h.count) for name, h in self._requests.items()}),
+            )
+        for metric, label, help_text, histograms in families:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for name, (buckets, counts, total, count) in sorted(histograms.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float('inf') else repr(bound)
+                    lines.append(f'{metric}_bucket{{{label}="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {total}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {count}')
+
+        for component, values in sorted(self.gauges().items()):
+            for key, value in sorted(values.items()):
+                metric = _NAME_RE.sub("_", f"editalbot_{component}_{key}")
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port: int, addr: str = "0.0.0.0"):
+        """Serve /metrics on a daemon thread (once per process)"""
+        with self._lock:
+            if self._server is not None:
+                return self._server
+            telemetry = self
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] != '/metrics':
+                        self.send_error(404)
+                        return
+                    body = telemetry.render_prometheus().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer((addr, port), MetricsHandler)
+            threading.Thread(target=self._server.serve_forever, name="metrics-http",
+                             daemon=True).start()
+            logger.info("Serving metrics on %s:%d/metrics", addr, port)
+            return self._server
+
+
+# Global telemetry registry
+telemetry = Telemetry()
+
+
+def start_metrics_server(port: Optional[str] = METRICS_PORT):
+    """Start the /metrics endpoint when METRICS_PORT is set"""
+    if not port:
+        return None
+    try:
+        return telemetry.start_http_server(int(port))
+    except OSError as e:
+        # Another process (or Streamlit worker) already owns the port
+        logger.warning("Metrics endpoint not started on port %s: %s", port, e)
+        return None
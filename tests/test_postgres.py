@@ -0,0 +1,109 @@
+"""
+Smoke test of the PostgreSQL backend
+
+Runs the migrations and a save / page / search / export round trip against
+a throwaway database created next to the one POSTGRES_TEST_URL points at
+(the user needs CREATEDB). Skipped when POSTGRES_TEST_URL is unset:
+
+    docker run -d --name editalbot-pg-test -e POSTGRES_HOST_AUTH_METHOD=trust \\
+        -p 5433:5432 postgres:16
+    POSTGRES_TEST_URL=postgresql://postgres@localhost:5433/postgres python -m pytest tests
+"""
+
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+POSTGRES_TEST_URL = os.getenv("POSTGRES_TEST_URL")
+
+pytestmark = pytest.mark.skipif(not POSTGRES_TEST_URL, reason="POSTGRES_TEST_URL is not set")
+
+
+@pytest.fixture(scope="module")
+def conninfo():
+    psycopg = pytest.importorskip("psycopg")
+    name = f"editalbot_test_{uuid.uuid4().hex[:8]}"
+    with psycopg.connect(POSTGRES_TEST_URL, autocommit=True) as admin:
+        admin.execute(f"CREATE DATABASE {name}")
+    try:
+        yield psycopg.conninfo.make_conninfo(POSTGRES_TEST_URL, dbname=name)
+    finally:
+        with psycopg.connect(POSTGRES_TEST_URL, autocommit=True) as admin:
+            admin.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+
+
+@pytest.fixture(scope="module")
+def pg(conninfo):
+    from database_postgres import PostgresDatabase
+    database = PostgresDatabase(conninfo, min_size=1, max_size=4)
+    yield database
+    database.close()
+
+
+def test_migrations(pg, conninfo):
+    from migrations import POSTGRES_LATEST_VERSION
+    with pg._connect() as conn:
+        row = conn.execute("SELECT MAX(version) AS version, COUNT(*) AS applied FROM schema_version").fetchone()
+    assert row == {'version': POSTGRES_LATEST_VERSION, 'applied': POSTGRES_LATEST_VERSION}
+
+    # A second replica starting on the migrated database changes nothing
+    pg.init_database()
+    with pg._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) AS n FROM schema_version").fetchone()['n'] == POSTGRES_LATEST_VERSION
+
+
+def test_round_trip(pg):
+    version = pg.data_version()
+    user = pg.get_or_create_user("aluno@edu.unirio.br", "Aluno")
+    again = pg.get_or_create_user("aluno@edu.unirio.br", "Aluno Silva", "https://example.com/a.png")
+    assert again['id'] == user['id']
+    assert again['access_count'] == user['access_count'] + 1
+    assert again['name'] == "Aluno Silva"
+
+    session_id = pg.create_session(user['id'], "127.0.0.1", "pytest")
+    assert pg.touch_sessions({session_id: "2030-01-01 00:00:00"}) == []
+    pg.end_session(session_id)
+    # A heartbeat of a closed (or unknown) session is reported back
+    assert pg.touch_sessions({session_id: "2030-01-01 00:00:00", -1: "2030-01-01 00:00:00"}) == [session_id, -1]
+
+    pg.save_message(user['id'], "Qual o prazo de inscrição?", "Até 30 de maio.", "Edital 001/2025",
+                    prompt_tokens=12, response_tokens=8, model_latency_ms=120.0, model_name="fake")
+    pg.save_messages([
+        {'user_id': user['id'], 'user_message': f"Pergunta {i} sobre a taxa", 'bot_response': f"Resposta {i}",
+         'notice_context': "Edital 002/2025"}
+        for i in range(25)
+    ])
+
+    # Keyset pages cover every message exactly once, newest first
+    seen, cursor = [], None
+    while True:
+        rows, cursor = pg.get_messages_page(cursor, page_size=10)
+        seen.extend(row['id'] for row in rows)
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen)) == 26
+    assert seen == sorted(seen, reverse=True)
+
+    results = pg.search_messages("inscrição")
+    assert [row['notice_context'] for row in results] == ["Edital 001/2025"]
+    assert "**" in results[0]['question_snippet']
+    assert len(pg.search_messages("taxa", notice="Edital 002/2025", limit=5)) == 5
+
+    columns = [name for name, _ in pg.get_table_columns('messages')]
+    assert 'search' not in columns
+    exported = [row for chunk in pg.iter_export_rows('messages', chunk_size=7) for row in chunk]
+    assert [row['id'] for row in exported] == sorted(seen)
+    assert set(exported[0]) == set(columns)
+    assert len([row for chunk in pg.iter_export_rows('messages', notice="Edital 001/2025")
+                for row in chunk]) == 1
+
+    # Rollups maintained by the triggers
+    stats = pg.get_user_stats()
+    assert stats['total_messages'] == 26
+    assert stats['domain_stats'] == {'edu.unirio.br': 1}
+    assert pg.get_user_tokens_today(user['id']) == 20
+    assert pg.data_version() != version